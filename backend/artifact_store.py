@@ -0,0 +1,202 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+
+ARTIFACT_DIR = os.getenv('ARTIFACT_DIR', 'artifacts')
+
+
+class ArtifactStore:
+    """
+    Versioned store of transcription and translation results.
+
+    Each artifact is keyed by audio hash, transcription model and language,
+    and every re-transcription adds a new version. The raw transcript and
+    timestamped segments live in files under
+    artifacts/<audio_hash>/<model>__<language>/v<N>/, while sentences and
+    their translations are indexed in SQLite so a large archive can be
+    searched and replayed without reading every file.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or ARTIFACT_DIR
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.root, 'index.sqlite3'), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS artifacts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                audio_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                language TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                path TEXT NOT NULL,
+                sentence_count INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (audio_hash, model, language, version)
+            );
+            CREATE TABLE IF NOT EXISTS sentences (
+                artifact_id INTEGER NOT NULL,
+                idx INTEGER NOT NULL,
+                sanskrit TEXT NOT NULL,
+                english TEXT,
+                start REAL,
+                end REAL,
+                PRIMARY KEY (artifact_id, idx)
+            );
+        """)
+        self.full_text_search = self._create_search_index()
+        self._db.commit()
+
+    def _create_search_index(self):
+        """Use FTS5 for search when SQLite was built with it, LIKE otherwise"""
+        try:
+            self._db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS sentences_fts USING fts5("
+                "sanskrit, english, artifact_id UNINDEXED, idx UNINDEXED)"
+            )
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    @staticmethod
+    def _slug(value):
+        return re.sub(r'[^A-Za-z0-9_.-]+', '-', value)
+
+    def save_transcript(self, audio_hash, model, language, text, segments=None):
+        """Store a new transcript version and return its artifact id"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MAX(version) FROM artifacts WHERE audio_hash = ? AND model = ? AND language = ?",
+                (audio_hash, model, language)
+            ).fetchone()
+            version = (row[0] or 0) + 1
+            path = os.path.join(self.root, audio_hash, f"{self._slug(model)}__{self._slug(language)}", f"v{version}")
+            os.makedirs(path, exist_ok=True)
+
+            with open(os.path.join(path, 'transcript.txt'), 'w', encoding='utf-8') as f:
+                f.write(text)
+            with open(os.path.join(path, 'segments.json'), 'w', encoding='utf-8') as f:
+                json.dump(segments or [], f, ensure_ascii=False)
+
+            cursor = self._db.execute(
+                "INSERT INTO artifacts (audio_hash, model, language, version, created_at, path) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (audio_hash, model, language, version, time.time(), path)
+            )
+            self._db.commit()
+            return cursor.lastrowid
+
+    def save_sentences(self, artifact_id, sentences):
+        """
+        Store the sentence split and translations for an artifact.
+
+        sentences is a list of dicts with 'sanskrit' and optional 'english',
+        'start' and 'end'; any previous split for the artifact is replaced.
+        """
+        rows = [
+            (artifact_id, i, s['sanskrit'], s.get('english'), s.get('start'), s.get('end'))
+            for i, s in enumerate(sentences)
+        ]
+        with self._lock:
+            self._db.execute("DELETE FROM sentences WHERE artifact_id = ?", (artifact_id,))
+            self._db.executemany(
+                "INSERT INTO sentences (artifact_id, idx, sanskrit, english, start, end) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            if self.full_text_search:
+                self._db.execute("DELETE FROM sentences_fts WHERE artifact_id = ?", (artifact_id,))
+                self._db.executemany(
+                    "INSERT INTO sentences_fts (sanskrit, english, artifact_id, idx) VALUES (?, ?, ?, ?)",
+                    [(r[2], r[3] or '', r[0], r[1]) for r in rows]
+                )
+            self._db.execute(
+                "UPDATE artifacts SET sentence_count = ? WHERE id = ?", (len(rows), artifact_id)
+            )
+            self._db.commit()
+
+    def latest(self, audio_hash, model, language):
+        """Return the newest artifact row for the key as a dict, or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM artifacts WHERE audio_hash = ? AND model = ? AND language = ? "
+                "ORDER BY version DESC LIMIT 1",
+                (audio_hash, model, language)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def get_transcript(self, audio_hash, model, language):
+        """Return the newest transcript text for the key, or None"""
+        artifact = self.latest(audio_hash, model, language)
+        if artifact is None:
+            return None
+        return self._read_transcript(artifact)
+
+    def load_transcript(self, artifact_id):
+        artifact = self.get(artifact_id)
+        if artifact is None:
+            return None
+        return self._read_transcript(artifact)
+
+    def _read_transcript(self, artifact):
+        try:
+            with open(os.path.join(artifact['path'], 'transcript.txt'), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def get(self, artifact_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM artifacts WHERE id = ?", (artifact_id,)).fetchone()
+        return dict(row) if row else None
+
+    def load_sentences(self, artifact_id):
+        """Stored sentences with translations and timestamps, in order"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT sanskrit, english, start, end FROM sentences WHERE artifact_id = ? ORDER BY idx",
+                (artifact_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def load_segments(self, artifact_id):
+        artifact = self.get(artifact_id)
+        if artifact is None:
+            return []
+        try:
+            with open(os.path.join(artifact['path'], 'segments.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def list_artifacts(self, limit=100, offset=0):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM artifacts ORDER BY created_at DESC LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def search(self, query, limit=50):
+        """Find stored sentences whose text or translation matches query"""
+        with self._lock:
+            if self.full_text_search:
+                try:
+                    rows = self._db.execute(
+                        "SELECT artifact_id, idx, sanskrit, english FROM sentences_fts "
+                        "WHERE sentences_fts MATCH ? LIMIT ?",
+                        # Quote the query so user text is matched as a phrase, not FTS syntax
+                        ('"' + query.replace('"', '""') + '"', limit)
+                    ).fetchall()
+                    return [dict(row) for row in rows]
+                except sqlite3.OperationalError:
+                    pass
+            pattern = f"%{query}%"
+            rows = self._db.execute(
+                "SELECT artifact_id, idx, sanskrit, english FROM sentences "
+                "WHERE sanskrit LIKE ? OR english LIKE ? LIMIT ?",
+                (pattern, pattern, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
@@ -0,0 +1,149 @@
+import io
+import os
+import re
+import wave
+import shutil
+import tempfile
+import subprocess
+from array import array
+
+# Analysis frame used when looking for quiet split points
+SILENCE_FRAME_SECONDS = 0.02
+
+
+class AudioWindow:
+    """One overlapping slice of a longer recording"""
+
+    def __init__(self, index, start_frame, end_frame, read_start_frame, framerate):
+        self.index = index
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        # Audio actually sent starts earlier so words cut at the boundary appear in both windows
+        self.read_start_frame = read_start_frame
+        self.framerate = framerate
+
+    @property
+    def start(self):
+        return self.start_frame / self.framerate
+
+    @property
+    def end(self):
+        return self.end_frame / self.framerate
+
+
+def ensure_wav(audio_file_path):
+    """
+    Return (wav_path, is_temporary) for audio_file_path.
+
+    WAV files are used as-is; anything else is decoded with ffmpeg into a
+    temporary WAV that the caller must delete.
+    """
+    if audio_file_path.lower().endswith('.wav'):
+        return audio_file_path, False
+
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise ValueError("Chunked transcription needs a WAV file or ffmpeg on PATH")
+
+    fd, wav_path = tempfile.mkstemp(suffix='.wav')
+    os.close(fd)
+    subprocess.run(
+        [ffmpeg, '-y', '-loglevel', 'error', '-i', audio_file_path, '-ac', '1', '-ar', '16000', wav_path],
+        check=True
+    )
+    return wav_path, True
+
+
+def _frame_energies(raw, nchannels, samples_per_frame):
+    """Mean absolute amplitude for each analysis frame of 16-bit PCM"""
+    samples = array('h')
+    samples.frombytes(raw[:len(raw) - len(raw) % 2])
+    step = samples_per_frame * nchannels
+    return [
+        sum(abs(s) for s in samples[i:i + step]) / max(1, len(samples[i:i + step]))
+        for i in range(0, len(samples), step)
+    ]
+
+
+def _quietest_frame(wav_file, around_frame, search_frames):
+    """Find the quietest point within search_frames of around_frame"""
+    framerate = wav_file.getframerate()
+    nframes = wav_file.getnframes()
+    if wav_file.getsampwidth() != 2:
+        # Silence search only understands 16-bit PCM; split at the nominal point
+        return around_frame
+
+    lo = max(0, around_frame - search_frames)
+    hi = min(nframes, around_frame + search_frames)
+    wav_file.setpos(lo)
+    raw = wav_file.readframes(hi - lo)
+
+    samples_per_frame = max(1, int(framerate * SILENCE_FRAME_SECONDS))
+    energies = _frame_energies(raw, wav_file.getnchannels(), samples_per_frame)
+    if not energies:
+        return around_frame
+    quietest = min(range(len(energies)), key=energies.__getitem__)
+    return lo + quietest * samples_per_frame + samples_per_frame // 2
+
+
+def plan_windows(wav_path, window_seconds=30.0, overlap_seconds=2.0, search_seconds=3.0):
+    """
+    Split a WAV file into windows of about window_seconds.
+
+    Each boundary is moved to the quietest point within search_seconds of
+    the nominal split, and each window re-reads overlap_seconds of audio
+    before its start.
+    """
+    windows = []
+    with wave.open(wav_path, 'rb') as wav_file:
+        framerate = wav_file.getframerate()
+        nframes = wav_file.getnframes()
+        window_frames = int(window_seconds * framerate)
+        overlap_frames = int(overlap_seconds * framerate)
+        search_frames = int(search_seconds * framerate)
+
+        start = 0
+        while start < nframes:
+            nominal_end = start + window_frames
+            if nominal_end + search_frames >= nframes:
+                end = nframes
+            else:
+                end = _quietest_frame(wav_file, nominal_end, search_frames)
+                end = max(end, start + window_frames // 2)
+            windows.append(AudioWindow(len(windows), start, end, max(0, start - overlap_frames), framerate))
+            start = end
+    return windows
+
+
+def read_window(wav_path, window):
+    """Return the window's audio (including its overlap) as WAV bytes"""
+    with wave.open(wav_path, 'rb') as wav_file:
+        wav_file.setpos(window.read_start_frame)
+        raw = wav_file.readframes(window.end_frame - window.read_start_frame)
+        params = wav_file.getparams()
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as out:
+        out.setparams(params)
+        out.writeframes(raw)
+    return buffer.getvalue()
+
+
+PUNCTUATION = re.compile(r'[।॥\.\,\!\?]')
+
+
+def merge_overlap(previous_text, next_text, max_words=30):
+    """
+    Drop the start of next_text that repeats the end of previous_text.
+
+    The overlapping audio is transcribed twice, so the longest run of words
+    that ends previous_text and starts next_text is removed from next_text.
+    """
+    previous_words = [PUNCTUATION.sub('', w) for w in previous_text.split()][-max_words:]
+    next_words = next_text.split()
+    next_compare = [PUNCTUATION.sub('', w) for w in next_words]
+
+    for size in range(min(len(previous_words), len(next_compare)), 0, -1):
+        if previous_words[-size:] == next_compare[:size]:
+            return ' '.join(next_words[size:])
+    return next_text
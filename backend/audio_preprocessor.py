@@ -0,0 +1,436 @@
+import os
+import json
+import math
+import time
+import wave
+import shutil
+import hashlib
+import logging
+import tempfile
+import warnings
+import subprocess
+from array import array
+from bisect import bisect_right
+from collections import deque
+
+from media_store import MEDIA_DIR, CHUNK_SIZE
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        import audioop
+except ImportError:
+    audioop = None  # removed in Python 3.13; WAV input then needs ffmpeg like everything else
+
+logger = logging.getLogger(__name__)
+
+PREPROCESSED_DIR = os.getenv('PREPROCESSED_DIR', os.path.join(MEDIA_DIR, 'preprocessed'))
+# Least recently used conversions are deleted once the cache grows past this
+PREPROCESSED_MAX_BYTES = int(float(os.getenv('PREPROCESSED_MAX_MB', 2048)) * 1024 * 1024)
+# 'off' uploads recordings as they are, 'resample' only converts them,
+# 'trim' also cuts leading/trailing silence, 'vad' also shortens long pauses
+AUDIO_PREPROCESS = os.getenv('AUDIO_PREPROCESS', 'trim')
+# flac (lossless), opus (smallest) or wav; without ffmpeg only wav can be written
+AUDIO_CODEC = os.getenv('AUDIO_CODEC', 'flac')
+OPUS_BITRATE = os.getenv('AUDIO_OPUS_BITRATE', '32k')
+
+# What Whisper resamples to anyway
+TARGET_SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2  # 16-bit PCM
+FRAME_SECONDS = 0.02
+# Frames quieter than this (RMS, dB below full scale) count as silence
+SILENCE_THRESHOLD_DB = float(os.getenv('AUDIO_SILENCE_DB', -40))
+# Silence left around speech so word onsets and endings are not clipped
+SILENCE_PAD_SECONDS = 0.25
+# With 'vad', pauses longer than this are shortened to it; still longer than
+# the segmenter's PAUSE_SECONDS so pauses keep ending sentences
+MAX_PAUSE_SECONDS = 1.0
+
+CODECS = {
+    'flac': ('.flac', ['-c:a', 'flac', '-compression_level', '8']),
+    'opus': ('.ogg', ['-c:a', 'libopus', '-b:a', OPUS_BITRATE, '-application', 'voip']),
+    'wav': ('.wav', None),
+}
+MODES = ('off', 'resample', 'trim', 'vad')
+
+
+def frame_rms(pcm):
+    """RMS amplitude of 16-bit mono PCM"""
+    if audioop is not None:
+        return audioop.rms(pcm, SAMPLE_WIDTH)
+    samples = array('h')
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % SAMPLE_WIDTH])
+    return math.sqrt(sum(s * s for s in samples) / len(samples)) if samples else 0.0
+
+
+class SilenceTrimmer:
+    """
+    Streaming silence removal for 16kHz mono PCM.
+
+    feed() takes PCM in chunks of any size and returns the PCM to keep;
+    finish() returns the rest. Silence before the first and after the last
+    voiced frame is cut to SILENCE_PAD_SECONDS; with vad, pauses longer
+    than max_pause are also shortened to it, keeping their start and end.
+    Only silence that may still be cut is held back, so memory is bounded
+    by the longest pause (or by max_pause, with vad).
+
+    offsets maps the output timeline back to the input one: a list of
+    (output seconds, input seconds) points where a cut ends, for
+    PreparedAudio.original_time().
+    """
+
+    def __init__(self, vad=False, threshold_db=SILENCE_THRESHOLD_DB,
+                 pad_seconds=SILENCE_PAD_SECONDS, max_pause=MAX_PAUSE_SECONDS):
+        self.frame_bytes = int(TARGET_SAMPLE_RATE * FRAME_SECONDS) * SAMPLE_WIDTH
+        self.threshold = 32768 * 10 ** (threshold_db / 20)
+        self.pad_frames = round(pad_seconds / FRAME_SECONDS)
+        keep_frames = max(2 * self.pad_frames, round(max_pause / FRAME_SECONDS))
+        # A pause's first frames go to head and the rest to tail; with vad
+        # only both ends of a long pause are kept, without it all of it is
+        self.head_frames = keep_frames // 2 if vad else self.pad_frames
+        self.tail = deque(maxlen=keep_frames - keep_frames // 2 if vad else None)
+        self.lead = deque(maxlen=self.pad_frames)
+        self.head = []
+        self.pause = 0  # frames in the current silent run
+        self.buffer = b''
+        self.written = 0  # output frames
+        self.dropped = 0  # input frames cut so far
+        self.voiced = False
+        self.offsets = [(0.0, 0.0)]
+
+    def feed(self, pcm):
+        out = []
+        data = self.buffer + pcm if self.buffer else pcm
+        size = self.frame_bytes
+        end = len(data) - len(data) % size
+        for i in range(0, end, size):
+            self._frame(data[i:i + size], out)
+        self.buffer = data[end:]
+        return b''.join(out)
+
+    def finish(self):
+        out = []
+        if self.buffer:
+            self._frame(self.buffer, out)
+            self.buffer = b''
+        if self.voiced:
+            self._emit(self.head[:self.pad_frames], out)
+        return b''.join(out)
+
+    def _frame(self, frame, out):
+        if frame_rms(frame) < self.threshold:
+            self.pause += 1
+            if not self.voiced:
+                self.lead.append(frame)
+            elif len(self.head) < self.head_frames:
+                self.head.append(frame)
+            else:
+                self.tail.append(frame)
+            return
+
+        if self.pause:
+            # This frame ends a pause: keep its ends and cut the middle
+            before, after = (self.head, list(self.tail)) if self.voiced else ([], list(self.lead))
+            self._emit(before, out)
+            dropped = self.pause - len(before) - len(after)
+            if dropped:
+                self.dropped += dropped
+                self.offsets.append((self.written * FRAME_SECONDS, (self.written + self.dropped) * FRAME_SECONDS))
+            self._emit(after, out)
+            self.lead.clear()
+            self.head = []
+            self.tail.clear()
+            self.pause = 0
+        self.voiced = True
+        self._emit([frame], out)
+
+    def _emit(self, frames, out):
+        out.extend(frames)
+        self.written += len(frames)
+
+
+class PreparedAudio:
+    """
+    A recording ready for upload, with what preprocessing it cost and saved.
+
+    path is the file to send (the original when preprocessing was off,
+    failed or did not make it smaller). Use original_time() to map
+    timestamps in the uploaded audio back to the recording.
+    """
+
+    def __init__(self, path, input_bytes, output_bytes, duration=None, offsets=None, seconds=0.0, cached=False):
+        self.path = path
+        self.input_bytes = input_bytes
+        self.output_bytes = output_bytes
+        self.duration = duration
+        self.offsets = offsets or [(0.0, 0.0)]
+        self.seconds = seconds
+        self.cached = cached
+
+    @classmethod
+    def original(cls, path, seconds=0.0):
+        size = os.path.getsize(path)
+        return cls(path, size, size, seconds=seconds)
+
+    def original_time(self, t):
+        """Seconds into the recording for t seconds into the uploaded audio"""
+        i = bisect_right(self.offsets, (t, math.inf)) - 1
+        written, read = self.offsets[max(0, i)]
+        return t - written + read
+
+    def shift_segments(self, segments):
+        """Whisper segments with their times mapped back to the recording"""
+        return [
+            {**segment, 'start': self.original_time(segment['start']), 'end': self.original_time(segment['end'])}
+            for segment in segments
+        ]
+
+    def to_dict(self):
+        return {
+            'input_bytes': self.input_bytes, 'output_bytes': self.output_bytes,
+            'duration': self.duration, 'offsets': self.offsets
+        }
+
+
+class AudioPreprocessor:
+    """
+    Converts recordings to compact 16kHz mono audio before transcription.
+
+    The input is decoded by ffmpeg (or, for WAV without ffmpeg, the wave
+    module) into a PCM stream that is downmixed, resampled, optionally
+    trimmed of silence (see SilenceTrimmer) and piped into the encoder, so
+    long recordings are never held in memory. Results are cached under
+    PREPROCESSED_DIR by input hash and settings, so a recording is only
+    converted once, and the least recently used are evicted past max_bytes.
+    """
+
+    def __init__(self, root=None, mode=AUDIO_PREPROCESS, codec=AUDIO_CODEC, max_bytes=PREPROCESSED_MAX_BYTES):
+        if mode not in MODES:
+            raise ValueError(f"Unknown AUDIO_PREPROCESS mode {mode!r}; expected one of {', '.join(MODES)}")
+        if codec not in CODECS:
+            raise ValueError(f"Unknown AUDIO_CODEC {codec!r}; expected one of {', '.join(CODECS)}")
+        self.root = root or PREPROCESSED_DIR
+        os.makedirs(self.root, exist_ok=True)
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.ffmpeg = shutil.which('ffmpeg')
+        # Without ffmpeg only WAV can be written
+        self.codec = codec if self.ffmpeg else 'wav'
+
+    def prepare(self, path, audio_hash=None, codec=None, mode=None):
+        """
+        Return a PreparedAudio for path; blocking, so run it in an executor.
+
+        codec and mode override the preprocessor's settings for this call.
+        Falls back to the original file, with a warning, when the input
+        cannot be decoded here.
+        """
+        started = time.perf_counter()
+        # A caller asking for WAV needs decoded audio, even if it is larger
+        wants_wav = codec == 'wav'
+        mode = mode or self.mode
+        codec = codec if codec and self.ffmpeg else self.codec
+        if mode == 'off':
+            return PreparedAudio.original(path)
+        if not self.ffmpeg and (audioop is None or not path.lower().endswith('.wav')):
+            return PreparedAudio.original(path)
+
+        audio_hash = audio_hash or _file_hash(path)
+        extension, _ = CODECS[codec]
+        settings = f"{mode}-{codec}-{SILENCE_THRESHOLD_DB:g}-{OPUS_BITRATE if codec == 'opus' else ''}"
+        name = f"{audio_hash}-{hashlib.sha256(settings.encode()).hexdigest()[:8]}"
+        output_path = os.path.join(self.root, name + extension)
+        info_path = os.path.join(self.root, name + '.json')
+
+        prepared = self._load(output_path, info_path)
+        if prepared is None:
+            try:
+                prepared = self._convert(path, output_path, info_path, codec, mode)
+            except (OSError, EOFError, wave.Error, subprocess.SubprocessError, RuntimeError) as e:
+                logger.warning("Preprocessing %s failed, uploading it unchanged: %s", path, e)
+                return PreparedAudio.original(path, time.perf_counter() - started)
+            self.evict(keep=name)
+        prepared.seconds = time.perf_counter() - started
+        if prepared.duration == 0:
+            logger.warning("No speech found in %s, uploading it unchanged", path)
+            return PreparedAudio.original(path, prepared.seconds)
+        if prepared.output_bytes >= prepared.input_bytes and not wants_wav:
+            # Already compact (e.g. a low-bitrate Opus upload)
+            return PreparedAudio.original(path, prepared.seconds)
+        return prepared
+
+    def evict(self, keep=None):
+        """Delete the least recently used conversions until the cache fits in max_bytes; returns bytes freed"""
+        entries = {}  # name -> [last used, bytes, paths]
+        try:
+            with os.scandir(self.root) as scan:
+                for item in scan:
+                    name, extension = os.path.splitext(item.name)
+                    if not item.is_file() or name.startswith('tmp'):
+                        continue  # conversions still being written
+                    stat = item.stat()
+                    entry = entries.setdefault(name, [0.0, 0, []])
+                    entry[0] = max(entry[0], stat.st_mtime)
+                    entry[1] += stat.st_size
+                    # The info file goes first, so a half-deleted entry is never loaded
+                    entry[2].insert(0 if extension == '.json' else len(entry[2]), item.path)
+        except OSError as e:
+            logger.warning("Could not scan %s for eviction: %s", self.root, e)
+            return 0
+        total = sum(size for _, size, _ in entries.values())
+        freed = 0
+        for name, (_, size, paths) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total - freed <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass  # evicted concurrently
+            freed += size
+        if freed:
+            logger.info("Evicted %.1f MB of preprocessed audio from %s", freed / 1e6, self.root)
+        return freed
+
+    def _load(self, output_path, info_path):
+        try:
+            with open(info_path, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            # Marks the entry as recently used for evict()
+            os.utime(output_path)
+        except OSError:
+            return None
+        info['offsets'] = [tuple(point) for point in info['offsets']]
+        return PreparedAudio(output_path, cached=True, **info)
+
+    def _convert(self, path, output_path, info_path, codec, mode):
+        trimmer = SilenceTrimmer(vad=mode == 'vad') if mode in ('trim', 'vad') else None
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix=CODECS[codec][0])
+        os.close(fd)
+        try:
+            written = self._encode(self._decode(path), temp_path, codec, trimmer)
+            os.replace(temp_path, output_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        prepared = PreparedAudio(
+            output_path, os.path.getsize(path), os.path.getsize(output_path),
+            duration=written / (TARGET_SAMPLE_RATE * SAMPLE_WIDTH),
+            offsets=trimmer.offsets if trimmer else None
+        )
+        # The info file marks the entry complete, so it is written last
+        fd, temp_info = tempfile.mkstemp(dir=self.root, suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(prepared.to_dict(), f)
+        os.replace(temp_info, info_path)
+        logger.info(
+            "Preprocessed %s: %.1f MB -> %.1f MB (%s, %s)", path,
+            prepared.input_bytes / 1e6, prepared.output_bytes / 1e6, codec, mode
+        )
+        return prepared
+
+    def _decode(self, path):
+        """Yield the recording as 16kHz mono 16-bit PCM chunks"""
+        if self.ffmpeg:
+            yield from self._decode_ffmpeg(path)
+        else:
+            yield from _decode_wav(path)
+
+    def _decode_ffmpeg(self, path):
+        # stderr goes to a file so a chatty decoder cannot block on a full pipe
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(
+                [self.ffmpeg, '-nostdin', '-loglevel', 'error', '-i', path,
+                 '-f', 's16le', '-ac', '1', '-ar', str(TARGET_SAMPLE_RATE), 'pipe:1'],
+                stdout=subprocess.PIPE, stderr=errors
+            )
+            try:
+                for chunk in iter(lambda: process.stdout.read(CHUNK_SIZE), b''):
+                    yield chunk
+            finally:
+                process.stdout.close()
+                process.wait()
+            if process.returncode != 0:
+                errors.seek(0)
+                raise RuntimeError(f"ffmpeg could not decode {path}: {errors.read().decode(errors='replace').strip()}")
+
+    def _encode(self, chunks, output_path, codec, trimmer):
+        """Write PCM chunks (through trimmer, if any) to output_path; returns PCM bytes written"""
+        written = 0
+        if codec == 'wav':
+            with wave.open(output_path, 'wb') as out:
+                out.setnchannels(1)
+                out.setsampwidth(SAMPLE_WIDTH)
+                out.setframerate(TARGET_SAMPLE_RATE)
+                for pcm in _trimmed(chunks, trimmer):
+                    out.writeframes(pcm)
+                    written += len(pcm)
+            return written
+
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(
+                [self.ffmpeg, '-y', '-loglevel', 'error', '-f', 's16le', '-ar', str(TARGET_SAMPLE_RATE),
+                 '-ac', '1', '-i', 'pipe:0', *CODECS[codec][1], output_path],
+                stdin=subprocess.PIPE, stderr=errors
+            )
+            try:
+                for pcm in _trimmed(chunks, trimmer):
+                    process.stdin.write(pcm)
+                    written += len(pcm)
+            finally:
+                process.stdin.close()
+                returncode = process.wait()
+            if returncode != 0:
+                errors.seek(0)
+                raise RuntimeError(f"ffmpeg could not encode {codec}: {errors.read().decode(errors='replace').strip()}")
+        return written
+
+
+def _trimmed(chunks, trimmer):
+    for pcm in chunks:
+        if trimmer is not None:
+            pcm = trimmer.feed(pcm)
+        if pcm:
+            yield pcm
+    if trimmer is not None:
+        rest = trimmer.finish()
+        if rest:
+            yield rest
+
+
+def _decode_wav(path):
+    """Decode, downmix and resample a PCM WAV file with audioop (no ffmpeg)"""
+    with wave.open(path, 'rb') as wav_file:
+        channels = wav_file.getnchannels()
+        width = wav_file.getsampwidth()
+        rate = wav_file.getframerate()
+        if channels > 2:
+            raise RuntimeError(f"{channels}-channel WAV needs ffmpeg")
+        state = None
+        frames_per_chunk = max(1, CHUNK_SIZE // (channels * width))
+        while True:
+            pcm = wav_file.readframes(frames_per_chunk)
+            if not pcm:
+                break
+            if width == 1:
+                pcm = audioop.bias(pcm, 1, -128)  # 8-bit WAV is unsigned
+            if width != SAMPLE_WIDTH:
+                pcm = audioop.lin2lin(pcm, width, SAMPLE_WIDTH)
+            if channels == 2:
+                pcm = audioop.tomono(pcm, SAMPLE_WIDTH, 0.5, 0.5)
+            if rate != TARGET_SAMPLE_RATE:
+                pcm, state = audioop.ratecv(pcm, SAMPLE_WIDTH, 1, rate, TARGET_SAMPLE_RATE, state)
+            yield pcm
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
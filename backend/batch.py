@@ -0,0 +1,415 @@
+"""
+Headless batch subtitling of a directory or manifest of recordings.
+
+Each recording is transcribed and translated without the UI's pacing and
+written as SRT, WebVTT and JSONL. Recordings are spread over a process
+pool; all processes share one budget of API calls in flight and split the
+request rate between them. Finished recordings are appended to a
+checkpoint in the output directory, so an interrupted run picks up where
+it stopped.
+
+    python batch.py recordings/ --output-dir subtitles --processes 4 --api-concurrency 8
+    python batch.py manifest.txt --formats srt jsonl --bilingual
+
+A manifest lists one audio path per line ('#' comments allowed), or is a
+.jsonl file of {"path": ..., "name": ...} objects. A JSON throughput
+report is printed at the end and written to report.json.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('srt', 'vtt', 'jsonl')
+CHECKPOINT_FILE = 'checkpoint.jsonl'
+REPORT_FILE = 'report.json'
+# Subtitle length for sentences without timestamps, and the shortest one shown
+DEFAULT_SUBTITLE_SECONDS = 3.0
+MIN_SUBTITLE_SECONDS = 1.0
+# How often a worker retries the shared API budget while it is exhausted
+BUDGET_POLL_SECONDS = 0.02
+
+# Per-process pipeline, set up by _init_worker
+_worker = {}
+
+
+class SharedBudget:
+    """
+    A multiprocessing semaphore with the acquire()/release() RequestScheduler expects.
+
+    acquire() polls instead of blocking so it never ties up the event
+    loop or an executor thread, and it is safe to cancel.
+    """
+
+    def __init__(self, semaphore):
+        self.semaphore = semaphore
+
+    async def acquire(self):
+        while not self.semaphore.acquire(block=False):
+            await asyncio.sleep(BUDGET_POLL_SECONDS)
+        return True
+
+    def release(self):
+        self.semaphore.release()
+
+
+def find_recordings(source):
+    """[(path, name)] for a directory (searched recursively) or a manifest file"""
+    from media_store import AUDIO_EXTENSIONS
+
+    recordings = []
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for filename in sorted(files):
+                if os.path.splitext(filename)[1].lower() in AUDIO_EXTENSIONS:
+                    path = os.path.join(root, filename)
+                    recordings.append((path, os.path.splitext(os.path.relpath(path, source))[0]))
+        return recordings
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if source.endswith('.jsonl'):
+                entry = json.loads(line)
+                path, name = entry['path'], entry.get('name')
+            else:
+                path, name = line, None
+            # Relative manifest paths are relative to the manifest
+            path = os.path.join(base, path)
+            recordings.append((path, name or os.path.splitext(os.path.basename(path))[0]))
+
+    # Two manifest entries with the same file name must not overwrite each other's output
+    seen = Counter()
+    unique = []
+    for path, name in recordings:
+        seen[name] += 1
+        unique.append((path, name if seen[name] == 1 else f"{name}_{seen[name]}"))
+    return unique
+
+
+def _timestamp(seconds, separator):
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+
+def subtitle_cues(sentences):
+    """(start, end, sentence) for each sentence, filling in times for untimed ones"""
+    cues = []
+    previous_end = 0.0
+    for sentence in sentences:
+        start = sentence.get('start')
+        end = sentence.get('end')
+        if start is None:
+            start = previous_end
+            end = start + DEFAULT_SUBTITLE_SECONDS
+        end = max(end if end is not None else start, start + MIN_SUBTITLE_SECONDS)
+        cues.append((start, end, sentence))
+        previous_end = end
+    return cues
+
+
+def _cue_text(sentence, bilingual):
+    english = sentence['english'] or ''
+    return f"{sentence['sanskrit']}\n{english}" if bilingual else english
+
+
+def to_srt(sentences, bilingual=False):
+    blocks = []
+    for i, (start, end, sentence) in enumerate(subtitle_cues(sentences), 1):
+        blocks.append(
+            f"{i}\n{_timestamp(start, ',')} --> {_timestamp(end, ',')}\n{_cue_text(sentence, bilingual)}\n"
+        )
+    return "\n".join(blocks)
+
+
+def to_vtt(sentences, bilingual=False):
+    blocks = ["WEBVTT\n"]
+    for start, end, sentence in subtitle_cues(sentences):
+        blocks.append(f"{_timestamp(start, '.')} --> {_timestamp(end, '.')}\n{_cue_text(sentence, bilingual)}\n")
+    return "\n".join(blocks)
+
+
+def to_jsonl(sentences):
+    return "".join(
+        json.dumps({'index': i, **sentence}, ensure_ascii=False) + "\n"
+        for i, sentence in enumerate(sentences, 1)
+    )
+
+
+def _write_atomic(path, text):
+    """Write via a temporary file so an interrupted run never leaves half an output behind"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = path + '.part'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def output_paths(output_dir, name, formats):
+    return {fmt: os.path.join(output_dir, f"{name}.{fmt}") for fmt in formats}
+
+
+def _init_worker(budget, processes, log_level):
+    """Build one pipeline per process, sharing the API budget and rate limit with the others"""
+    logging.basicConfig(level=log_level, format='%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s')
+    from scheduler import RequestScheduler, API_RATE_LIMIT, API_BURST
+    from media_store import MediaStore
+    from artifact_store import ArtifactStore
+    from transcription_module import TranscriptionModule
+    from translation_module import TranslationModule
+
+    scheduler = RequestScheduler(
+        rate=API_RATE_LIMIT / processes, burst=max(1, API_BURST // processes), limiter=SharedBudget(budget)
+    )
+    artifact_store = ArtifactStore()
+    _worker.update(
+        loop=asyncio.new_event_loop(),
+        artifact_store=artifact_store,
+        transcription=TranscriptionModule(
+            media_store=MediaStore(), artifact_store=artifact_store, scheduler=scheduler
+        ),
+        translation=TranslationModule(scheduler=scheduler)
+    )
+
+
+def process_recording(path, name, output_dir, formats, bilingual, max_batch_tokens, max_concurrency):
+    """Subtitle one recording in a worker process; returns its checkpoint record"""
+    return _worker['loop'].run_until_complete(
+        _process_recording(path, name, output_dir, formats, bilingual, max_batch_tokens, max_concurrency)
+    )
+
+
+async def _process_recording(path, name, output_dir, formats, bilingual, max_batch_tokens, max_concurrency):
+    from jobs import Job
+    from metrics import bind_job
+    from transcription_module import MAX_UPLOAD_BYTES, WHISPER_MODEL, TRANSCRIPTION_LANGUAGE, timed_sentences
+    from translation_module import is_error
+
+    transcription = _worker['transcription']
+    translation = _worker['translation']
+    # A job without a client, only to collect this recording's API and cache counters
+    job = Job(None, 'batch', name, lambda *args, **kwargs: None)
+    bind_job(job)
+    started = time.monotonic()
+
+    if os.path.getsize(path) > MAX_UPLOAD_BYTES:
+        sentences = [
+            {'sanskrit': s['sanskrit'], 'start': s['start'], 'end': s['end']}
+            async for s in transcription.transcribe_stream(path, max_concurrency=max_concurrency)
+        ]
+    else:
+        text, segments = await transcription.transcribe_timed(path)
+        sentences = timed_sentences(text, segments) if text else []
+    # Only real API output is stored; a failure or the demo fallback text leaves nothing
+    audio_hash, transcript = await transcription.cached_transcript(path)
+    if not transcript:
+        raise RuntimeError("transcription failed")
+    transcribed = time.monotonic()
+
+    translations = await translation.batch_translate(
+        [s['sanskrit'] for s in sentences], max_batch_tokens, max_concurrency
+    )
+    for sentence, english in zip(sentences, translations):
+        sentence['english'] = english
+    untranslated = sum(1 for english in translations if is_error(english))
+
+    writers = {
+        'srt': lambda: to_srt(sentences, bilingual),
+        'vtt': lambda: to_vtt(sentences, bilingual),
+        'jsonl': lambda: to_jsonl(sentences)
+    }
+    paths = output_paths(output_dir, name, formats)
+    for fmt, out_path in paths.items():
+        _write_atomic(out_path, writers[fmt]())
+
+    # Let the UI replay the recording from its artifact without calling the API again
+    artifact = _worker['artifact_store'].latest(audio_hash, WHISPER_MODEL, TRANSCRIPTION_LANGUAGE)
+    if artifact is not None and sentences:
+        _worker['artifact_store'].save_sentences(artifact['id'], sentences)
+
+    ends = [s['end'] for s in sentences if s.get('end') is not None]
+    return {
+        'name': name,
+        'sentences': len(sentences),
+        'untranslated': untranslated,
+        'audio_seconds': max(ends) if ends else None,
+        'transcription_seconds': transcribed - started,
+        'translation_seconds': time.monotonic() - transcribed,
+        'elapsed': time.monotonic() - started,
+        'counters': dict(job.counters),
+        'outputs': sorted(paths.values())
+    }
+
+
+def _source_key(path):
+    """Identifies a recording's content well enough to notice it was replaced"""
+    stat = os.stat(path)
+    return {'source': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def load_checkpoint(output_dir):
+    """source path -> last successful record"""
+    done = {}
+    try:
+        with open(os.path.join(output_dir, CHECKPOINT_FILE), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by an interrupted run
+                done[record['source']] = record
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def is_done(record, key, formats):
+    return (
+        record is not None and record['size'] == key['size'] and record['mtime'] == key['mtime']
+        and record.get('untranslated', 0) == 0
+        and all(os.path.exists(path) for path in output_paths(record['output_dir'], record['name'], formats).values())
+    )
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def build_report(records, skipped, failures, elapsed, processes, api_concurrency):
+    counters = Counter()
+    for record in records:
+        counters.update(record['counters'])
+    audio_seconds = sum(record['audio_seconds'] or 0 for record in records)
+    sentences = sum(record['sentences'] for record in records)
+    return {
+        'files': {
+            'completed': len(records),
+            'skipped': skipped,
+            'failed': len(failures),
+            'incomplete_translations': sum(1 for record in records if record['untranslated'])
+        },
+        'processes': processes,
+        'api_concurrency': api_concurrency,
+        'elapsed': elapsed,
+        'audio_seconds': audio_seconds,
+        'sentences': sentences,
+        'throughput': {
+            'files_per_minute': len(records) * 60 / elapsed if elapsed else None,
+            'audio_seconds_per_second': audio_seconds / elapsed if elapsed else None,
+            'sentences_per_second': sentences / elapsed if elapsed else None
+        },
+        'file_seconds': {
+            'p50': _percentile([record['elapsed'] for record in records], 50),
+            'p95': _percentile([record['elapsed'] for record in records], 95)
+        },
+        'counters': dict(counters),
+        'failures': failures
+    }
+
+
+def run(args):
+    recordings = find_recordings(args.input)
+    os.makedirs(args.output_dir, exist_ok=True)
+    done = {} if args.no_resume else load_checkpoint(args.output_dir)
+
+    pending = []
+    skipped = 0
+    for path, name in recordings:
+        key = _source_key(path)
+        if is_done(done.get(key['source']), key, args.formats):
+            skipped += 1
+        else:
+            pending.append((path, name, key))
+    logger.info("%d recordings, %d already done, %d to process", len(recordings), skipped, len(pending))
+
+    records = []
+    failures = []
+    started = time.monotonic()
+    budget = multiprocessing.BoundedSemaphore(args.api_concurrency)
+    checkpoint_path = os.path.join(args.output_dir, CHECKPOINT_FILE)
+    with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint, ProcessPoolExecutor(
+        max_workers=args.processes, initializer=_init_worker,
+        initargs=(budget, args.processes, logging.getLogger().level)
+    ) as executor:
+        futures = {
+            executor.submit(
+                process_recording, path, name, args.output_dir, args.formats, args.bilingual,
+                args.max_batch_tokens, args.max_concurrency
+            ): (path, name, key)
+            for path, name, key in pending
+        }
+        try:
+            for finished, future in enumerate(as_completed(futures), 1):
+                path, name, key = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    logger.error("[%d/%d] %s failed: %s", finished, len(pending), name, e)
+                    failures.append({'source': key['source'], 'error': str(e)})
+                    continue
+                record.update(key, output_dir=args.output_dir)
+                records.append(record)
+                checkpoint.write(json.dumps(record, ensure_ascii=False) + "\n")
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+                logger.info("[%d/%d] %s: %d sentences in %.1fs%s", finished, len(pending), name,
+                            record['sentences'], record['elapsed'],
+                            f" ({record['untranslated']} untranslated, will retry)" if record['untranslated'] else "")
+        except KeyboardInterrupt:
+            logger.warning("Interrupted; finished recordings are checkpointed and will be skipped next run")
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    report = build_report(records, skipped, failures, time.monotonic() - started,
+                          args.processes, args.api_concurrency)
+    _write_atomic(os.path.join(args.output_dir, REPORT_FILE), json.dumps(report, indent=2, ensure_ascii=False))
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('input', help='directory of recordings, or a manifest (.txt or .jsonl)')
+    parser.add_argument('--output-dir', default='subtitles')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=list(FORMATS))
+    parser.add_argument('--bilingual', action='store_true', help='show the Sanskrit line above the English')
+    parser.add_argument('--processes', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--api-concurrency', type=int, default=int(os.getenv('WORKER_POOL_SIZE', 8)),
+                        help='API calls in flight across all processes')
+    parser.add_argument('--max-concurrency', type=int, default=4,
+                        help='translation batches or transcription windows in flight per recording')
+    parser.add_argument('--max-batch-tokens', type=int, default=1500)
+    parser.add_argument('--no-resume', action='store_true', help='ignore the checkpoint and redo every recording')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+    )
+    report = run(args)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 1 if report['files']['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,660 @@
+"""
+Offline benchmark of the transcription/translation pipeline.
+
+Starts a local stand-in for OpenRouter's OpenAI-compatible
+/chat/completions and /audio/transcriptions endpoints, with configurable
+latency distributions, error rates and rate limiting, and drives
+transcribe_audio, batch_translate and process_audio_realtime against it
+with synthetic Sanskrit text and audio. No API key or network is needed.
+The translation_memory and segmenter scenarios run locally without the mock.
+
+    python benchmark.py --jobs 8 --sentences 200 --output results.json
+
+Results are printed as JSON (and written to --output) so runs can be compared.
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import wave
+import random
+import asyncio
+import argparse
+import itertools
+import hashlib
+import logging
+import tempfile
+import threading
+from array import array
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Words from the demo transcript, recombined into synthetic sentences
+CORPUS_WORDS = (
+    "अजिता हरे जय माधवा विष्णो अजमुख देव नाथा विजय शारदे साधु द्विजनोनु "
+    "परयुन्नु सुजन सङ्गममेत्तम् सुकृत निवग सुलभमथनु नियतम् पलदिनमायि ञ्जनम् "
+    "बलभद्रनुजा निन्ने नलमोडु काण्मथिन्नु कलियल्ले रुचिक्कुन्नु काल विशमम् कोण्डु"
+).split()
+
+SAMPLE_RATE = 16000
+# Synthetic audio alternates voiced bursts and pauses; the mock hears one sentence per burst
+SECONDS_PER_SENTENCE = 3.0
+PAUSE_SECONDS = 0.5
+
+
+def synthetic_sentence(rng):
+    return " ".join(rng.choice(CORPUS_WORDS) for _ in range(rng.randint(3, 7))) + " ।"
+
+
+def synthetic_corpus(count, seed=0):
+    rng = random.Random(seed)
+    return [synthetic_sentence(rng) for _ in range(count)]
+
+
+def synthetic_glossary(entries, vocabulary=30000, seed=0):
+    """
+    (lines, terms) for a large translation memory.
+
+    Words are random Devanagari syllable strings drawn with Zipf-like
+    frequencies, so stock words recur across many lines as in real lyrics.
+    """
+    rng = random.Random(seed)
+    consonants = [chr(c) for c in range(0x915, 0x939)]
+    vowel_signs = ['', 'ा', 'ि', 'ी', 'ु', 'ू', 'े', 'ो', 'ं']
+    words = [
+        ''.join(rng.choice(consonants) + rng.choice(vowel_signs) for _ in range(rng.randint(2, 4)))
+        for _ in range(vocabulary)
+    ]
+    weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(vocabulary)))
+    lines = [' '.join(rng.choices(words, cum_weights=weights, k=rng.randint(3, 7))) for _ in range(entries)]
+    return lines, words[:vocabulary // 10]
+
+
+def write_synthetic_wav(path, seconds, seed=0):
+    """Write 16kHz mono PCM16 audio: noisy tone bursts separated by silence"""
+    rng = random.Random(seed)
+    voiced = int((SECONDS_PER_SENTENCE - PAUSE_SECONDS) * SAMPLE_RATE)
+    pause = int(PAUSE_SECONDS * SAMPLE_RATE)
+    frequency = rng.uniform(180, 320)
+    burst = array('h', (
+        int(6000 * math.sin(2 * math.pi * frequency * i / SAMPLE_RATE) + rng.randint(-400, 400))
+        for i in range(voiced)
+    )).tobytes() + bytes(2 * pause)
+    total = int(seconds * SAMPLE_RATE) * 2
+    pcm = (burst * (total // len(burst) + 1))[:total]
+    with wave.open(path, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(SAMPLE_RATE)
+        out.writeframes(pcm)
+    return path
+
+
+def percentile(values, q):
+    """Nearest-rank percentile, or None for no values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class LatencyProfile:
+    """Log-normal response latency with the given median (seconds) and spread"""
+
+    def __init__(self, median, spread=0.5):
+        self.median = median
+        self.spread = spread
+
+    def sample(self, rng):
+        if self.median <= 0:
+            return 0.0
+        return rng.lognormvariate(math.log(self.median), self.spread)
+
+    def to_dict(self):
+        return {'median': self.median, 'spread': self.spread}
+
+
+class MockOpenRouter:
+    """
+    Local OpenAI-compatible server answering chat and transcription requests.
+
+    Each request waits for a latency drawn from its endpoint's profile,
+    then fails with a 500 at error_rate, is rejected with a 429 and
+    Retry-After at rate_limit_rate, or returns a synthetic answer. Batch
+    prompts with numbered lines get a JSON array with one entry per line.
+    Transcripts are derived from a hash of the uploaded audio, so the same
+    file always gets the same text. model_latency overrides the chat
+    latency for individual models, e.g. to simulate a degraded primary.
+    Chat requests with stream=true are answered as server-sent events, one
+    word every token_interval seconds after the drawn latency.
+    """
+
+    def __init__(self, chat_latency=None, audio_latency=None, error_rate=0.0,
+                 rate_limit_rate=0.0, retry_after=1.0, seed=0, model_latency=None,
+                 token_interval=0.05):
+        self.chat_latency = chat_latency or LatencyProfile(0.5)
+        self.audio_latency = audio_latency or LatencyProfile(1.5)
+        self.model_latency = model_latency or {}
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.token_interval = token_interval
+        self.calls = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        """Serve on a free localhost port; returns the base URL"""
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                mock.handle(self, body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}/api/v1"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _draw(self, profile):
+        with self._lock:
+            return profile.sample(self._rng), self._rng.random()
+
+    def handle(self, request, body):
+        payload = None
+        if request.path.endswith('/chat/completions'):
+            payload = json.loads(body or b'{}')
+            endpoint = 'chat'
+            profile = self.model_latency.get(payload.get('model'), self.chat_latency)
+        elif request.path.endswith('/audio/transcriptions'):
+            endpoint, profile = 'transcriptions', self.audio_latency
+        else:
+            self._send(request, 404, {'error': {'message': f'Unknown path {request.path}'}})
+            return
+
+        latency, roll = self._draw(profile)
+        with self._lock:
+            self.calls[endpoint] += 1
+        time.sleep(latency)
+
+        if roll < self.rate_limit_rate:
+            with self._lock:
+                self.calls['rate_limited'] += 1
+            self._send(request, 429, {'error': {'message': 'Rate limit exceeded (mock)'}},
+                       {'Retry-After': str(self.retry_after)})
+        elif roll < self.rate_limit_rate + self.error_rate:
+            with self._lock:
+                self.calls['errors'] += 1
+            self._send(request, 500, {'error': {'message': 'Internal error (mock)'}})
+        elif endpoint == 'chat' and payload.get('stream'):
+            self._stream_chat(request, self._chat_response(payload))
+        elif endpoint == 'chat':
+            self._send(request, 200, self._chat_response(payload))
+        else:
+            self._transcription_response(request, body)
+
+    def _chat_response(self, payload):
+        prompt = payload.get('messages', [{}])[-1].get('content', '')
+        lines = re.findall(r'^\d+\.\s*(.+)$', prompt, re.MULTILINE)
+        if len(lines) > 1:
+            content = json.dumps([f"Translation of: {line}" for line in lines], ensure_ascii=False)
+        else:
+            content = f"Translation of: {prompt}"
+        return {
+            'id': 'mock-' + hashlib.md5(prompt.encode('utf-8')).hexdigest()[:12],
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': payload.get('model', 'mock'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': len(prompt) // 2, 'completion_tokens': len(content) // 2,
+                      'total_tokens': (len(prompt) + len(content)) // 2}
+        }
+
+    def _stream_chat(self, request, response):
+        """Send a chat response as OpenAI-style server-sent event chunks"""
+        content = response['choices'][0]['message']['content']
+        words = re.findall(r'\S+\s*', content)
+
+        def chunk(delta, finish_reason=None, usage=None):
+            data = {
+                'id': response['id'], 'object': 'chat.completion.chunk', 'created': response['created'],
+                'model': response['model'],
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+            }
+            if usage is not None:
+                data['usage'] = usage
+            return b'data: ' + json.dumps(data, ensure_ascii=False).encode('utf-8') + b'\n\n'
+
+        try:
+            request.send_response(200)
+            request.send_header('Content-Type', 'text/event-stream')
+            request.send_header('Connection', 'close')
+            request.end_headers()
+            request.close_connection = True
+            request.wfile.write(chunk({'role': 'assistant', 'content': ''}))
+            for i, word in enumerate(words):
+                if i:
+                    time.sleep(self.token_interval)
+                request.wfile.write(chunk({'content': word}))
+                request.wfile.flush()
+            request.wfile.write(chunk({}, 'stop', response['usage']))
+            request.wfile.write(b'data: [DONE]\n\n')
+            request.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _transcription_response(self, request, body):
+        # Multipart body: estimate the duration from the PCM16 payload size
+        duration = max(SECONDS_PER_SENTENCE, len(body) / (SAMPLE_RATE * 2))
+        rng = random.Random(hashlib.sha256(body).hexdigest())
+        segments = []
+        for i in range(max(1, int(duration / SECONDS_PER_SENTENCE))):
+            start = i * SECONDS_PER_SENTENCE
+            segments.append({
+                'id': i, 'start': start, 'end': start + SECONDS_PER_SENTENCE - PAUSE_SECONDS,
+                'text': synthetic_sentence(rng)
+            })
+        text = " ".join(segment['text'] for segment in segments)
+        if b'verbose_json' in body:
+            self._send(request, 200, {'text': text, 'language': 'sanskrit', 'duration': duration,
+                                      'segments': segments})
+        else:
+            self._send_bytes(request, 200, text.encode('utf-8'), 'text/plain; charset=utf-8')
+
+    def _send(self, request, status, payload, headers=None):
+        self._send_bytes(request, status, json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+                         'application/json', headers)
+
+    def _send_bytes(self, request, status, data, content_type, headers=None):
+        try:
+            request.send_response(status)
+            request.send_header('Content-Type', content_type)
+            request.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                request.send_header(name, value)
+            request.end_headers()
+            request.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up, e.g. a hedged request that lost the race
+
+
+def configure_environment(base_url, workdir):
+    """Point the pipeline at the mock server and keep all state in workdir"""
+    os.environ['KAPI'] = 'mock-key'
+    os.environ['OPENROUTER_BASE_URL'] = base_url
+    os.environ['TRANSLATION_CACHE_PATH'] = os.path.join(workdir, 'translation_cache.sqlite3')
+    os.environ['MEDIA_DIR'] = os.path.join(workdir, 'media')
+    os.environ['ARTIFACT_DIR'] = os.path.join(workdir, 'artifacts')
+    os.environ['GLOSSARY_DIR'] = os.path.join(workdir, 'glossaries')
+
+
+def api_calls(mock, before):
+    return {key: mock.calls[key] - before.get(key, 0) for key in mock.calls}
+
+
+async def bench_transcribe_audio(mock, workdir, files=4, seconds=20.0):
+    """Whole-file transcription of several synthetic recordings"""
+    from transcription_module import TranscriptionModule
+
+    module = TranscriptionModule()
+    paths = [write_synthetic_wav(os.path.join(workdir, f"transcribe_{i}.wav"), seconds, seed=i)
+             for i in range(files)]
+    before = Counter(mock.calls)
+    latencies = []
+
+    async def transcribe(path):
+        started = time.monotonic()
+        text = await module.transcribe_audio(path)
+        latencies.append(time.monotonic() - started)
+        return text
+
+    started = time.monotonic()
+    texts = await asyncio.gather(*(transcribe(path) for path in paths))
+    elapsed = time.monotonic() - started
+    return {
+        'files': files,
+        'audio_seconds': files * seconds,
+        'elapsed': elapsed,
+        'audio_seconds_per_second': files * seconds / elapsed if elapsed else None,
+        'failed': sum(1 for text in texts if not text),
+        'latency_p50': percentile(latencies, 50),
+        'latency_p95': percentile(latencies, 95),
+        'api_calls': api_calls(mock, before)
+    }
+
+
+async def bench_batch_translate(mock, workdir, sentences=200, max_batch_tokens=1500, max_concurrency=4):
+    """Translate a synthetic corpus with a cold cache"""
+    from translation_cache import TranslationCache
+    from translation_module import TranslationModule
+
+    cache = TranslationCache(os.path.join(workdir, 'batch_cache.sqlite3'))
+    module = TranslationModule(cache=cache)
+    corpus = synthetic_corpus(sentences, seed=1)
+    before = Counter(mock.calls)
+
+    started = time.monotonic()
+    translations = await module.batch_translate(corpus, max_batch_tokens, max_concurrency)
+    elapsed = time.monotonic() - started
+    cache.close()
+    calls = api_calls(mock, before)
+    return {
+        'sentences': sentences,
+        'unique_sentences': len(set(corpus)),
+        'elapsed': elapsed,
+        'sentences_per_second': sentences / elapsed if elapsed else None,
+        'translated': sum(1 for t in translations if t),
+        'api_calls': calls,
+        'api_calls_per_sentence': calls.get('chat', 0) / sentences if sentences else None
+    }
+
+
+async def bench_process_audio(mock, workdir, jobs=8, seconds=30.0, pool_size=8,
+                              prefetch_depth=4, max_concurrency=3, timing='fixed', stream_translation=False):
+    """
+    Concurrent end-to-end file jobs, each with its own recording.
+
+    time_to_first_word is when the first English text reached the client:
+    the first translation_delta with stream_translation, else the first
+    sentence_update.
+    """
+    from main import RealTimeTranslator
+    from jobs import Job, WorkerPool
+    from metrics import bind_job
+
+    translator = RealTimeTranslator(WorkerPool(pool_size))
+    paths = [write_synthetic_wav(os.path.join(workdir, f"job_{i}.wav"), seconds, seed=100 + i)
+             for i in range(jobs)]
+    first_subtitle = []
+    first_word = []
+    sentence_counts = []
+    before = Counter(mock.calls)
+
+    async def run(path):
+        started = time.monotonic()
+        events = []
+        words = []
+
+        def record(event, data, to=None):
+            if event == 'sentence_update':
+                events.append(time.monotonic())
+            if event in ('sentence_update', 'translation_delta'):
+                words.append(time.monotonic())
+
+        job = Job('benchmark', 'file', path, record)
+        bind_job(job)
+        await translator.process_audio_realtime(
+            job, path, delay_per_sentence=0, prefetch_depth=prefetch_depth,
+            max_concurrency=max_concurrency, timing=timing, stream_translation=stream_translation
+        )
+        if events:
+            first_subtitle.append(events[0] - started)
+            first_word.append(words[0] - started)
+        sentence_counts.append(len(events))
+
+    started = time.monotonic()
+    await asyncio.gather(*(run(path) for path in paths))
+    elapsed = time.monotonic() - started
+    total = sum(sentence_counts)
+    calls = api_calls(mock, before)
+    return {
+        'jobs': jobs,
+        'audio_seconds': jobs * seconds,
+        'sentences': total,
+        'elapsed': elapsed,
+        'sentences_per_second': total / elapsed if elapsed else None,
+        'time_to_first_subtitle': {
+            'p50': percentile(first_subtitle, 50),
+            'p95': percentile(first_subtitle, 95),
+            'p99': percentile(first_subtitle, 99)
+        },
+        'time_to_first_word': {
+            'p50': percentile(first_word, 50),
+            'p95': percentile(first_word, 95),
+            'p99': percentile(first_word, 99)
+        },
+        'api_calls': calls,
+        'api_calls_per_sentence': (calls.get('chat', 0) + calls.get('transcriptions', 0)) / total if total else None
+    }
+
+
+def bench_translation_memory(entries=200000, queries=1000, seed=0, max_p99_us=1000):
+    """
+    Build a large translation memory and time exact, near-miss and unknown-line lookups.
+
+    Fails if any kind of lookup has a p99 latency above max_p99_us.
+    """
+    from translation_memory import TranslationMemory
+
+    # Held-out lines share the vocabulary, so they contain known terms
+    lines, terms = synthetic_glossary(entries + queries, seed=seed)
+    lines, unknown = lines[:entries], lines[entries:]
+    memory = TranslationMemory()
+    started = time.monotonic()
+    for i, line in enumerate(lines):
+        memory.add(line, f"translation {i}")
+    for term in terms:
+        memory.add(term, f"term {term}")
+    build_seconds = time.monotonic() - started
+
+    rng = random.Random(seed + 1)
+
+    def misspell(line):
+        chars = list(line)
+        position = rng.randrange(len(chars))
+        chars[position] = chr(rng.randrange(0x915, 0x939))
+        return ''.join(chars)
+
+    cases = {
+        'exact': [rng.choice(lines) for _ in range(queries)],
+        'near_miss': [misspell(rng.choice(lines)) for _ in range(queries)],
+        'unknown': unknown
+    }
+    results = {}
+    for name, texts in cases.items():
+        latencies = []
+        kinds = Counter()
+        for text in texts:
+            started = time.perf_counter()
+            match = memory.lookup(text)
+            latencies.append(time.perf_counter() - started)
+            kinds[match.kind if match is not None else 'none'] += 1
+        results[name] = {
+            'lookup_us_p50': percentile(latencies, 50) * 1e6,
+            'lookup_us_p99': percentile(latencies, 99) * 1e6,
+            'lookup_us_max': max(latencies) * 1e6,
+            'matches': dict(kinds)
+        }
+        if results[name]['lookup_us_p99'] > max_p99_us:
+            raise AssertionError(f"{name} lookups: p99 {results[name]['lookup_us_p99']:.0f}us "
+                                 f"exceeds {max_p99_us}us with {len(memory)} entries")
+    return {'entries': len(memory), 'build_seconds': build_seconds, 'lookups': results}
+
+
+def bench_segmenter(sizes_mb=(1, 2, 4), chunk_words=20, seed=0):
+    """
+    Segment multi-megabyte synthetic transcripts, whole and chunk by chunk.
+
+    In the 'mixed' corpus half the sentences lack a closing danda, as in
+    Whisper output; the 'unpunctuated' corpus has none at all, so all of
+    it goes through the length-based metrical split. Time per megabyte
+    staying flat as the size grows shows segmentation is linear, and the
+    chunked run must give exactly the sentences of the whole run.
+    """
+    from segmenter import Segmenter, split_sentences
+
+    rng = random.Random(seed)
+    results = []
+    for corpus, keep_danda in (('mixed', 0.5), ('unpunctuated', 0.0)):
+        for size_mb in sizes_mb:
+            parts = []
+            length = 0
+            while length < size_mb * 1024 * 1024:
+                sentence = synthetic_sentence(rng)
+                if rng.random() >= keep_danda:
+                    sentence = sentence.rstrip(' ।')
+                parts.append(sentence)
+                length += len(sentence.encode('utf-8')) + 1
+            text = ' '.join(parts)
+            words = text.split(' ')
+            chunks = [' '.join(words[i:i + chunk_words]) for i in range(0, len(words), chunk_words)]
+
+            started = time.perf_counter()
+            sentences = split_sentences(text)
+            whole = time.perf_counter() - started
+
+            started = time.perf_counter()
+            segmenter = Segmenter()
+            streamed = []
+            for chunk in chunks:
+                streamed.extend(segmenter.feed(chunk))
+            streamed.extend(segmenter.flush())
+            incremental = time.perf_counter() - started
+
+            if streamed != sentences:
+                raise AssertionError(f"{corpus} {size_mb}MB: chunked segmentation gave {len(streamed)} "
+                                     f"sentences, whole text {len(sentences)}")
+            megabytes = len(text.encode('utf-8')) / (1024 * 1024)
+            results.append({
+                'corpus': corpus,
+                'megabytes': megabytes,
+                'sentences': len(sentences),
+                'longest_sentence': max(map(len, sentences)),
+                'whole_seconds': whole,
+                'whole_seconds_per_mb': whole / megabytes,
+                'incremental_seconds': incremental,
+                'incremental_seconds_per_mb': incremental / megabytes
+            })
+    return {'chunk_words': chunk_words, 'sizes': results}
+
+
+SCENARIOS = ('transcribe_audio', 'batch_translate', 'process_audio_realtime', 'translation_memory', 'segmenter')
+
+
+async def run_benchmarks(args, mock, workdir):
+    results = {}
+    for name in args.scenarios:
+        if name == 'transcribe_audio':
+            result = await bench_transcribe_audio(mock, workdir, args.files, args.audio_seconds)
+        elif name == 'segmenter':
+            result = bench_segmenter(seed=args.seed)
+        elif name == 'translation_memory':
+            result = bench_translation_memory(args.memory_entries, seed=args.seed)
+        elif name == 'batch_translate':
+            result = await bench_batch_translate(mock, workdir, args.sentences, args.max_batch_tokens,
+                                                 args.max_concurrency)
+        else:
+            result = await bench_process_audio(mock, workdir, args.jobs, args.audio_seconds, args.pool_size,
+                                               args.prefetch_depth, args.max_concurrency, args.timing,
+                                               args.stream_translation)
+        result['peak_rss_mb'] = peak_rss_mb()
+        results[name] = result
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--jobs', type=int, default=8, help='concurrent process_audio_realtime jobs')
+    parser.add_argument('--files', type=int, default=4, help='recordings for transcribe_audio')
+    parser.add_argument('--audio-seconds', type=float, default=30.0, help='length of each synthetic recording')
+    parser.add_argument('--sentences', type=int, default=200, help='corpus size for batch_translate')
+    parser.add_argument('--memory-entries', type=int, default=200000, help='lines in the translation_memory index')
+    parser.add_argument('--pool-size', type=int, default=8)
+    parser.add_argument('--prefetch-depth', type=int, default=4)
+    parser.add_argument('--max-concurrency', type=int, default=3)
+    parser.add_argument('--max-batch-tokens', type=int, default=1500)
+    parser.add_argument('--timing', choices=('fixed', 'timestamps'), default='fixed')
+    parser.add_argument('--stream-translation', action='store_true', help='stream translations token by token')
+    parser.add_argument('--token-interval', type=float, default=0.05, help='seconds between streamed words')
+    parser.add_argument('--chat-latency', type=float, default=0.5, help='median chat latency in seconds')
+    parser.add_argument('--audio-latency', type=float, default=1.5, help='median transcription latency in seconds')
+    parser.add_argument('--latency-spread', type=float, default=0.5, help='log-normal sigma of latencies')
+    parser.add_argument('--degraded-model', help='chat model to slow down, e.g. anthropic/claude-3.5-sonnet')
+    parser.add_argument('--degraded-latency', type=float, default=10.0, help='median latency of --degraded-model')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests failing with 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='fraction of requests rejected with 429')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After seconds sent with 429s')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON results to this file')
+    parser.add_argument('--verbose', action='store_true', help='show pipeline log output')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mock = MockOpenRouter(
+        chat_latency=LatencyProfile(args.chat_latency, args.latency_spread),
+        audio_latency=LatencyProfile(args.audio_latency, args.latency_spread),
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+        token_interval=args.token_interval,
+        model_latency={args.degraded_model: LatencyProfile(args.degraded_latency, args.latency_spread)}
+        if args.degraded_model else None
+    )
+    base_url = mock.start()
+    with tempfile.TemporaryDirectory(prefix='benchmark_') as workdir:
+        configure_environment(base_url, workdir)
+        # Configured before the pipeline modules are imported, so their logging stays quiet
+        logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+        try:
+            results = asyncio.run(run_benchmarks(args, mock, workdir))
+        finally:
+            mock.stop()
+
+    report = {
+        'created_at': time.time(),
+        'config': {
+            key: value for key, value in vars(args).items() if key not in ('output', 'verbose')
+        },
+        'mock': {
+            'chat_latency': mock.chat_latency.to_dict(),
+            'audio_latency': mock.audio_latency.to_dict(),
+            'model_latency': {model: profile.to_dict() for model, profile in mock.model_latency.items()},
+            'calls': dict(mock.calls)
+        },
+        'results': results
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    return report
+
+
+if __name__ == '__main__':
+    main()
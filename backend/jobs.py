@@ -0,0 +1,252 @@
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import Counter, OrderedDict, deque
+from playback import PlaybackClock
+from metrics import bind_job, span
+from profiler import SamplingProfiler
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_PAUSED = 'paused'
+JOB_COMPLETED = 'completed'
+JOB_CANCELLED = 'cancelled'
+JOB_FAILED = 'failed'
+
+
+class WorkerPool:
+    """
+    Caps concurrent API calls across all jobs.
+
+    When the pool is full, freed slots are handed out round-robin between
+    the jobs that are waiting, so one long recording cannot starve the
+    other halls.
+    """
+
+    def __init__(self, size=8):
+        self.size = size
+        self.in_use = 0
+        # job id -> deque of waiter futures, in round-robin order
+        self._waiters = OrderedDict()
+
+    def slot(self, job_id):
+        """Return a reusable async context manager that holds one slot for job_id"""
+        return _PoolSlot(self, job_id)
+
+    async def acquire(self, job_id):
+        if self.in_use < self.size and not self._waiters:
+            self.in_use += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(job_id, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just as we were cancelled; pass it on
+                self.release()
+            else:
+                self._discard(job_id, future)
+            raise
+
+    def release(self):
+        self.in_use -= 1
+        while self._waiters:
+            job_id, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            # Rotate this job to the back so the next slot goes to another job
+            del self._waiters[job_id]
+            if waiters:
+                self._waiters[job_id] = waiters
+            if not future.done():
+                self.in_use += 1
+                future.set_result(None)
+                return
+
+    def _discard(self, job_id, future):
+        waiters = self._waiters.get(job_id)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            if not waiters:
+                del self._waiters[job_id]
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'in_use': self.in_use,
+            'waiting': {job_id: len(waiters) for job_id, waiters in self._waiters.items()}
+        }
+
+
+class _PoolSlot:
+    def __init__(self, pool, job_id):
+        self.pool = pool
+        self.job_id = job_id
+
+    async def __aenter__(self):
+        await self.pool.acquire(self.job_id)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.pool.release()
+
+
+class Job:
+    """One client's processing job with its own cancellation and pause state"""
+
+    def __init__(self, sid, kind, description, emit):
+        self.id = uuid.uuid4().hex[:12]
+        self.sid = sid
+        self.kind = kind
+        self.description = description
+        self.room = f"job:{self.id}"
+        self.state = JOB_QUEUED
+        self.created_at = time.time()
+        self.finished_at = None
+        self.progress = 0
+        self.sentences_emitted = 0
+        self.task = None
+        # Media-time clock for timestamp-driven emission; stops while paused
+        self.clock = PlaybackClock()
+        # Cache hits, fallbacks, bytes uploaded... counted while the job runs
+        self.counters = Counter()
+        self.profile = None  # collapsed stacks when started with profiling
+        self._emit = emit
+        self._resume = None
+
+    @property
+    def is_active(self):
+        return self.state in (JOB_QUEUED, JOB_RUNNING, JOB_PAUSED)
+
+    def emit(self, event, data):
+        """Emit only to the clients watching this job"""
+        with span('emit', event=event):
+            self._emit(event, data, to=self.room)
+
+    async def wait_if_paused(self):
+        """Block while the job is paused"""
+        if self._resume is not None:
+            await self._resume.wait()
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'sid': self.sid,
+            'kind': self.kind,
+            'description': self.description,
+            'state': self.state,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'progress': self.progress,
+            'sentences_emitted': self.sentences_emitted,
+            'counters': dict(self.counters),
+            'profiled': self.profile is not None
+        }
+
+
+class JobManager:
+    """
+    Runs every client's jobs on the shared AsyncRuntime loop.
+
+    Sharing the loop lets the WorkerPool schedule API calls fairly across
+    jobs; each job is an asyncio task that can be paused, resumed or
+    cancelled from the Socket.IO handler threads.
+    """
+
+    def __init__(self, runtime, pool_size=8, history=100):
+        self.runtime = runtime
+        self.pool = WorkerPool(pool_size)
+        self.jobs = OrderedDict()
+        self.history = history
+        self._lock = threading.Lock()
+
+    def start(self, job, coroutine_function, profile=False):
+        """
+        Schedule coroutine_function(job) on the runtime loop.
+
+        With profile, a sampling profiler runs for the job's lifetime and
+        leaves its collapsed stacks in job.profile.
+        """
+        with self._lock:
+            self.jobs[job.id] = job
+            self._trim_history()
+        self.runtime.submit(self._run(job, coroutine_function, profile))
+        return job
+
+    async def _run(self, job, coroutine_function, profile=False):
+        if job.state == JOB_CANCELLED:
+            return  # cancelled before it started
+        bind_job(job)
+        profiler = None
+        if profile:
+            profiler = SamplingProfiler(self.runtime.loop, self.runtime.thread_id, job.id)
+            profiler.start()
+        job.task = asyncio.current_task()
+        job._resume = asyncio.Event()
+        job._resume.set()
+        job.state = JOB_RUNNING
+        try:
+            await coroutine_function(job)
+            job.state = JOB_COMPLETED
+        except asyncio.CancelledError:
+            job.state = JOB_CANCELLED
+        except Exception:
+            logger.exception("Job %s failed", job.id)
+            job.state = JOB_FAILED
+        finally:
+            job.finished_at = time.time()
+            if profiler is not None:
+                # Joining the sampler thread is brief; it wakes every few milliseconds
+                profiler.stop()
+                job.profile = profiler.collapsed()
+
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self.jobs.items() if not job.is_active]
+        for job_id in finished[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list_jobs(self, sid=None):
+        with self._lock:
+            return [job.to_dict() for job in self.jobs.values() if sid is None or job.sid == sid]
+
+    def active_jobs(self, sid):
+        with self._lock:
+            return [job for job in self.jobs.values() if job.sid == sid and job.is_active]
+
+    def pause(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.state != JOB_RUNNING:
+            return False
+        job.state = JOB_PAUSED
+        self.runtime.call_soon(job._resume.clear)
+        self.runtime.call_soon(job.clock.pause)
+        return True
+
+    def resume(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.state != JOB_PAUSED:
+            return False
+        job.state = JOB_RUNNING
+        self.runtime.call_soon(job.clock.resume)
+        self.runtime.call_soon(job._resume.set)
+        return True
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or not job.is_active:
+            return False
+        if job.task is not None:
+            self.runtime.call_soon(job.task.cancel)
+        else:
+            job.state = JOB_CANCELLED
+        return True
+
+    def cancel_for_sid(self, sid):
+        """Cancel every active job started by sid"""
+        return [job.id for job in self.active_jobs(sid) if self.cancel(job.id)]
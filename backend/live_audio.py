@@ -0,0 +1,313 @@
+import io
+import time
+import wave
+import asyncio
+import logging
+import threading
+from array import array
+
+logger = logging.getLogger(__name__)
+
+LIVE_SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2  # 16-bit PCM
+ANALYSIS_FRAME_SECONDS = 0.02
+
+
+class JitterBuffer:
+    """
+    Reorders numbered audio frames that arrive out of order.
+
+    Frames are released strictly in sequence. If a frame is still missing
+    once max_pending later frames have arrived, it is treated as lost and
+    skipped so a dropped packet cannot stall the stream.
+    """
+
+    def __init__(self, max_pending=10, first_seq=0):
+        self.max_pending = max_pending
+        self.next_seq = first_seq
+        self.pending = {}
+        self.lost = 0
+
+    def push(self, seq, payload):
+        """Add a frame and return the list of payloads now ready in order"""
+        if seq < self.next_seq or seq in self.pending:
+            return []  # late duplicate
+        self.pending[seq] = payload
+
+        ready = []
+        while self.pending:
+            if self.next_seq in self.pending:
+                ready.append(self.pending.pop(self.next_seq))
+                self.next_seq += 1
+            elif len(self.pending) > self.max_pending:
+                self.lost += 1
+                self.next_seq += 1
+            else:
+                break
+        return ready
+
+
+class RingBuffer:
+    """Fixed-capacity PCM buffer addressed by absolute sample position"""
+
+    def __init__(self, capacity_seconds=120, sample_rate=LIVE_SAMPLE_RATE):
+        self.capacity = int(capacity_seconds * sample_rate) * SAMPLE_WIDTH
+        self.data = bytearray(self.capacity)
+        self.written = 0  # total bytes ever written
+
+    def write(self, pcm):
+        if len(pcm) > self.capacity:
+            # Only the newest capacity bytes can be kept
+            self.written += len(pcm) - self.capacity
+            pcm = pcm[-self.capacity:]
+        offset = self.written % self.capacity
+        first = min(len(pcm), self.capacity - offset)
+        self.data[offset:offset + first] = pcm[:first]
+        self.data[:len(pcm) - first] = pcm[first:]
+        self.written += len(pcm)
+
+    def read(self, start_sample, end_sample):
+        """Return PCM between two absolute sample positions still held in the buffer"""
+        start = max(start_sample * SAMPLE_WIDTH, self.written - self.capacity)
+        end = min(end_sample * SAMPLE_WIDTH, self.written)
+        if end <= start:
+            return b''
+        offset = start % self.capacity
+        length = end - start
+        if offset + length <= self.capacity:
+            return bytes(self.data[offset:offset + length])
+        first = self.capacity - offset
+        return bytes(self.data[offset:]) + bytes(self.data[:length - first])
+
+
+class RollingSegmenter:
+    """
+    Cuts a live PCM stream into utterances.
+
+    A segment opens on the first voiced analysis frame and closes after
+    silence_seconds of quiet or once it reaches max_segment_seconds, so a
+    long held note still produces subtitles.
+    """
+
+    def __init__(self, sample_rate=LIVE_SAMPLE_RATE, energy_threshold=500,
+                 silence_seconds=0.6, min_segment_seconds=0.5, max_segment_seconds=8.0):
+        self.sample_rate = sample_rate
+        self.frame_samples = int(sample_rate * ANALYSIS_FRAME_SECONDS)
+        self.energy_threshold = energy_threshold
+        self.silence_frames = int(silence_seconds / ANALYSIS_FRAME_SECONDS)
+        self.min_samples = int(min_segment_seconds * sample_rate)
+        self.max_samples = int(max_segment_seconds * sample_rate)
+
+        self.position = 0  # samples analysed so far
+        self.segment_start = None
+        self.quiet_frames = 0
+        self._remainder = b''
+
+    def feed(self, pcm):
+        """Analyse new PCM and return a list of closed (start_sample, end_sample) segments"""
+        pcm = self._remainder + pcm
+        frame_bytes = self.frame_samples * SAMPLE_WIDTH
+        usable = len(pcm) - len(pcm) % frame_bytes
+        self._remainder = pcm[usable:]
+
+        closed = []
+        for offset in range(0, usable, frame_bytes):
+            samples = array('h')
+            samples.frombytes(pcm[offset:offset + frame_bytes])
+            energy = sum(abs(s) for s in samples) / len(samples)
+            voiced = energy >= self.energy_threshold
+            self.position += self.frame_samples
+
+            if self.segment_start is None:
+                if voiced:
+                    self.segment_start = self.position - self.frame_samples
+                    self.quiet_frames = 0
+                continue
+
+            self.quiet_frames = 0 if voiced else self.quiet_frames + 1
+            length = self.position - self.segment_start
+            if self.quiet_frames >= self.silence_frames or length >= self.max_samples:
+                if length >= self.min_samples:
+                    closed.append((self.segment_start, self.position))
+                self.segment_start = None
+        return closed
+
+    def flush(self):
+        """Close any open segment at the current position"""
+        if self.segment_start is not None and self.position - self.segment_start >= self.min_samples:
+            segment = (self.segment_start, self.position)
+            self.segment_start = None
+            return [segment]
+        self.segment_start = None
+        return []
+
+
+def pcm_to_wav(pcm, sample_rate=LIVE_SAMPLE_RATE):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(SAMPLE_WIDTH)
+        out.setframerate(sample_rate)
+        out.writeframes(pcm)
+    return buffer.getvalue()
+
+
+class LiveSession:
+    """
+    Incremental transcribe-translate pipeline for one live audio stream.
+
+    Socket.IO handlers call push_frame() from their own thread; closed
+    segments are handed to the loop the session is bound to, transcribed and
+    translated concurrently, and emitted as 'sentence_update' events in
+    segment order.
+    """
+
+    def __init__(self, transcription_module, translation_module, split_sentences, emit,
+                 sample_rate=LIVE_SAMPLE_RATE, limiter=None, gate=None):
+        self.transcription_module = transcription_module
+        self.translation_module = translation_module
+        self.split_sentences = split_sentences
+        self.emit = emit
+        self.sample_rate = sample_rate
+        # Optional shared-pool slot held around each API call
+        self.limiter = limiter
+        # Optional coroutine awaited before each emit (e.g. while the job is paused)
+        self.gate = gate
+
+        self.jitter = JitterBuffer()
+        self.ring = RingBuffer(sample_rate=sample_rate)
+        self.segmenter = RollingSegmenter(sample_rate=sample_rate)
+        self._lock = threading.Lock()
+        # (start sample, client capture timestamp in ms, server arrival time) per frame
+        self._frame_times = []
+        self.sentence_count = 0
+        self.latencies = []
+
+        self._loop = None
+        self._queue = None
+        self.is_running = False
+
+    def bind(self, loop):
+        """Attach the session to the event loop that will run it"""
+        self._loop = loop
+
+    async def run(self):
+        """Process closed segments until stop() is called"""
+        self._loop = asyncio.get_running_loop()
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self.is_running = True
+        ordered = asyncio.Queue()
+
+        async def emit_in_order():
+            while True:
+                task = await ordered.get()
+                if task is None:
+                    return
+                for payload in await task:
+                    if self.gate is not None:
+                        await self.gate()
+                    # Numbered as sent, since segments finish processing out of order
+                    self.sentence_count += 1
+                    payload['index'] = payload['total'] = self.sentence_count
+                    self.emit('sentence_update', payload)
+
+        emitter = asyncio.ensure_future(emit_in_order())
+        tasks = []
+        try:
+            while True:
+                segment = await self._queue.get()
+                if segment is None:
+                    break
+                task = asyncio.ensure_future(self._process_segment(*segment))
+                tasks.append(task)
+                ordered.put_nowait(task)
+            ordered.put_nowait(None)
+            await emitter
+        finally:
+            emitter.cancel()
+            for task in tasks:
+                task.cancel()
+            self.is_running = False
+
+    def push_frame(self, seq, pcm, captured_at=None):
+        """Accept one PCM16 frame from the client (thread-safe)"""
+        with self._lock:
+            for payload in self.jitter.push(seq, pcm):
+                start_sample = self.ring.written // SAMPLE_WIDTH
+                self.ring.write(payload)
+                self._frame_times.append((start_sample, captured_at, time.monotonic()))
+                for start, end in self.segmenter.feed(payload):
+                    self._submit((start, end))
+
+    def stop(self):
+        """Flush the open segment and finish once queued segments are emitted"""
+        with self._lock:
+            for start, end in self.segmenter.flush():
+                self._submit((start, end))
+            self._submit(None)
+
+    def _submit(self, segment):
+        if segment is not None:
+            start, end = segment
+            captured_at, received_at = self._times_for(end)
+            # Only the timing of frames after this segment is still needed
+            self._frame_times = [t for t in self._frame_times if t[0] >= end]
+            segment = (self.ring.read(start, end), start, end, captured_at, received_at)
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._enqueue, segment)
+
+    def _enqueue(self, segment):
+        # Runs on the session loop, so the queue is created there
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._queue.put_nowait(segment)
+
+    def _times_for(self, sample):
+        captured_at, received_at = None, time.monotonic()
+        for start, frame_captured_at, frame_received_at in self._frame_times:
+            if start >= sample:
+                break
+            captured_at, received_at = frame_captured_at, frame_received_at
+        return captured_at, received_at
+
+    async def _limited(self, coroutine):
+        if self.limiter is None:
+            return await coroutine
+        async with self.limiter:
+            return await coroutine
+
+    async def _process_segment(self, pcm, start, end, captured_at, received_at):
+        """Transcribe and translate one segment, returning its sentence_update payloads (unnumbered)"""
+        try:
+            text = await self._limited(self.transcription_module.transcribe_window(
+                pcm_to_wav(pcm, self.sample_rate), f"live_{start}.wav"
+            ))
+        except Exception as e:
+            logger.warning("Live transcription error: %s", e)
+            return []
+        transcribed_at = time.monotonic()
+
+        sentences = self.split_sentences(text or "")
+        translations = await asyncio.gather(
+            *(self._limited(self.translation_module.translate_sentence(sentence)) for sentence in sentences)
+        )
+        payloads = []
+        for sentence, translation in zip(sentences, translations):
+            latency = time.monotonic() - received_at
+            self.latencies.append(latency)
+            payloads.append({
+                'sanskrit': sentence,
+                'english': translation,
+                'progress': 100,
+                'live': True,
+                'segment_start': start / self.sample_rate,
+                'segment_end': end / self.sample_rate,
+                # Echoed back so the browser can measure capture-to-display lag on its own clock
+                'captured_at': captured_at,
+                'latency': {
+                    'transcription': transcribed_at - received_at,
+                    'server_total': latency
+                }
+            })
+        return payloads
@@ -1,96 +1,399 @@
 import asyncio
+import atexit
+import logging
 import json
 import time
 import os
 import base64
-from flask import Flask, render_template, request
+from flask import Flask, Request, render_template, request
 from flask_socketio import SocketIO, emit
-import threading
-import re
-from translation_module import TranslationModule
-from transcription_module import TranscriptionModule
+from translation_module import TranslationModule, PartialTranslation, is_error
+from transcription_module import (
+    TranscriptionModule, MAX_UPLOAD_BYTES, WHISPER_MODEL, TRANSCRIPTION_LANGUAGE, timed_sentences
+)
+from live_audio import LiveSession, LIVE_SAMPLE_RATE
+from jobs import Job, JobManager, JOB_PAUSED
+from runtime import AsyncRuntime
+from media_store import MediaStore, AUDIO_EXTENSIONS
+from artifact_store import ArtifactStore
+from segmenter import split_sentences
+from playback import LatenessStats
+from metrics import REGISTRY, count, span
+from scheduler import RequestScheduler
+from outbound import Outbox
+
+logging.basicConfig(
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Uploaded files are hashed and written into the media store as they arrive,
+        # instead of being spooled to a temporary file and copied afterwards
+        return media_store.open_upload()
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config['KAPI'] = 'KAPI'
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
 
+# Shared across all clients: total concurrent transcription/translation API calls
+WORKER_POOL_SIZE = int(os.getenv('WORKER_POOL_SIZE', 8))
+# Initial guess for one translation call, refined per job as calls complete
+TRANSLATION_LATENCY_ESTIMATE = 2.0
+# Extra headroom when scheduling a translation ahead of its timestamp
+SCHEDULING_MARGIN = 0.5
+# Minimum seconds between translation_delta events for one sentence
+DELTA_INTERVAL = 0.05
+
 class RealTimeTranslator:
-    def __init__(self):
-        self.translation_module = TranslationModule()
-        self.transcription_module = TranscriptionModule()
-        self.is_processing = False
+    """Shared transcription/translation pipeline; per-client state lives on each Job"""
+    
+    def __init__(self, pool, http_client=None, media_store=None, artifact_store=None):
+        # Both modules share the runtime's pooled HTTP client and one rate limiter per model
+        self.scheduler = RequestScheduler()
+        self.translation_module = TranslationModule(http_client=http_client, scheduler=self.scheduler)
+        self.transcription_module = TranscriptionModule(
+            http_client=http_client, media_store=media_store, artifact_store=artifact_store,
+            scheduler=self.scheduler
+        )
+        self.artifact_store = artifact_store
+        self.pool = pool
+        
+        # Preload recently used translations so repeat performances start warm
+        warmed = self.translation_module.cache.warm_up()
+        logger.info("Translation cache warmed with %d entries", warmed)
         
     def split_into_sentences(self, text):
-        """Split text into meaningful sentences/phrases"""
-        # Split on common punctuation and natural breaks
-        sentences = re.split(r'[।॥\.\!\?]+|(?<=\w)\s+(?=[A-Z])', text.strip())
-        # Filter out empty strings and clean up
-        sentences = [s.strip() for s in sentences if s.strip() and len(s.strip()) > 3]
-        return sentences
+        """Split text into sentences at dandas, punctuation and line breaks (see segmenter.py)"""
+        with span('split', chars=len(text)):
+            return split_sentences(text)
     
-    async def process_audio_realtime(self, audio_file_path, delay_per_sentence=3):
-        """Process audio file and emit real-time translations"""
+    async def prefetch_translations(self, job, sentences, prefetch_depth=4, max_concurrency=3, clock=None,
+                                    stream=False):
+        """
+        Yield (index, sentence, task, partial) in order while translating ahead.
+
+        sentences is an async iterable of dicts with 'sanskrit', 'progress',
+        'total' (None while not yet known) and optional 'start'/'end' media
+        times. Up to prefetch_depth sentences beyond the one being consumed
+        are scheduled at once, with at most max_concurrency model calls in
+        flight for this job and each call holding a slot in the shared
+        worker pool. With a playback clock, a sentence whose timestamp is
+        closer than the expected translation latency is scheduled even when
+        the prefetch window is full, so it can still be ready on time.
+        Outstanding prefetches are cancelled when the generator is closed.
+
+        task resolves to the translation. With stream=True, partial is a
+        PartialTranslation that fills in while the task runs; otherwise
+        it is None.
+        """
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        slot = self.pool.slot(job.id)
+        depth = max(1, prefetch_depth)
+        queue = asyncio.Queue()
+        consumed = asyncio.Event()
+        scheduled = []
+        # Running estimate of one translation's latency, used as the scheduling lead time
+        latency = {'ewma': TRANSLATION_LATENCY_ESTIMATE}
+
+        async def translate(sentence, partial):
+            async with semaphore:
+                async with slot:
+                    started = time.monotonic()
+                    translation = await self.translation_module.translate_sentence(sentence, partial)
+                    latency['ewma'] += 0.2 * (time.monotonic() - started - latency['ewma'])
+                    return translation
+
+        async def admit(item):
+            # The queue bounds how far the producer runs ahead of the emit loop
+            while queue.qsize() >= depth:
+                timeout = None
+                if clock is not None and clock.started and item.get('start') is not None:
+                    lead_time = 2 * latency['ewma'] + SCHEDULING_MARGIN
+                    timeout = item['start'] - lead_time - clock.now()
+                    if timeout <= 0:
+                        return  # due soon: translate now to meet its timestamp
+                consumed.clear()
+                try:
+                    await asyncio.wait_for(consumed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+        async def produce():
+            async for item in sentences:
+                await admit(item)
+                partial = PartialTranslation() if stream else None
+                task = asyncio.ensure_future(translate(item['sanskrit'], partial))
+                scheduled.append(task)
+                queue.put_nowait((item, task, partial))
+            queue.put_nowait(None)
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            index = 0
+            while True:
+                get = asyncio.ensure_future(queue.get())
+                await asyncio.wait([get, producer], return_when=asyncio.FIRST_COMPLETED)
+                if not get.done():
+                    # Producer finished without queueing a sentinel: it failed
+                    get.cancel()
+                    producer.result()
+                    break
+                consumed.set()
+                item = get.result()
+                if item is None:
+                    break
+                sentence, task, partial = item
+                yield index, sentence, task, partial
+                index += 1
+        finally:
+            producer.cancel()
+            for task in scheduled:
+                task.cancel()
+            await asyncio.gather(producer, *scheduled, return_exceptions=True)
+
+    async def _stream_deltas(self, job, index, sentence, task, partial):
+        """
+        Emit translation_delta events for a sentence until its translation is done.
+
+        Each event carries the full partial 'english' so far plus the new
+        'delta'; 'reset' marks a restart (a retried request), after which
+        the client should replace rather than append.
+        """
+        sent = ''
+        while not task.done():
+            partial.changed.clear()
+            changed = asyncio.ensure_future(partial.changed.wait())
+            try:
+                await asyncio.wait([task, changed], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                changed.cancel()
+            text = partial.text
+            if task.done() or text == sent or not text:
+                continue
+            event = {
+                'index': index + 1, 'total': sentence['total'] or index + 1,
+                'sanskrit': sentence['sanskrit'], 'english': text
+            }
+            if text.startswith(sent):
+                event['delta'] = text[len(sent):]
+            else:
+                event['delta'] = text
+                event['reset'] = True
+            job.emit('translation_delta', event)
+            sent = text
+            # Batch up tokens that arrive faster than the client can usefully redraw
+            await asyncio.wait([task], timeout=DELTA_INTERVAL)
+
+    async def _transcribed_sentences(self, job, audio_file_path):
+        """Transcribe the whole file, then yield sentence dicts as prefetch_translations expects"""
+        async with self.pool.slot(job.id):
+            transcribed_text, segments = await self.transcription_module.transcribe_timed(audio_file_path)
+        
+        if not transcribed_text:
+            job.emit('status', {'message': 'Transcription failed', 'type': 'error'})
+            return
+        
+        job.emit('status', {'message': 'Transcription complete! Starting translation...', 'type': 'success'})
+        
+        sentences = timed_sentences(transcribed_text, segments)
+        
+        if not sentences:
+            job.emit('status', {'message': 'No sentences found in transcription', 'type': 'error'})
+            return
+        
+        job.emit('status', {'message': f'Processing {len(sentences)} sentences...', 'type': 'info'})
+        
+        for i, sentence in enumerate(sentences):
+            sentence.update(progress=(i + 1) / len(sentences), total=len(sentences))
+            yield sentence
+
+    async def process_audio_realtime(self, job, audio_file_path, delay_per_sentence=3,
+                                     prefetch_depth=4, max_concurrency=3, streaming=None,
+                                     timing='timestamps', stream_translation=False):
+        """
+        Process audio file and emit real-time translations
+
+        With streaming (the default for files over the 25MB upload limit)
+        the recording is transcribed window by window and translation starts
+        as soon as the first window is done; 'total' is then the number of
+        sentences known so far.
+
+        With timing='timestamps', sentences that carry Whisper timestamps
+        are emitted when the job's playback clock reaches their start time,
+        and each update reports how late it was. Sentences without
+        timestamps, or timing='fixed', fall back to delay_per_sentence.
+
+        With stream_translation, a sentence whose translation is still
+        running when it is due is shown at once: its English is sent token
+        by token as translation_delta events, then sentence_update follows
+        as usual with the final text.
+        """
+        translations = None
+        emitted = []
+        lateness = LatenessStats()
+        clock = job.clock
         try:
-            self.is_processing = True
-            
             # Check if file exists
             if not os.path.exists(audio_file_path):
-                socketio.emit('status', {'message': f'Audio file "{audio_file_path}" not found', 'type': 'error'})
+                job.emit('status', {'message': f'Audio file "{audio_file_path}" not found', 'type': 'error'})
                 return
             
-            socketio.emit('status', {'message': 'Starting audio transcription...', 'type': 'info'})
-            
-            # Step 1: Transcribe the audio using OpenRouter API
-            transcribed_text = await self.transcription_module.transcribe_audio(audio_file_path)
-            
-            if not transcribed_text:
-                socketio.emit('status', {'message': 'Transcription failed', 'type': 'error'})
-                return
+            if streaming is None:
+                streaming = os.path.getsize(audio_file_path) > MAX_UPLOAD_BYTES
             
-            socketio.emit('status', {'message': 'Transcription complete! Starting translation...', 'type': 'success'})
+            # Steps 1-2: Transcribe the audio using OpenRouter API and split into sentences
+            if streaming:
+                job.emit('status', {'message': 'Starting streaming transcription...', 'type': 'info'})
+                sentences = self.transcription_module.transcribe_stream(
+                    audio_file_path, max_concurrency=max_concurrency,
+                    limiter=self.pool.slot(job.id)
+                )
+            else:
+                job.emit('status', {'message': 'Starting audio transcription...', 'type': 'info'})
+                sentences = self._transcribed_sentences(job, audio_file_path)
             
-            # Step 2: Split into sentences
-            sentences = self.split_into_sentences(transcribed_text)
-            
-            if not sentences:
-                socketio.emit('status', {'message': 'No sentences found in transcription', 'type': 'error'})
-                return
-            
-            socketio.emit('status', {'message': f'Processing {len(sentences)} sentences...', 'type': 'info'})
-            
-            # Step 3: Process each sentence with delay
-            for i, sentence in enumerate(sentences):
-                if not self.is_processing:  # Check if user stopped
-                    break
-                    
-                # Translate the sentence
-                socketio.emit('status', {'message': f'Translating sentence {i+1}...', 'type': 'info'})
-                translation = await self.translation_module.translate_sentence(sentence)
+            # Step 3: Emit each sentence on time while translations run ahead
+            translations = self.prefetch_translations(
+                job, sentences, prefetch_depth, max_concurrency, clock if timing == 'timestamps' else None,
+                stream=stream_translation
+            )
+            next_emit_at = time.monotonic()
+            async for i, sentence, task, partial in translations:
+                timed = timing == 'timestamps' and sentence.get('start') is not None
+                if timed:
+                    # Playback starts with the first subtitle unless the client synced a position
+                    clock.start()
+                    await clock.wait_until(sentence['start'])
+                else:
+                    # Pace output only; translation time is already overlapped
+                    wait = next_emit_at - time.monotonic()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+
+                if job.state == JOB_PAUSED:
+                    await job.wait_if_paused()
+
+                job.emit('status', {'message': f'Translating sentence {i+1}...', 'type': 'info'})
                 
-                # Emit the sentence pair
-                socketio.emit('sentence_update', {
-                    'sanskrit': sentence,
+                if partial is not None and not task.done():
+                    await self._stream_deltas(job, i, sentence, task, partial)
+                translation = await task
+                
+                update = {
+                    'sanskrit': sentence['sanskrit'],
                     'english': translation,
                     'index': i + 1,
-                    'total': len(sentences),
-                    'progress': ((i + 1) / len(sentences)) * 100
-                })
+                    'total': sentence['total'] or i + 1,
+                    'progress': sentence['progress'] * 100
+                }
+                if sentence.get('start') is not None:
+                    update['start'] = sentence['start']
+                    update['end'] = sentence['end']
+                if timed:
+                    update['lateness'] = max(0.0, clock.now() - sentence['start'])
+                    lateness.record(update['lateness'])
                 
-                # Wait before next sentence (simulate real-time)
-                await asyncio.sleep(delay_per_sentence)
+                # Emit the sentence pair
+                job.emit('sentence_update', update)
+                count('sentences_emitted')
+                emitted.append({
+                    'sanskrit': sentence['sanskrit'], 'english': translation,
+                    'start': sentence.get('start'), 'end': sentence.get('end')
+                })
+                job.sentences_emitted = i + 1
+                job.progress = sentence['progress'] * 100
+                next_emit_at = time.monotonic() + delay_per_sentence
+            
+            await self._save_results(audio_file_path, emitted)
             
-            if self.is_processing:
-                socketio.emit('status', {'message': 'Translation complete!', 'type': 'success'})
-                socketio.emit('processing_complete', {'total_sentences': len(sentences)})
+            if job.sentences_emitted:
+                job.emit('status', {'message': 'Translation complete!', 'type': 'success'})
+                complete = {'total_sentences': job.sentences_emitted, 'job_id': job.id}
+                if lateness.values:
+                    complete['lateness'] = lateness.summary()
+                job.emit('processing_complete', complete)
+            elif streaming:
+                job.emit('status', {'message': 'No sentences found in transcription', 'type': 'error'})
             
         except Exception as e:
-            socketio.emit('status', {'message': f'Error: {str(e)}', 'type': 'error'})
+            job.emit('status', {'message': f'Error: {str(e)}', 'type': 'error'})
+            raise
         finally:
-            self.is_processing = False
+            # Closing the pipeline cancels outstanding prefetches (also on cancel_job)
+            if translations is not None:
+                await translations.aclose()
+    
+    async def _save_results(self, audio_file_path, sentences):
+        """Attach the sentence split and translations of a finished job to its transcript artifact"""
+        if self.artifact_store is None or not sentences:
+            return
+        audio_hash = await self.transcription_module.audio_hash(audio_file_path)
+        if audio_hash is None:
+            return
+        artifact = self.artifact_store.latest(audio_hash, WHISPER_MODEL, TRANSCRIPTION_LANGUAGE)
+        if artifact is not None:
+            # Lines that failed to translate are stored untranslated, not with the error text
+            sentences = [
+                dict(sentence, english=None) if sentence.get('english') and is_error(sentence['english']) else sentence
+                for sentence in sentences
+            ]
+            self.artifact_store.save_sentences(artifact['id'], sentences)
+    
+    async def replay_artifact(self, job, artifact_id, delay_per_sentence=3, timing='timestamps'):
+        """Re-emit a stored job's sentences at their timestamps or a fixed pace, without calling the APIs"""
+        sentences = self.artifact_store.load_sentences(artifact_id)
+        if not sentences:
+            job.emit('status', {'message': f'No stored translations for artifact {artifact_id}', 'type': 'error'})
+            return
+        
+        job.emit('status', {'message': f'Replaying {len(sentences)} sentences...', 'type': 'info'})
+        for i, sentence in enumerate(sentences):
+            if timing == 'timestamps' and sentence['start'] is not None:
+                job.clock.start()
+                await job.clock.wait_until(sentence['start'])
+            await job.wait_if_paused()
+            update = {
+                'sanskrit': sentence['sanskrit'],
+                'english': sentence['english'] or '',
+                'index': i + 1,
+                'total': len(sentences),
+                'progress': ((i + 1) / len(sentences)) * 100
+            }
+            if sentence['start'] is not None:
+                update['start'] = sentence['start']
+                update['end'] = sentence['end']
+            job.emit('sentence_update', update)
+            job.sentences_emitted = i + 1
+            job.progress = ((i + 1) / len(sentences)) * 100
+            if i + 1 < len(sentences) and (timing != 'timestamps' or sentences[i + 1]['start'] is None):
+                await asyncio.sleep(delay_per_sentence)
+        
+        job.emit('status', {'message': 'Replay complete!', 'type': 'success'})
+        job.emit('processing_complete', {'total_sentences': len(sentences), 'job_id': job.id})
+
+# One persistent event loop and HTTP client for the whole server
+runtime = AsyncRuntime()
+atexit.register(runtime.shutdown)
+
+# Global job manager and shared translator
+job_manager = JobManager(runtime, pool_size=WORKER_POOL_SIZE)
+media_store = MediaStore()
+artifact_store = ArtifactStore()
+translator = RealTimeTranslator(job_manager.pool, runtime.http_client, media_store, artifact_store)
+# Writes back cache hits not yet recorded in last_used
+atexit.register(translator.translation_module.cache.close)
+
+# Per-client bounded queues between jobs and Socket.IO, sent as acknowledged batches
+outbox = Outbox(socketio)
+outbox.start()
 
-# Global translator instance
-translator = RealTimeTranslator()
+# Live microphone sessions by Socket.IO sid
+live_sessions = {}
 
 @app.route('/')
 def index():
@@ -100,60 +403,313 @@ def index():
 def upload_file():
     """Handle audio file uploads"""
     try:
-        if 'audio' not in request.files:
+        # Parsing the form receives the file straight into the media store (see UploadRequest)
+        with span('upload'):
+            files = request.files
+        if 'audio' not in files:
             return {'error': 'No audio file provided'}, 400
         
-        file = request.files['audio']
+        file = files['audio']
         if file.filename == '':
             return {'error': 'No file selected'}, 400
         
-        # Save the uploaded file
-        filename = f"uploaded_audio_{int(time.time())}.{file.filename.split('.')[-1]}"
-        filepath = os.path.join(os.getcwd(), filename)
-        file.save(filepath)
+        extension = os.path.splitext(file.filename)[1].lower()
+        if extension not in AUDIO_EXTENSIONS:
+            return {'error': f'Unsupported audio format: {extension or "none"}'}, 400
         
-        return {'success': True, 'filename': filename}, 200
+        sha256, filepath, duplicate = media_store.commit(file.stream, extension)
+        count('bytes_uploaded', os.path.getsize(filepath), destination='media_store')
+        result = {'success': True, 'filename': filepath, 'sha256': sha256, 'duplicate': duplicate}
+        
+        # A known recording comes back with its transcript, skipping transcription
+        artifact = artifact_store.latest(sha256, WHISPER_MODEL, TRANSCRIPTION_LANGUAGE)
+        if artifact:
+            transcript = artifact_store.get_transcript(sha256, WHISPER_MODEL, TRANSCRIPTION_LANGUAGE)
+            stored = artifact_store.load_sentences(artifact['id'])
+            result['artifact_id'] = artifact['id']
+            result['transcript'] = transcript
+            result['sentences'] = [s['sanskrit'] for s in stored] or translator.split_into_sentences(transcript or '')
+        
+        return result, 200
     
     except Exception as e:
         return {'error': str(e)}, 500
 
+def query_count(name, default, maximum=None):
+    """A non-negative integer query parameter, capped at maximum; None if it is not one"""
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        return None
+    if value < 0:
+        return None
+    return value if maximum is None else min(value, maximum)
+
+@app.route('/artifacts')
+def list_artifacts():
+    """List stored transcription/translation artifacts, newest first"""
+    limit = query_count('limit', 100, 1000)
+    offset = query_count('offset', 0)
+    if limit is None or offset is None:
+        return {'error': 'limit and offset must be non-negative integers'}, 400
+    return {'artifacts': artifact_store.list_artifacts(limit, offset)}, 200
+
+@app.route('/artifacts/search')
+def search_artifacts():
+    """Search stored sentences and translations"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return {'error': 'Missing query parameter q'}, 400
+    limit = query_count('limit', 50, 500)
+    if limit is None:
+        return {'error': 'limit must be a non-negative integer'}, 400
+    return {'results': artifact_store.search(query, limit)}, 200
+
+@app.route('/artifacts/<int:artifact_id>')
+def get_artifact(artifact_id):
+    artifact = artifact_store.get(artifact_id)
+    if artifact is None:
+        return {'error': 'Artifact not found'}, 404
+    artifact['transcript'] = artifact_store.load_transcript(artifact_id)
+    artifact['segments'] = artifact_store.load_segments(artifact_id)
+    artifact['sentences'] = artifact_store.load_sentences(artifact_id)
+    return artifact, 200
+
+def collect_job_metrics():
+    """Per-job counters and worker pool usage, read at scrape time"""
+    jobs = [job_manager.get(job['job_id']) for job in job_manager.list_jobs()]
+    jobs = [job for job in jobs if job is not None]
+    stats = job_manager.pool.stats()
+    outbox_stats = outbox.stats()
+    return [
+        ('translator_job_events', 'gauge', 'Per-job counters for recent jobs',
+         [({'job_id': job.id, 'kind': job.kind, 'counter': name}, value)
+          for job in jobs for name, value in job.counters.items()]),
+        ('translator_active_jobs', 'gauge', 'Jobs queued, running or paused',
+         [({}, sum(1 for job in jobs if job.is_active))]),
+        ('translator_pool_slots_in_use', 'gauge', 'Worker pool slots held by API calls',
+         [({}, stats['in_use'])]),
+        ('translator_pool_waiters', 'gauge', 'API calls waiting for a worker pool slot',
+         [({}, sum(stats['waiting'].values()))]),
+        ('translator_outbound_queued', 'gauge', 'Messages queued for clients',
+         [({}, outbox_stats['queued'])]),
+        ('translator_clients_behind', 'gauge', 'Clients with a full window of unacknowledged batches',
+         [({}, outbox_stats['behind'])])
+    ]
+
+REGISTRY.register_collector(collect_job_metrics)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint"""
+    return REGISTRY.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/jobs/<job_id>/profile')
+def job_profile(job_id):
+    """Collapsed stacks from a job started with profiling, for flame graph tools"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return {'error': 'Job not found'}, 404
+    if job.profile is None:
+        return {'error': 'No profile for this job (start it with "profile": true and wait for it to finish)'}, 404
+    return job.profile, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+@app.route('/jobs')
+def list_jobs():
+    """List all jobs across clients"""
+    return {
+        'jobs': job_manager.list_jobs(),
+        'pool': job_manager.pool.stats(),
+        'clients': outbox.stats(),
+        'models': translator.scheduler.stats()
+    }, 200
+
 @socketio.on('connect')
-def handle_connect():
-    print('Client connected')
-    emit('status', {'message': 'Connected to server', 'type': 'success'})
+def handle_connect(auth=None):
+    # Clients opt in to batched, acknowledged job events with io({auth: {batch: true}}),
+    # adding encoding: 'msgpack' for msgpack batches; others get plain events
+    auth = auth or {}
+    encoding = outbox.connect(request.sid, auth.get('encoding', 'json'), bool(auth.get('batch')))
+    logger.info('Client connected (%s)', f'{encoding} batches' if encoding else 'plain events')
+    emit('status', {'message': 'Connected to server', 'type': 'success', 'batch': encoding is not None,
+                    'encoding': encoding})
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    print('Client disconnected')
-    translator.is_processing = False
+    logger.info('Client disconnected')
+    # Only this client's jobs are stopped
+    job_manager.cancel_for_sid(request.sid)
+    live_sessions.pop(request.sid, None)
+    outbox.disconnect(request.sid)
+
+def create_job(kind, description):
+    """Create a job for the requesting client and join it to the job's room"""
+    job = Job(request.sid, kind, description, outbox.emit)
+    outbox.join(request.sid, job.room)
+    return job
+
+def start_job(kind, description, coroutine_function, profile=False, job=None):
+    """Run coroutine_function(job) for the requesting client, on a new job unless one is given"""
+    job = job or create_job(kind, description)
+    job_manager.start(job, coroutine_function, profile=profile)
+    emit('job_started', job.to_dict())
+    return job
 
 @socketio.on('start_processing')
 def handle_start_processing(data):
     audio_file = data.get('audio_file', 'chunk_1.wav')
     delay = data.get('delay', 3)  # seconds between sentences
+    prefetch_depth = max(0, int(data.get('prefetch_depth', 4)))  # sentences translated ahead
+    max_concurrency = max(1, int(data.get('max_concurrency', 3)))  # translation calls in flight
+    streaming = data.get('streaming')  # None: stream only files over the upload limit
+    stream_translation = bool(data.get('stream_translation', False))  # send translation_delta events
+    timing = data.get('timing', 'timestamps')  # 'timestamps' or 'fixed' (always use delay)
+    profile = bool(data.get('profile', False))  # sample the job's stacks, see /jobs/<id>/profile
     
-    if translator.is_processing:
+    if any(job.kind == 'file' for job in job_manager.active_jobs(request.sid)):
         emit('status', {'message': 'Processing already in progress', 'type': 'warning'})
         return
     
-    # Run the processing in a separate thread
-    def run_processing():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(translator.process_audio_realtime(audio_file, delay))
-        loop.close()
-    
-    thread = threading.Thread(target=run_processing)
-    thread.daemon = True
-    thread.start()
+    start_job('file', audio_file, lambda job: translator.process_audio_realtime(
+        job, audio_file, delay, prefetch_depth, max_concurrency, streaming, timing, stream_translation
+    ), profile=profile)
     
     emit('status', {'message': 'Processing started...', 'type': 'info'})
 
 @socketio.on('stop_processing')
 def handle_stop_processing():
-    translator.is_processing = False
+    for job in job_manager.active_jobs(request.sid):
+        if job.kind == 'file':
+            job_manager.cancel(job.id)
     emit('status', {'message': 'Processing stopped by user', 'type': 'warning'})
 
+@socketio.on('start_live')
+def handle_start_live(data=None):
+    """Start incremental translation of audio frames streamed from the browser"""
+    data = data or {}
+    encoding = data.get('encoding', 'pcm16')
+    if encoding != 'pcm16':
+        emit('status', {'message': f'Unsupported live audio encoding "{encoding}", send 16-bit PCM', 'type': 'error'})
+        return
+    
+    if request.sid in live_sessions:
+        emit('status', {'message': 'Live translation already running', 'type': 'warning'})
+        return
+    
+    sample_rate = int(data.get('sample_rate', LIVE_SAMPLE_RATE))
+    
+    # Registered before the job starts so frames sent right after start_live
+    # are buffered for it rather than dropped; the job only drives the session
+    job = create_job('live', 'microphone')
+    session = LiveSession(
+        translator.transcription_module,
+        translator.translation_module,
+        translator.split_into_sentences,
+        job.emit,
+        sample_rate=sample_rate,
+        limiter=translator.pool.slot(job.id),
+        gate=job.wait_if_paused
+    )
+    session.bind(runtime.loop)
+    live_sessions[request.sid] = session
+    
+    async def run_live(job):
+        try:
+            await session.run()
+        finally:
+            job.sentences_emitted = session.sentence_count
+            if live_sessions.get(job.sid) is session:
+                del live_sessions[job.sid]
+    
+    start_job('live', 'microphone', run_live, job=job)
+    emit('status', {'message': 'Live translation started, listening...', 'type': 'info'})
+
+@socketio.on('audio_frame')
+def handle_audio_frame(data):
+    """Receive one numbered PCM16 frame: {'seq', 'pcm', 't' (capture time in ms)}"""
+    session = live_sessions.get(request.sid)
+    if session is None:
+        return
+    session.push_frame(int(data['seq']), bytes(data['pcm']), data.get('t'))
+
+@socketio.on('stop_live')
+def handle_stop_live():
+    session = live_sessions.pop(request.sid, None)
+    if session is None:
+        return
+    session.stop()
+    emit('status', {'message': 'Live translation stopped', 'type': 'warning'})
+
+@socketio.on('replay_job')
+def handle_replay_job(data):
+    """Replay a stored artifact: {'artifact_id', 'delay', 'timing'}"""
+    artifact_id = int(data.get('artifact_id', 0))
+    delay = data.get('delay', 3)
+    timing = data.get('timing', 'timestamps')
+    if artifact_store.get(artifact_id) is None:
+        emit('status', {'message': f'Artifact {artifact_id} not found', 'type': 'error'})
+        return
+    
+    start_job('replay', f'artifact {artifact_id}', lambda job: translator.replay_artifact(job, artifact_id, delay, timing))
+
+@socketio.on('list_jobs')
+def handle_list_jobs(data=None):
+    """List jobs; pass {'all': true} to include other clients' jobs"""
+    data = data or {}
+    emit('jobs_list', {'jobs': job_manager.list_jobs(None if data.get('all') else request.sid)})
+
+@socketio.on('join_job')
+def handle_join_job(data):
+    """Watch another client's job, e.g. audience devices following a performance"""
+    job = job_manager.get(data.get('job_id'))
+    if job is None:
+        emit('status', {'message': 'Job not found', 'type': 'error'})
+        return
+    outbox.join(request.sid, job.room)
+    emit('status', {'message': f'Following job {job.id}', 'type': 'info'})
+
+@socketio.on('leave_job')
+def handle_leave_job(data):
+    job = job_manager.get(data.get('job_id'))
+    if job is not None:
+        outbox.leave(request.sid, job.room)
+
+@socketio.on('playback_position')
+def handle_playback_position(data):
+    """Sync a job's playback clock to the client's player: {'job_id', 'position', 'latency'}"""
+    job = job_manager.get(data.get('job_id'))
+    if job is None or not job.is_active:
+        return
+    # The clock lives on the runtime loop, so adjust it there
+    runtime.call_soon(job.clock.sync, float(data['position']), float(data.get('latency', 0.0)))
+
+def control_job(action, data):
+    job_id = (data or {}).get('job_id')
+    job = job_manager.get(job_id)
+    if job is None:
+        emit('status', {'message': 'Job not found', 'type': 'error'})
+        return
+    # Clients following a job with join_job only watch it
+    if job.sid != request.sid:
+        emit('status', {'message': f'Only the client that started job {job_id} can {action} it', 'type': 'error'})
+        return
+    if not getattr(job_manager, action)(job_id):
+        emit('status', {'message': f'Cannot {action} job {job_id}', 'type': 'warning'})
+        return
+    emit('job_updated', job_manager.get(job_id).to_dict())
+
+@socketio.on('pause_job')
+def handle_pause_job(data):
+    control_job('pause', data)
+
+@socketio.on('resume_job')
+def handle_resume_job(data):
+    control_job('resume', data)
+
+@socketio.on('cancel_job')
+def handle_cancel_job(data):
+    control_job('cancel', data)
+
 @socketio.on('test_connection')
 def handle_test():
     emit('status', {'message': 'WebSocket connection working!', 'type': 'success'})
@@ -162,18 +718,18 @@ def handle_test():
 def handle_list_files():
     """List available audio files in the directory"""
     try:
-        audio_extensions = ['.mp3', '.wav', '.m4a', '.aac', '.ogg', '.flac']
         audio_files = []
         
         for file in os.listdir('.'):
-            if any(file.lower().endswith(ext) for ext in audio_extensions):
+            if any(file.lower().endswith(ext) for ext in AUDIO_EXTENSIONS):
                 audio_files.append(file)
+        audio_files.extend(media_store.list_files())
         
         emit('audio_files_list', {'files': audio_files})
     except Exception as e:
         emit('status', {'message': f'Error listing files: {str(e)}', 'type': 'error'})
 
 if __name__ == '__main__':
-    print("Starting Real-Time Sanskrit Translation Server...")
-    print("Access the application at: http://localhost:5000")
+    logger.info("Starting Real-Time Sanskrit Translation Server...")
+    logger.info("Access the application at: http://localhost:5000")
     socketio.run(app, debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
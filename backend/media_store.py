@@ -0,0 +1,126 @@
+import os
+import hashlib
+import tempfile
+import threading
+
+MEDIA_DIR = os.getenv('MEDIA_DIR', 'media')
+CHUNK_SIZE = 1024 * 1024  # 1MB
+AUDIO_EXTENSIONS = ['.mp3', '.wav', '.m4a', '.aac', '.ogg', '.flac', '.webm', '.opus']
+
+
+class MediaUpload:
+    """
+    Writable file for an incoming recording, hashed as it is written.
+
+    The data goes to a temporary file inside the store, so MediaStore.commit()
+    only has to rename it; closing an upload that was not committed deletes it.
+    """
+
+    def __init__(self, root):
+        fd, self.temp_path = tempfile.mkstemp(dir=root, suffix='.part')
+        self.file = os.fdopen(fd, 'w+b')
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.file.write(data)
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+        if self.temp_path is not None:
+            try:
+                os.remove(self.temp_path)
+            except FileNotFoundError:
+                pass
+            self.temp_path = None
+
+
+class MediaStore:
+    """
+    Content-addressed storage for uploaded recordings.
+
+    Files are stored as <sha256>.<ext> under the media directory, so the
+    same recording uploaded twice is kept once. The hash also keys the
+    ArtifactStore, so a repeat upload never needs transcribing again.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or MEDIA_DIR
+        os.makedirs(self.root, exist_ok=True)
+        # (path, size, mtime) -> sha256 for files hashed outside the store
+        self._hash_cache = {}
+        self._lock = threading.Lock()
+
+    def open_upload(self):
+        """A MediaUpload to write a recording into, e.g. as a request's file stream"""
+        return MediaUpload(self.root)
+
+    def commit(self, upload, extension):
+        """
+        Keep a fully written MediaUpload as <sha256>.<extension>.
+
+        Returns (sha256, path, duplicate) where duplicate is True if the
+        content was already stored, in which case the upload is discarded.
+        """
+        extension = extension.lower().lstrip('.')
+        upload.file.close()
+        sha256 = upload.digest.hexdigest()
+        path = os.path.join(self.root, f"{sha256}.{extension}")
+        if os.path.exists(path):
+            upload.close()
+            return sha256, path, True
+        os.replace(upload.temp_path, path)
+        upload.temp_path = None
+        return sha256, path, False
+
+    def save_stream(self, stream, extension):
+        """
+        Copy a file-like stream into the store in fixed-size chunks.
+
+        The SHA-256 is computed while writing. Returns (sha256, path, duplicate)
+        as commit() does.
+        """
+        upload = self.open_upload()
+        try:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                upload.write(chunk)
+        except BaseException:
+            upload.close()
+            raise
+        return self.commit(upload, extension)
+
+    def hash_for(self, path):
+        """SHA-256 of an audio file; free for stored files, memoized for others"""
+        name, _ = os.path.splitext(os.path.basename(path))
+        if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.root) and len(name) == 64:
+            return name
+
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+        with self._lock:
+            if key in self._hash_cache:
+                return self._hash_cache[key]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        with self._lock:
+            self._hash_cache[key] = digest.hexdigest()
+        return self._hash_cache[key]
+
+    def list_files(self):
+        """Stored recordings as paths relative to the working directory"""
+        return sorted(
+            os.path.join(self.root, name) for name in os.listdir(self.root)
+            if any(name.lower().endswith(ext) for ext in AUDIO_EXTENSIONS)
+        )
@@ -0,0 +1,232 @@
+import time
+import asyncio
+import logging
+import weakref
+import threading
+import contextvars
+import collections
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers cache hits through slow long-audio transcriptions
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# The Job whose task is running; child tasks inherit it, so counters land on the right job
+current_job = contextvars.ContextVar('current_job', default=None)
+# asyncio task -> id of the job it works for, read by the sampling profiler
+task_jobs = weakref.WeakKeyDictionary()
+
+
+class _Metric:
+    def __init__(self, name, documentation, label_names=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.label_names, key)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter(_Metric):
+    """Monotonic counter, optionally split by labels"""
+
+    type = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = collections.defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{self._format_labels(key)} {value:g}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram in the Prometheus exposition format"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, documentation, label_names, registry)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            else:
+                state[len(self.buckets)] += 1
+            state[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state[:-1]):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f"{self.name}_bucket{self._format_labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {state[-1]:g}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Metrics plus collector callbacks, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def register_collector(self, collector):
+        """collector() returns (name, type, documentation, [(labels dict, value), ...]) tuples"""
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        for collector in self.collectors:
+            for name, metric_type, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                    lines.append(f"{name}{{{label_text}}} {value:g}" if label_text else f"{name} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+SPAN_SECONDS = Histogram(
+    'translator_span_seconds', 'Duration of pipeline stages', ['span']
+)
+API_CALL_SECONDS = Histogram(
+    'translator_api_call_seconds', 'Latency of transcription and translation API calls',
+    ['model', 'path', 'outcome']
+)
+COUNTERS = {
+    'cache_hits': Counter('translator_cache_hits_total', 'Translation cache hits'),
+    'cache_misses': Counter('translator_cache_misses_total', 'Translation cache misses'),
+    'fallbacks': Counter('translator_fallbacks_total', 'Fallback paths taken', ['stage']),
+    'bytes_uploaded': Counter('translator_bytes_uploaded_total', 'Audio bytes received or sent', ['destination']),
+    'api_requests': Counter('translator_api_requests_total', 'HTTP requests sent to the API, retries included',
+                            ['endpoint']),
+    'tokens': Counter('translator_tokens_total', 'Tokens reported by the API', ['model', 'kind']),
+    'sentences_emitted': Counter('translator_sentences_emitted_total', 'Subtitles sent to clients'),
+    'retries': Counter('translator_retries_total', 'API calls retried after an error', ['model', 'reason']),
+    'circuit_rejections': Counter('translator_circuit_rejections_total', 'Calls refused by an open circuit breaker',
+                                  ['model']),
+    'hedges': Counter('translator_hedges_total', 'Hedged requests racing the fallback model', ['outcome']),
+    'memory_matches': Counter('translator_memory_matches_total', 'Translation-memory lookups by match kind',
+                              ['kind']),
+    'preprocess_input_bytes': Counter('translator_preprocess_input_bytes_total',
+                                      'Size of recordings before preprocessing'),
+    'preprocess_output_bytes': Counter('translator_preprocess_output_bytes_total',
+                                       'Size of the audio uploaded after preprocessing'),
+    'preprocess_seconds': Counter('translator_preprocess_seconds_total',
+                                  'Time spent decoding, trimming and encoding audio'),
+    'messages_sent': Counter('translator_messages_sent_total', 'Messages delivered to clients in batches',
+                             ['encoding']),
+    'messages_coalesced': Counter('translator_messages_coalesced_total',
+                                  'Queued client messages replaced by a newer status or delta'),
+    'messages_dropped': Counter('translator_messages_dropped_total',
+                                'Messages dropped for clients that fell behind', ['event']),
+}
+
+
+def bind_job(job):
+    """Make job the current job for this task and every task it creates"""
+    current_job.set(job)
+    task = asyncio.current_task()
+    if task is not None:
+        task_jobs[task] = job.id
+
+
+def job_task_factory(loop, coro, **kwargs):
+    """Event loop task factory that tags new tasks with the job creating them"""
+    task = asyncio.Task(coro, loop=loop, **kwargs)
+    job = current_job.get()
+    if job is not None:
+        task_jobs[task] = job.id
+    return task
+
+
+def count(name, amount=1, **labels):
+    """Increment a global counter and the same counter on the current job"""
+    COUNTERS[name].inc(amount, **labels)
+    job = current_job.get()
+    if job is not None:
+        job.counters[name] += amount
+
+
+class span:
+    """
+    Time a pipeline stage into translator_span_seconds.
+
+    A plain context manager, so it can also wrap awaits. Extra fields are only
+    logged, and only when DEBUG logging is enabled; more can be attached
+    inside the block with span.fields.update(). With model set the call is
+    also recorded in translator_api_call_seconds, labelled by path
+    (primary, fallback, batch...) and outcome.
+    """
+
+    __slots__ = ('name', 'fields', 'model', 'path', 'started')
+
+    def __init__(self, name, model=None, path=None, **fields):
+        self.name = name
+        self.model = model
+        self.path = path
+        self.fields = fields
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.started
+        SPAN_SECONDS.observe(duration, span=self.name)
+        outcome = 'ok' if exc_type is None else 'error'
+        if self.model is not None:
+            API_CALL_SECONDS.observe(duration, model=self.model, path=self.path or '', outcome=outcome)
+        if logger.isEnabledFor(logging.DEBUG):
+            job = current_job.get()
+            logger.debug(
+                "span=%s duration_ms=%.1f outcome=%s job=%s model=%s path=%s %s",
+                self.name, duration * 1000, outcome, job.id if job else '-', self.model or '-',
+                self.path or '-', ' '.join(f"{k}={v}" for k, v in self.fields.items())
+            )
+        return False
@@ -0,0 +1,327 @@
+import json
+import time
+import logging
+import threading
+from collections import Counter, OrderedDict
+
+from metrics import count
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None  # clients asking for msgpack get JSON
+
+logger = logging.getLogger(__name__)
+
+# Messages held for one client before the oldest are dropped or summarized
+MAX_PENDING = 64
+# Messages sent to a client in one 'batch' event
+MAX_BATCH = 32
+# Batches a client may have unacknowledged before its messages wait in its queue
+SEND_WINDOW = 2
+# A batch not acknowledged within this long is assumed lost, reopening the window
+ACK_TIMEOUT = 10.0
+# Messages emitted within this long of each other go out in one batch
+BATCH_INTERVAL = 0.02
+ENCODINGS = ('json', 'msgpack')
+
+
+class OutboundMessage:
+    """One event for clients, encoded at most once per encoding however many clients get it"""
+
+    __slots__ = ('event', 'data', 'key', 'encoded')
+
+    def __init__(self, event, data):
+        self.event = event
+        self.data = data
+        self.key = coalesce_key(event, data)
+        self.encoded = {}
+
+    def encode(self, encoding):
+        if encoding not in self.encoded:
+            if encoding == 'msgpack':
+                self.encoded[encoding] = msgpack.packb([self.event, self.data], use_bin_type=True)
+            else:
+                self.encoded[encoding] = json.dumps([self.event, self.data], ensure_ascii=False,
+                                                    separators=(',', ':'))
+        return self.encoded[encoding]
+
+
+def coalesce_key(event, data):
+    """Messages with the same key supersede each other in a client's queue; None never does"""
+    if event == 'status' and data.get('type') != 'error':
+        return 'status'
+    if event == 'translation_delta':
+        return ('translation_delta', data.get('index'))
+    return None
+
+
+def merge_delta(old, new):
+    """One translation_delta event equivalent to old followed by new"""
+    if new.data.get('reset'):
+        return new
+    data = dict(new.data)
+    data['delta'] = old.data.get('delta', '') + new.data.get('delta', '')
+    if old.data.get('reset'):
+        data['reset'] = True
+    return OutboundMessage(new.event, data)
+
+
+class ClientQueue:
+    """
+    Bounded queue of messages waiting for one client.
+
+    A newer status replaces a queued one, consecutive translation deltas
+    for a sentence merge into one, and deltas are dropped once that
+    sentence's final sentence_update is queued. Past max_pending, the
+    oldest deltas and statuses are dropped first, then the oldest
+    sentence updates, which are summarized in a single 'sentences_skipped'
+    message so the client can show that it jumped ahead.
+    """
+
+    def __init__(self, sid, encoding='json', max_pending=MAX_PENDING):
+        self.sid = sid
+        self.encoding = encoding
+        self.max_pending = max_pending
+        self.pending = OrderedDict()  # coalescing key (or sequence number) -> OutboundMessage
+        self.sequence = 0
+        self.skipped = None  # summary of dropped sentence updates not yet sent
+        self.batches = 0
+        self.outstanding = {}  # id of each unacknowledged batch -> when it was sent
+
+    def __len__(self):
+        return len(self.pending) + (self.skipped is not None)
+
+    @property
+    def in_flight(self):
+        return len(self.outstanding)
+
+    def sent(self):
+        """Record a batch as sent; returns the id its acknowledgement must carry"""
+        self.batches += 1
+        self.outstanding[self.batches] = time.monotonic()
+        return self.batches
+
+    def put(self, message, outcomes):
+        """Queue message; tallies what was coalesced or dropped in the outcomes Counter"""
+        key = message.key
+        if key is not None and key in self.pending:
+            old = self.pending.pop(key)
+            if message.event == 'translation_delta':
+                message = merge_delta(old, message)
+            outcomes['coalesced'] += 1
+        elif key is None:
+            self.sequence += 1
+            key = self.sequence
+        if message.event == 'sentence_update':
+            # Partial text for this sentence is stale once the final text is queued
+            if self.pending.pop(('translation_delta', message.data.get('index')), None) is not None:
+                outcomes['coalesced'] += 1
+        self.pending[key] = message
+        while len(self) > self.max_pending:
+            outcomes[self._shed()] += 1
+
+    def _shed(self):
+        """Drop one message to make room; returns its event"""
+        # Statuses and deltas, which newer messages would replace anyway, go first
+        for key, message in self.pending.items():
+            if message.key is not None:
+                break
+        else:
+            key, message = next(iter(self.pending.items()))
+        del self.pending[key]
+        if message.event == 'sentence_update':
+            index = message.data.get('index')
+            if self.skipped is None:
+                self.skipped = {'count': 0, 'first_index': index, 'last_index': index}
+            self.skipped['count'] += 1
+            self.skipped['last_index'] = index
+        return message.event
+
+    def take(self, limit=MAX_BATCH):
+        """Remove and return up to limit messages, oldest first"""
+        batch = []
+        if self.skipped is not None:
+            batch.append(OutboundMessage('sentences_skipped', self.skipped))
+            self.skipped = None
+        while self.pending and len(batch) < limit:
+            batch.append(self.pending.popitem(last=False)[1])
+        return batch
+
+
+class Outbox:
+    """
+    Outbound message layer between jobs and Socket.IO clients.
+
+    emit() has the signature of socketio.emit for room messages. Clients
+    that asked for batching when connecting only get the message queued
+    (see ClientQueue), and emit() returns at once, so a slow client can
+    neither block a job nor grow the server's memory without bound. A
+    sender thread delivers each such client's queue as 'batch' events (a
+    list of [event, data] pairs, encoded once per message as JSON text or,
+    for clients that asked for it, msgpack bytes) and lets at most
+    SEND_WINDOW batches per client go unacknowledged; until the client
+    acknowledges one, its messages wait and coalesce in its queue. Other
+    clients keep getting each event as a plain Socket.IO emit.
+
+    Job rooms are joined and left here (join/leave) rather than with
+    Flask-SocketIO's join_room, and clients must be registered with
+    connect().
+    """
+
+    def __init__(self, socketio, max_pending=MAX_PENDING, window=SEND_WINDOW):
+        self.socketio = socketio
+        self.max_pending = max_pending
+        self.window = window
+        self.clients = {}  # sid -> ClientQueue, for batching clients
+        self.plain = set()  # sids of clients getting plain emits
+        self.rooms = {}  # room -> set of batching sids
+        self._ready = set()  # sids with messages and an open window
+        self._wakeup = threading.Condition(threading.Lock())
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='outbox', daemon=True)
+        self._thread.start()
+
+    def connect(self, sid, encoding='json', batch=False):
+        """Register a client; returns the batch encoding it will get, or None for plain emits"""
+        if not batch:
+            with self._wakeup:
+                self.plain.add(sid)
+            return None
+        if encoding not in ENCODINGS or (encoding == 'msgpack' and msgpack is None):
+            encoding = 'json'
+        with self._wakeup:
+            self.clients[sid] = ClientQueue(sid, encoding, self.max_pending)
+        return encoding
+
+    def disconnect(self, sid):
+        # Socket.IO drops a disconnected client from its rooms itself
+        with self._wakeup:
+            self.plain.discard(sid)
+            self.clients.pop(sid, None)
+            self._ready.discard(sid)
+            for room, members in list(self.rooms.items()):
+                members.discard(sid)
+                if not members:
+                    del self.rooms[room]
+
+    def join(self, sid, room):
+        if sid in self.plain:
+            self.socketio.server.enter_room(sid, room, namespace='/')
+            return
+        with self._wakeup:
+            self.rooms.setdefault(room, set()).add(sid)
+
+    def leave(self, sid, room):
+        if sid in self.plain:
+            self.socketio.server.leave_room(sid, room, namespace='/')
+            return
+        with self._wakeup:
+            members = self.rooms.get(room)
+            if members is not None:
+                members.discard(sid)
+                if not members:
+                    del self.rooms[room]
+
+    def emit(self, event, data, to=None):
+        """Send event to every client in room `to` (every client without it)"""
+        # Only clients getting plain emits are in Socket.IO's own rooms
+        if to is not None:
+            self.socketio.emit(event, data, to=to)
+        else:
+            for sid in list(self.plain):
+                self.socketio.emit(event, data, to=sid)
+        message = OutboundMessage(event, data)
+        outcomes = Counter()
+        with self._wakeup:
+            sids = self.rooms.get(to, ()) if to is not None else self.clients
+            for sid in sids:
+                client = self.clients.get(sid)
+                if client is None:
+                    continue
+                client.put(message, outcomes)
+                if client.in_flight < self.window:
+                    self._ready.add(sid)
+            if self._ready:
+                self._wakeup.notify()
+        # Counted once per emit rather than per client
+        coalesced = outcomes.pop('coalesced', 0)
+        if coalesced:
+            count('messages_coalesced', coalesced)
+        for dropped_event, dropped in outcomes.items():
+            count('messages_dropped', dropped, event=dropped_event)
+
+    def stats(self):
+        with self._wakeup:
+            return {
+                'clients': len(self.clients) + len(self.plain),
+                'batched': len(self.clients),
+                'queued': sum(len(client) for client in self.clients.values()),
+                'behind': sum(1 for client in self.clients.values() if client.in_flight >= self.window)
+            }
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                if not self._ready:
+                    self._wakeup.wait(timeout=ACK_TIMEOUT / 2)
+                self._expire_acks()
+            # Let a burst of emits (status + sentence_update + ...) gather into one batch
+            time.sleep(BATCH_INTERVAL)
+            with self._wakeup:
+                batches = []
+                for sid in self._ready:
+                    client = self.clients.get(sid)
+                    if client is None or client.in_flight >= self.window:
+                        continue
+                    batch = client.take()
+                    if batch:
+                        batches.append((client, client.sent(), batch))
+                self._ready = {
+                    client.sid for client, _, _ in batches if len(client) and client.in_flight < self.window
+                }
+            for client, batch_id, batch in batches:
+                self._send(client, batch_id, batch)
+
+    def _send(self, client, batch_id, batch):
+        if client.encoding == 'msgpack':
+            # A msgpack array is its header followed by the already encoded items
+            payload = bytearray(msgpack.Packer().pack_array_header(len(batch)))
+            for message in batch:
+                payload += message.encode('msgpack')
+            payload = bytes(payload)
+        else:
+            payload = '[' + ','.join(message.encode('json') for message in batch) + ']'
+        try:
+            self.socketio.emit('batch', payload, to=client.sid,
+                               callback=lambda *args: self._acked(client.sid, batch_id))
+            count('messages_sent', len(batch), encoding=client.encoding)
+        except Exception:
+            logger.exception("Sending to client %s failed", client.sid)
+            self._acked(client.sid, batch_id)
+
+    def _acked(self, sid, batch_id):
+        with self._wakeup:
+            client = self.clients.get(sid)
+            # A late acknowledgement for a batch already given up on must not reopen the window again
+            if client is None or client.outstanding.pop(batch_id, None) is None:
+                return
+            if len(client):
+                self._ready.add(sid)
+                self._wakeup.notify()
+
+    def _expire_acks(self):
+        """Reopen the window of clients whose acknowledgements never came"""
+        now = time.monotonic()
+        for client in self.clients.values():
+            expired = [batch_id for batch_id, sent_at in client.outstanding.items()
+                       if now - sent_at > ACK_TIMEOUT]
+            if expired:
+                logger.info("Client %s did not acknowledge %d batches in %.0fs",
+                            client.sid, len(expired), ACK_TIMEOUT)
+                for batch_id in expired:
+                    del client.outstanding[batch_id]
+                if len(client):
+                    self._ready.add(client.sid)
@@ -0,0 +1,119 @@
+import time
+import asyncio
+
+# Share of each measured offset applied per sync, smoothing out network jitter
+SYNC_SMOOTHING = 0.3
+# Offsets larger than this are treated as a seek and applied at once
+SEEK_THRESHOLD = 2.0
+
+
+class PlaybackClock:
+    """
+    Media-time clock for one job, driven by time.monotonic().
+
+    The clock maps wall time to a position in the recording, so subtitles
+    can be emitted when playback reaches each sentence's timestamp rather
+    than after fixed sleeps. It stops while paused and can be nudged back
+    into line with the position a client reports for its audio player:
+    small offsets are folded in gradually to correct drift, large ones are
+    treated as a seek.
+    """
+
+    def __init__(self):
+        self.origin_position = 0.0
+        self.origin_time = None  # monotonic time at origin_position; None until started
+        self.paused_at = None
+        self.drift = 0.0  # last offset measured by sync(), in seconds
+        self._changed = None
+
+    @property
+    def started(self):
+        return self.origin_time is not None
+
+    def start(self, position=0.0):
+        """Start counting from position unless already started"""
+        if self.started:
+            return
+        self.origin_position = position
+        self.origin_time = time.monotonic()
+        self._notify()
+
+    def now(self):
+        """Current media position in seconds"""
+        if not self.started:
+            return self.origin_position
+        at = self.paused_at if self.paused_at is not None else time.monotonic()
+        return self.origin_position + (at - self.origin_time)
+
+    def pause(self):
+        if self.paused_at is None:
+            self.paused_at = time.monotonic()
+            self._notify()
+
+    def resume(self):
+        if self.paused_at is not None:
+            if self.started:
+                self.origin_time += time.monotonic() - self.paused_at
+            self.paused_at = None
+            self._notify()
+
+    def sync(self, position, latency=0.0):
+        """
+        Align with a client-reported media position.
+
+        latency is the estimated age of the report in seconds; the client's
+        position has moved on by that much since it was sent.
+        """
+        position += latency
+        if not self.started:
+            self.start(position)
+            return
+        offset = position - self.now()
+        self.drift = offset
+        if abs(offset) >= SEEK_THRESHOLD:
+            self.origin_position += offset
+        else:
+            self.origin_position += offset * SYNC_SMOOTHING
+        self._notify()
+
+    async def wait_until(self, position):
+        """Sleep until the clock reaches position, following pauses and syncs"""
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        while True:
+            remaining = position - self.now()
+            if remaining <= 0:
+                return
+            self._changed.clear()
+            timeout = None if self.paused_at is not None else remaining
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _notify(self):
+        if self._changed is not None:
+            self._changed.set()
+
+
+class LatenessStats:
+    """Per-sentence lateness against the playback clock, in seconds"""
+
+    def __init__(self):
+        self.values = []
+
+    def record(self, lateness):
+        self.values.append(max(0.0, lateness))
+
+    def summary(self):
+        if not self.values:
+            return {'count': 0, 'late': 0, 'mean': 0.0, 'p95': 0.0, 'max': 0.0}
+        ordered = sorted(self.values)
+        return {
+            'count': len(ordered),
+            # Within a frame at 20fps counts as on time
+            'late': sum(1 for v in ordered if v > 0.05),
+            'mean': sum(ordered) / len(ordered),
+            'p95': ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+            'max': ordered[-1]
+        }
@@ -0,0 +1,66 @@
+import os
+import sys
+import asyncio
+import threading
+from collections import Counter
+
+from metrics import task_jobs
+
+DEFAULT_INTERVAL = 0.005
+MAX_STACK_DEPTH = 64
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for one job on the shared runtime loop.
+
+    A background thread samples the loop thread's stack every interval
+    seconds and keeps the samples taken while one of the job's tasks was
+    running. Results are collapsed stacks ("outer;inner count" lines, the
+    input format of flame graph tools), so other jobs sharing the loop do
+    not show up in the profile.
+    """
+
+    def __init__(self, loop, thread_id, job_id, interval=DEFAULT_INTERVAL):
+        self.loop = loop
+        self.thread_id = thread_id
+        self.job_id = job_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0  # all samples, including other jobs and idle time
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f'profiler-{self.job_id}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        self.samples += 1
+        try:
+            task = asyncio.current_task(self.loop)
+        except RuntimeError:
+            return
+        if task is None or task_jobs.get(task) != self.job_id:
+            return
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        if stack:
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """Collapsed stacks, most sampled first"""
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common())
@@ -0,0 +1,85 @@
+import os
+import asyncio
+import logging
+import threading
+import importlib.util
+import httpx
+from metrics import count, job_task_factory
+
+logger = logging.getLogger(__name__)
+
+# Connection pool tuning for the shared OpenRouter client
+MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 64))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_MAX_KEEPALIVE', 32))
+KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 120))
+CONNECT_TIMEOUT = 10.0
+REQUEST_TIMEOUT = 120.0
+
+
+class AsyncRuntime:
+    """
+    One long-lived event loop thread shared by every job.
+
+    Socket.IO handlers run on their own threads and hand work over with
+    submit(). The runtime also owns the single HTTP client used by the
+    translation and transcription modules, so keep-alive connections and
+    TLS sessions are reused across jobs instead of being rebuilt per request.
+    """
+
+    def __init__(self, http2=None):
+        if http2 is None:
+            # HTTP/2 needs the optional h2 package (httpx[http2])
+            http2 = importlib.util.find_spec('h2') is not None
+        self.http_client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+            event_hooks={'request': [self._count_request]}
+        )
+
+        self.loop = asyncio.new_event_loop()
+        # Tasks remember which job created them, for per-job profiling
+        self.loop.set_task_factory(job_task_factory)
+        self._thread = threading.Thread(target=self._run_loop, name='async-runtime')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def thread_id(self):
+        return self._thread.ident
+
+    @staticmethod
+    async def _count_request(request):
+        # Every HTTP attempt, so client retries show up as extra requests
+        count('api_requests', endpoint=request.url.path.split('/v1/')[-1])
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coroutine):
+        """Schedule a coroutine on the runtime loop; returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine, timeout=None):
+        """Run a coroutine on the runtime loop and block the calling thread for its result"""
+        return self.submit(coroutine).result(timeout)
+
+    def call_soon(self, callback, *args):
+        """Run a plain callback on the runtime loop from any thread"""
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def shutdown(self, timeout=5):
+        """Close the HTTP client and stop the loop"""
+        if self.loop.is_closed():
+            return
+        try:
+            self.run(self.http_client.aclose(), timeout)
+        except Exception as e:
+            logger.warning("Error closing HTTP client: %s", e)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
@@ -0,0 +1,365 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+import openai
+from metrics import count
+
+logger = logging.getLogger(__name__)
+
+# Requests per second per model; halved on each 429 and regrown on success
+API_RATE_LIMIT = float(os.getenv('API_RATE_LIMIT', 10))
+API_BURST = int(os.getenv('API_BURST', 20))
+MIN_RATE = 0.2
+RATE_INCREASE = 0.1  # requests/sec regained per successful call
+DEFAULT_RETRY_AFTER = 2.0
+
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+
+# Consecutive failures that open a model's circuit, and how long it stays open
+BREAKER_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30.0
+
+# Race the fallback model once the primary is slower than this percentile of its recent calls
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DEFAULT_DELAY = 5.0  # until enough latencies are known
+HEDGE_MIN_DELAY = 0.5
+
+
+class DeadlineExceeded(Exception):
+    """The call's deadline passed before any attempt succeeded"""
+
+
+class CircuitOpenError(Exception):
+    """The model's circuit breaker is open after repeated failures"""
+
+
+class TokenBucket:
+    """
+    Request rate limiter that adapts to 429 responses.
+
+    Each 429 halves the refill rate and holds all requests until its
+    Retry-After has passed; every success adds RATE_INCREASE back, up to
+    the configured rate (additive increase, multiplicative decrease).
+    """
+
+    def __init__(self, rate=API_RATE_LIMIT, capacity=API_BURST):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def rate_limited(self, retry_after=None):
+        self.rate = max(MIN_RATE, self.rate / 2)
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + (retry_after or DEFAULT_RETRY_AFTER))
+
+    def succeeded(self):
+        self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+
+class CircuitBreaker:
+    """
+    Stops calling a model that keeps failing.
+
+    After threshold consecutive failures the circuit opens and calls are
+    rejected for reset_seconds; then a single trial call is let through,
+    which closes the circuit on success or reopens it on failure.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half-open' and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def succeeded(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def failed(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning("Circuit opened after %d consecutive failures", self.failures)
+            self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Recent successful call latencies for one model"""
+
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+
+    def record(self, latency):
+        self.samples.append(latency)
+
+    def percentile(self, q):
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def retry_after_seconds(error):
+    """Seconds from a 429's Retry-After header (delta or HTTP date), or None"""
+    response = getattr(error, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify(error):
+    """Return 'rate_limited', 'transient' (retry, counts against the circuit) or 'fatal'"""
+    if isinstance(error, openai.RateLimitError):
+        return 'rate_limited'
+    if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError)):
+        return 'transient'
+    if isinstance(error, openai.APIStatusError) and (error.status_code >= 500 or error.status_code == 408):
+        return 'transient'
+    return 'fatal'
+
+
+class RequestScheduler:
+    """
+    Shared gatekeeper for API calls to each model.
+
+    call() rate-limits with an adaptive TokenBucket, retries rate-limited
+    and transient failures with jittered exponential backoff within an
+    overall deadline, and fails fast while the model's CircuitBreaker is
+    open. hedged() additionally races a fallback model once the primary
+    is slower than usual. Auth, credit and other client errors are raised
+    at once so callers keep their existing error handling.
+
+    limiter, if given, is held around every attempt (not the backoff
+    sleeps in between): any object with an async acquire() and a release(),
+    such as an asyncio.Semaphore, to cap the calls in flight.
+    """
+
+    def __init__(self, rate=API_RATE_LIMIT, burst=API_BURST, max_retries=MAX_RETRIES, limiter=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.limiter = limiter
+        self.buckets = {}
+        self.breakers = {}
+        self.latencies = {}
+
+    def _bucket(self, model):
+        if model not in self.buckets:
+            self.buckets[model] = TokenBucket(self.rate, self.burst)
+        return self.buckets[model]
+
+    def breaker(self, model):
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker()
+        return self.breakers[model]
+
+    def _latency(self, model):
+        if model not in self.latencies:
+            self.latencies[model] = LatencyTracker()
+        return self.latencies[model]
+
+    async def call(self, model, request, deadline=None, track_latency=True):
+        """
+        Run request() (a coroutine factory, called once per attempt) for model.
+
+        deadline is a number of seconds for all attempts together; it
+        raises DeadlineExceeded when it passes. Pass track_latency=False
+        for calls that are not comparable with the model's usual ones
+        (e.g. large batches), so they do not skew its hedge delay.
+        """
+        expires = None if deadline is None else time.monotonic() + deadline
+        bucket = self._bucket(model)
+        breaker = self.breaker(model)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                count('circuit_rejections', model=model)
+                raise CircuitOpenError(f"Circuit open for {model}")
+
+            started = None
+            try:
+                await asyncio.wait_for(bucket.acquire(), self._remaining(expires, model))
+                if self.limiter is None:
+                    started = time.monotonic()
+                    result = await asyncio.wait_for(request(), self._remaining(expires, model))
+                else:
+                    await asyncio.wait_for(self.limiter.acquire(), self._remaining(expires, model))
+                    try:
+                        started = time.monotonic()
+                        result = await asyncio.wait_for(request(), self._remaining(expires, model))
+                    finally:
+                        self.limiter.release()
+            except asyncio.CancelledError:
+                breaker.trial_running = False
+                raise
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError) and expires is not None and time.monotonic() >= expires:
+                    if started is not None:
+                        breaker.failed()  # the model itself was too slow
+                    else:
+                        breaker.trial_running = False
+                    raise DeadlineExceeded(f"Deadline exceeded calling {model}") from e
+                kind = classify(e)
+                if kind == 'fatal':
+                    # Refused requests (auth, credits, bad input) say nothing about the model's health
+                    breaker.trial_running = False
+                    raise
+                retry_after = None
+                if kind == 'rate_limited':
+                    retry_after = retry_after_seconds(e)
+                    bucket.rate_limited(retry_after)
+                    breaker.trial_running = False
+                else:
+                    breaker.failed()
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = max(retry_after or 0.0, random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)))
+                if expires is not None and time.monotonic() + delay >= expires:
+                    raise DeadlineExceeded(f"Deadline exceeded calling {model}") from e
+                count('retries', model=model, reason=kind)
+                logger.info("Retrying %s in %.2fs after %s error (attempt %d)", model, delay, kind, attempt)
+                await asyncio.sleep(delay)
+                continue
+
+            breaker.succeeded()
+            bucket.succeeded()
+            if track_latency:
+                self._latency(model).record(time.monotonic() - started)
+            return result
+
+    @staticmethod
+    def _remaining(expires, model):
+        if expires is None:
+            return None
+        remaining = expires - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Deadline exceeded calling {model}")
+        return remaining
+
+    def hedge_delay(self, model):
+        """How long to wait for model before racing a fallback"""
+        threshold = self._latency(model).percentile(HEDGE_PERCENTILE)
+        return HEDGE_DEFAULT_DELAY if threshold is None else max(HEDGE_MIN_DELAY, threshold)
+
+    async def hedged(self, primary, fallback, deadline=None):
+        """
+        Race a fallback model against a slow or failing primary.
+
+        primary and fallback are (model, request) pairs. The fallback
+        starts when the primary is slower than its hedge delay, fails, or
+        has its circuit open; the first success wins and the other call is
+        cancelled. A primary that keeps losing has its circuit opened, so
+        while it is degraded lines go straight to the fallback. Returns
+        (model, result). Fatal primary errors (e.g. authentication) are
+        raised without trying the fallback.
+        """
+        primary_model, primary_request = primary
+        fallback_model, fallback_request = fallback
+        tasks = {}
+        errors = []
+        try:
+            if self.breaker(primary_model).state != 'open':
+                primary_task = asyncio.ensure_future(self.call(primary_model, primary_request, deadline))
+                tasks[primary_task] = primary_model
+                done, _ = await asyncio.wait([primary_task], timeout=self.hedge_delay(primary_model))
+                if done:
+                    error = primary_task.exception()
+                    if error is None:
+                        return primary_model, primary_task.result()
+                    if classify(error) == 'fatal' and not isinstance(error, (DeadlineExceeded, CircuitOpenError)):
+                        raise error
+                    del tasks[primary_task]
+                    errors.append(error)
+
+            hedging = bool(tasks)  # primary still running: race it
+            if hedging:
+                count('hedges', outcome='started')
+            tasks[asyncio.ensure_future(self.call(fallback_model, fallback_request, deadline))] = fallback_model
+
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    model = tasks.pop(task)
+                    if task.exception() is None:
+                        if hedging and model == fallback_model:
+                            count('hedges', outcome='fallback_won')
+                            # Repeatedly losing to the fallback opens the primary's circuit too
+                            if tasks:
+                                self.breaker(primary_model).failed()
+                        elif hedging:
+                            count('hedges', outcome='primary_won')
+                        return model, task.result()
+                    errors.append(task.exception())
+            raise errors[0]
+        finally:
+            # Cancel the loser (or everything, if we were cancelled)
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            model: {
+                'rate': self.buckets[model].rate if model in self.buckets else self.rate,
+                'circuit': self.breaker(model).state,
+                'hedge_delay': self.hedge_delay(model)
+            }
+            for model in set(self.buckets) | set(self.breakers)
+        }
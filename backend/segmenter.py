@@ -0,0 +1,147 @@
+import re
+
+# Sentences longer than this are split at a metrical or word boundary
+MAX_SENTENCE_CHARS = 120
+# A gap of this many seconds between timed chunks ends a sentence
+PAUSE_SECONDS = 0.8
+# Syllables per pada (quarter verse) of an anushtubh shloka, the most common metre
+PADA_SYLLABLES = 8
+
+# Dandas (with an optional verse number: ॥ १ ॥), the Malayalam para sign, '|' typed
+# for a danda, Latin sentence punctuation and line breaks end a sentence
+BOUNDARY = re.compile(
+    r'[।॥|൏.!?]+(?:\s*[०-९൦-൯0-9]+\s*[।॥]+)*'
+    r'|\s*\n\s*'
+)
+# Clause punctuation preferred for a length split when no pada boundary fits
+SOFT_BREAK = re.compile(r'[,;:—–]\s')
+NON_SPACE = re.compile(r'\S')
+# One syllable: an independent vowel, or a consonant not closed by a virama
+# (Devanagari and Malayalam)
+SYLLABLE = re.compile(
+    '[\u0904-\u0914\u0960\u0961\u0d05-\u0d14\u0d60\u0d61]'
+    '|[\u0915-\u0939\u0958-\u095f\u0d15-\u0d3a]\u093c?(?![\u094d\u0d4d])'
+)
+
+
+def syllables(text):
+    """Number of aksharas in Devanagari/Malayalam text"""
+    return len(SYLLABLE.findall(text))
+
+
+class Segmenter:
+    """
+    Incremental sentence splitter for Sanskrit/Malayalam transcripts.
+
+    feed() takes transcript chunks as they arrive (e.g. Whisper segments,
+    joined with a space) and returns the sentences they complete; flush()
+    returns whatever is left at the end. Sentences end at dandas, the
+    Malayalam para sign, '.', '!', '?', line breaks, and, for chunks with
+    timestamps, pauses of at least pause_seconds. Anything longer than
+    max_chars is split at the last pada (PADA_SYLLABLES syllables)
+    boundary that fits, else at clause punctuation or a space.
+
+    Sentences are returned stripped, without their terminating
+    punctuation, and are substrings of the joined text so they can be
+    located in it. Fragments without any letters (stray verse numbers)
+    are dropped. Each character is scanned a bounded number of times, so
+    segmenting a transcript takes linear time however it is chunked.
+    """
+
+    def __init__(self, max_chars=MAX_SENTENCE_CHARS, pause_seconds=PAUSE_SECONDS):
+        self.max_chars = max_chars
+        self.pause_seconds = pause_seconds
+        self.pending = ""  # text after the last boundary
+        self.last_end = None
+
+    def feed(self, text, start=None, end=None):
+        """Add a chunk of transcript; returns the list of sentences it completes"""
+        sentences = []
+        if (start is not None and self.last_end is not None
+                and start - self.last_end >= self.pause_seconds and self.pending):
+            sentences.extend(self._finish(self.pending))
+            self.pending = ""
+        if end is not None:
+            self.last_end = end
+        text = text.strip()
+        if not text:
+            return sentences
+
+        # pending never holds a complete boundary, so only the new text is scanned
+        scan_from = len(self.pending) + 1 if self.pending else 0
+        buffer = f"{self.pending} {text}" if self.pending else text
+        last = 0
+        for match in BOUNDARY.finditer(buffer, scan_from):
+            sentences.extend(self._finish(buffer, last, match.start()))
+            last = match.end()
+        last = self._split(buffer, last, len(buffer), sentences)
+        self.pending = buffer[last:]
+        return sentences
+
+    def flush(self):
+        """Return the final unterminated sentence, if any, and reset"""
+        sentences = self._finish(self.pending)
+        self.pending = ""
+        self.last_end = None
+        return sentences
+
+    def _finish(self, text, start=0, end=None):
+        """Sentences of text[start:end], which ends at a boundary"""
+        end = len(text) if end is None else end
+        sentences = []
+        start = self._split(text, start, end, sentences)
+        sentences.extend(self._keep(text[start:end]))
+        return sentences
+
+    def _split(self, text, start, end, sentences):
+        """
+        Cut text[start:end] into sentences of at most max_chars while it is longer.
+
+        Works on offsets rather than re-slicing the remainder, so a long
+        stretch without boundaries is split in linear time, and skips
+        leading whitespace so cuts do not depend on where chunks were
+        joined. Returns the offset of the unsplit rest.
+        """
+        while True:
+            match = NON_SPACE.search(text, start, end)
+            start = match.start() if match else end
+            if end - start <= self.max_chars:
+                return start
+            cut = start + self._cut_point(text[start:start + self.max_chars + 1])
+            sentences.extend(self._keep(text[start:cut]))
+            start = cut
+
+    @staticmethod
+    def _keep(text):
+        text = text.strip()
+        return [text] if any(char.isalpha() for char in text) else []
+
+    def _cut_point(self, window):
+        """Where to split text starting with window (max_chars + 1 characters), preferring pada boundaries"""
+        # Splits in the first third would leave a fragment too short to translate well
+        earliest = self.max_chars // 3
+        pada = soft = space = None
+        count = 0
+        position = 0
+        for word in window.split(' '):
+            position += len(word)
+            if position >= len(window):
+                break  # the last word may continue past the window
+            count += syllables(word)
+            if position >= earliest:
+                space = position
+                if count and count % PADA_SYLLABLES == 0:
+                    pada = position
+            position += 1  # the space
+        for match in SOFT_BREAK.finditer(window, earliest):
+            soft = match.start() + 1
+        for cut in (pada, soft, space):
+            if cut:
+                return cut
+        return self.max_chars
+
+
+def split_sentences(text, max_chars=MAX_SENTENCE_CHARS):
+    """Split a complete transcript into sentences"""
+    segmenter = Segmenter(max_chars)
+    return segmenter.feed(text) + segmenter.flush()
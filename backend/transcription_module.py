@@ -1,104 +1,329 @@
 import os
 import asyncio
 import base64
+import logging
+from bisect import bisect_right
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
+from audio_chunker import ensure_wav, plan_windows, read_window, merge_overlap
+from audio_preprocessor import AudioPreprocessor, PreparedAudio, AUDIO_PREPROCESS
+from metrics import count, span
+from scheduler import RequestScheduler
+from segmenter import Segmenter, split_sentences
+
+logger = logging.getLogger(__name__)
+
+# Overridden with OPENROUTER_BASE_URL, e.g. to point at a local mock server
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+WHISPER_MODEL = "openai/whisper-large-v3"
+TRANSCRIPTION_LANGUAGE = "sa"  # Sanskrit language code
+
+# Whisper requests are rejected above this size
+MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+# Seconds allowed for one transcription request, retries included
+TRANSCRIPTION_DEADLINE = float(os.getenv('TRANSCRIPTION_DEADLINE', 300))
+
+
+def parse_segments(response, offset=0.0):
+    """
+    Return (text, segments) from a transcription response.
+
+    verbose_json responses carry segment timestamps, returned as
+    [{'start', 'end', 'text'}] shifted by offset seconds; plain text
+    responses have no segments.
+    """
+    if isinstance(response, str):
+        return response, []
+    segments = []
+    for segment in getattr(response, 'segments', None) or []:
+        if not isinstance(segment, dict):
+            segment = segment.model_dump() if hasattr(segment, 'model_dump') else vars(segment)
+        text = (segment.get('text') or '').strip()
+        if text:
+            segments.append({
+                'start': float(segment.get('start') or 0.0) + offset,
+                'end': float(segment.get('end') or 0.0) + offset,
+                'text': text
+            })
+    return getattr(response, 'text', '') or '', segments
+
+
+def timed_sentences(text, segments):
+    """
+    Split a transcript into sentence dicts with 'sanskrit', 'start' and 'end'.
+
+    With timestamped segments the sentences are placed on the media
+    timeline, and pauses between segments also end sentences; without
+    them start and end are None.
+    """
+    with span('split', chars=len(text or "")):
+        if not segments:
+            return [{'sanskrit': s, 'start': None, 'end': None} for s in split_sentences(text or "")]
+        timeline = TimedTranscript(segments)
+        segmenter = Segmenter()
+        sentences = []
+        for segment in segments:
+            sentences.extend(segmenter.feed(segment['text'], segment['start'], segment['end']))
+        sentences.extend(segmenter.flush())
+        return [
+            {'sanskrit': sentence, 'start': start, 'end': end}
+            for sentence, start, end, _ in timeline.locate(sentences)
+        ]
+
+
+class TimedTranscript:
+    """
+    Transcript text with a map from character offset to media time.
+
+    Text is appended one timed span at a time; times inside a span are
+    interpolated linearly by character position, which is close enough to
+    place a sentence within a Whisper segment.
+    """
+
+    def __init__(self, segments=None):
+        self.text = ""
+        self._offsets = []  # character offset where each span starts
+        self._spans = []    # (char_start, char_end, start, end)
+        for segment in segments or []:
+            self.append(segment['text'], segment['start'], segment['end'])
+
+    @property
+    def timed(self):
+        return any(end > start for _, _, start, end in self._spans)
+
+    def append(self, text, start, end):
+        text = text.strip()
+        if not text:
+            return
+        if self.text:
+            self.text += " "
+        char_start = len(self.text)
+        self.text += text
+        self._offsets.append(char_start)
+        self._spans.append((char_start, len(self.text), start, end))
+
+    def time_at(self, offset):
+        """Media time of a character offset, or None without spans"""
+        if not self._spans:
+            return None
+        char_start, char_end, start, end = self._spans[max(0, bisect_right(self._offsets, offset) - 1)]
+        fraction = min(1.0, max(0.0, (offset - char_start) / max(1, char_end - char_start)))
+        return start + (end - start) * fraction
+
+    def locate(self, sentences, cursor=0):
+        """
+        Find each sentence in the text from cursor onwards.
+
+        Returns a list of (sentence, start, end, char_end) with media times
+        for the sentence's first and last characters.
+        """
+        located = []
+        for sentence in sentences:
+            found = self.text.find(sentence, cursor)
+            char_start = found if found >= 0 else cursor
+            char_end = char_start + len(sentence)
+            located.append((sentence, self.time_at(char_start), self.time_at(char_end), char_end))
+            cursor = char_end
+        return located
 
 class TranscriptionModule:
-    def __init__(self):
+    def __init__(self, http_client=None, media_store=None, artifact_store=None, scheduler=None,
+                 preprocessor=None):
         load_dotenv()
         
         api_key = os.getenv('KAPI')
         if not api_key:
             raise ValueError("OPENROUTER_API_KEY environment variable is not set")
         
+        # http_client is the runtime's shared pooled client; None builds a private one
         self.client = AsyncOpenAI(
-            base_url="https://openrouter.ai/api/v1",
+            base_url=os.getenv('OPENROUTER_BASE_URL', OPENROUTER_BASE_URL),
             api_key=api_key,
+            http_client=http_client,
+            # Retries, backoff and rate limiting are handled by the scheduler
+            max_retries=0,
             default_headers={
                 "HTTP-Referer": "http://localhost:5000", 
                 "X-Title": "Sanskrit Translator"
             }
         )
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+        # With both stores, transcripts are saved and reused by audio hash
+        self.media_store = media_store
+        self.artifact_store = artifact_store
+        # Downmixes, resamples and compresses recordings before upload; None uploads them as they are
+        if preprocessor is None and AUDIO_PREPROCESS != 'off':
+            preprocessor = AudioPreprocessor()
+        self.preprocessor = preprocessor
     
-    def audio_to_base64(self, audio_file_path):
-        """Convert audio file to base64 for API transmission"""
+    def audio_to_base64(self, audio_file_path, output=None):
+        """
+        Convert audio file to base64 for API transmission.
+
+        The file is encoded in chunks; pass a text file-like output to stream
+        the encoding there instead of building the whole string in memory.
+        """
         try:
+            parts = []
             with open(audio_file_path, 'rb') as audio_file:
-                audio_data = audio_file.read()
-                base64_audio = base64.b64encode(audio_data).decode('utf-8')
-                return base64_audio
+                # Multiples of 3 bytes encode without padding, so chunks concatenate cleanly
+                for chunk in iter(lambda: audio_file.read(3 * 256 * 1024), b''):
+                    encoded = base64.b64encode(chunk).decode('ascii')
+                    if output is None:
+                        parts.append(encoded)
+                    else:
+                        output.write(encoded)
+            return ''.join(parts) if output is None else None
         except Exception as e:
-            print(f"Error converting audio to base64: {e}")
+            logger.error("Error converting audio to base64: %s", e)
             return None
     
+    async def audio_hash(self, audio_file_path):
+        """SHA-256 of the audio file, or None without the stores"""
+        if self.media_store is None or self.artifact_store is None:
+            return None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.media_store.hash_for, audio_file_path)
+    
+    async def cached_transcript(self, audio_file_path):
+        """Return (audio_hash, cached transcript or None)"""
+        audio_hash = await self.audio_hash(audio_file_path)
+        if audio_hash is None:
+            return None, None
+        return audio_hash, self.artifact_store.get_transcript(audio_hash, WHISPER_MODEL, TRANSCRIPTION_LANGUAGE)
+    
+    async def prepare_audio(self, audio_file_path, audio_hash=None, **settings):
+        """
+        Preprocess a recording for upload; returns a PreparedAudio.
+
+        settings (codec, mode) override the preprocessor's for this call.
+        Sizes and time taken are counted on the current job.
+        """
+        loop = asyncio.get_running_loop()
+        with span('preprocess'):
+            if self.preprocessor is None:
+                prepared = PreparedAudio.original(audio_file_path)
+            else:
+                prepared = await loop.run_in_executor(
+                    None, lambda: self.preprocessor.prepare(audio_file_path, audio_hash, **settings)
+                )
+        count('preprocess_input_bytes', prepared.input_bytes)
+        count('preprocess_output_bytes', prepared.output_bytes)
+        count('preprocess_seconds', prepared.seconds)
+        return prepared
+    
+    def cached_segments(self, audio_hash):
+        """Timestamped segments stored with the newest transcript, if any"""
+        if audio_hash is None:
+            return []
+        artifact = self.artifact_store.latest(audio_hash, WHISPER_MODEL, TRANSCRIPTION_LANGUAGE)
+        return self.artifact_store.load_segments(artifact['id']) if artifact else []
+    
+    def save_transcript(self, audio_hash, text, segments=None):
+        """Store a transcript as a new artifact version; returns its id"""
+        if audio_hash is None:
+            return None
+        return self.artifact_store.save_transcript(
+            audio_hash, WHISPER_MODEL, TRANSCRIPTION_LANGUAGE, text, segments
+        )
+    
     async def transcribe_audio(self, audio_file_path):
         """
         Transcribe audio using OpenRouter's API
         """
+        text, _ = await self.transcribe_timed(audio_file_path)
+        return text
+    
+    async def transcribe_timed(self, audio_file_path):
+        """
+        Transcribe audio and return (text, segments).
+
+        segments are Whisper's timestamped segments as dicts with 'start',
+        'end' and 'text'; they are empty for the fallback text or a
+        provider that ignores verbose_json. text is None on failure.
+        """
         try:
-            print(f"Transcribing audio file: {audio_file_path}")
+            logger.info("Transcribing audio file: %s", audio_file_path)
             
             # Check if file exists and is readable
             if not os.path.exists(audio_file_path):
                 raise FileNotFoundError(f"Audio file not found: {audio_file_path}")
             
-            # Get file size for debugging
-            file_size = os.path.getsize(audio_file_path)
-            print(f"Audio file size: {file_size / (1024*1024):.2f} MB")
+            audio_hash, cached = await self.cached_transcript(audio_file_path)
+            if cached:
+                logger.info("Using cached transcript")
+                return cached, self.cached_segments(audio_hash)
+            
+            # Upload compact 16kHz mono audio instead of the recording itself
+            prepared = await self.prepare_audio(audio_file_path, audio_hash)
+            upload_path = prepared.path
+            file_size = prepared.output_bytes
+            logger.debug("Upload size: %.2f MB (recording %.2f MB)", file_size / (1024*1024),
+                         prepared.input_bytes / (1024*1024))
             
             # Check if file is too large (OpenRouter has limits)
-            if file_size > 25 * 1024 * 1024:  # 25MB limit
+            if file_size > MAX_UPLOAD_BYTES:  # 25MB limit; use transcribe_stream instead
                 raise ValueError("Audio file too large (>25MB). Please use a smaller file.")
             
             # Try transcription with OpenRouter
-            with open(audio_file_path, 'rb') as audio_file:
-                print("Sending request to OpenRouter API...")
-                response = await self.client.audio.transcriptions.create(
-                    model="openai/whisper-large-v3",
-                    file=audio_file,
-                    language="sa",  # Sanskrit language code
-                    response_format="text"
-                )
+            async def request():
+                # Reopened per attempt so a retry uploads the file from the start
+                with open(upload_path, 'rb') as audio_file:
+                    logger.debug("Sending request to OpenRouter API...")
+                    count('bytes_uploaded', file_size, destination='api')
+                    with span('transcription', model=WHISPER_MODEL, path='file', bytes=file_size):
+                        return await self.client.audio.transcriptions.create(
+                            model=WHISPER_MODEL,
+                            file=audio_file,
+                            language=TRANSCRIPTION_LANGUAGE,
+                            response_format="verbose_json",
+                            timestamp_granularities=["segment"]
+                        )
             
-            transcribed_text = response if isinstance(response, str) else response.text
+            response = await self.scheduler.call(
+                WHISPER_MODEL, request, deadline=TRANSCRIPTION_DEADLINE, track_latency=False
+            )
+            
+            transcribed_text, segments = parse_segments(response)
+            # Timestamps refer to the trimmed upload; store them in recording time
+            segments = prepared.shift_segments(segments)
             
             if not transcribed_text or transcribed_text.strip() == "":
                 raise ValueError("Received empty transcription from API")
             
-            # Save transcription to file for reference
-            with open("transcript.txt", "w", encoding="utf-8") as f:
-                f.write(transcribed_text)
+            # Only real API output is stored, never the fallback sample text
+            self.save_transcript(audio_hash, transcribed_text, segments)
             
-            print("Transcription completed successfully")
-            print(f"Transcribed text preview: {transcribed_text[:100]}...")
-            return transcribed_text
+            logger.info("Transcription completed successfully")
+            logger.debug("Transcribed text preview: %s...", transcribed_text[:100])
+            return transcribed_text, segments
             
         except Exception as e:
             error_msg = str(e)
-            print(f"Transcription error: {error_msg}")
+            logger.warning("Transcription error: %s", error_msg)
             
             # Provide specific error messages
             if "401" in error_msg or "unauthorized" in error_msg.lower():
-                print("❌ Authentication failed - check your OPENROUTER_API_KEY")
-                return None
+                logger.error("Authentication failed - check your OPENROUTER_API_KEY")
+                return None, []
             elif "insufficient" in error_msg.lower() or "credits" in error_msg.lower():
-                print("❌ Insufficient credits in OpenRouter account")
-                return None
+                logger.error("Insufficient credits in OpenRouter account")
+                return None, []
             elif "connection" in error_msg.lower() or "timeout" in error_msg.lower():
-                print("❌ Network connection issue")
-                return None
+                logger.error("Network connection issue")
+                return None, []
             elif "file too large" in error_msg.lower():
-                print("❌ Audio file is too large")
-                return None
+                logger.error("Audio file is too large")
+                return None, []
             
             # Fallback: Use sample text for demo
-            print("🔄 Using fallback sample text for demo...")
+            logger.warning("Using fallback sample text for demo...")
+            count('fallbacks', stage='transcription')
             try:
-                return await self.fallback_transcription(audio_file_path)
+                return await self.fallback_transcription(audio_file_path), []
             except Exception as fallback_error:
-                print(f"Fallback transcription also failed: {fallback_error}")
-                return None
+                logger.error("Fallback transcription also failed: %s", fallback_error)
+                return None, []
     
     async def fallback_transcription(self, audio_file_path):
         """
@@ -115,9 +340,151 @@ class TranscriptionModule:
             नलमोडु काण्मथिन्नु कलियल्ले रुचिक्कुन्नु काल विशमम् कोण्डु
             """
             
-            print("Using fallback sample text for demo")
             return sample_sanskrit.strip()
             
         except Exception as e:
-            print(f"Fallback error: {e}")
-            return None
\ No newline at end of file
+            logger.error("Fallback error: %s", e)
+            return None
+    
+    async def transcribe_window(self, wav_bytes, name):
+        """Transcribe one in-memory WAV window"""
+        async def request():
+            count('bytes_uploaded', len(wav_bytes), destination='api')
+            with span('transcription', model=WHISPER_MODEL, path='window', bytes=len(wav_bytes)):
+                return await self.client.audio.transcriptions.create(
+                    model=WHISPER_MODEL,
+                    file=(name, wav_bytes),
+                    language=TRANSCRIPTION_LANGUAGE,
+                    response_format="text"
+                )
+        
+        response = await self.scheduler.call(WHISPER_MODEL, request, deadline=TRANSCRIPTION_DEADLINE)
+        return response if isinstance(response, str) else response.text
+    
+    async def transcribe_window_timed(self, wav_bytes, name, offset=0.0):
+        """Transcribe one window; returns (text, segments) with times shifted by offset"""
+        async def request():
+            count('bytes_uploaded', len(wav_bytes), destination='api')
+            with span('transcription', model=WHISPER_MODEL, path='window', bytes=len(wav_bytes)):
+                return await self.client.audio.transcriptions.create(
+                    model=WHISPER_MODEL,
+                    file=(name, wav_bytes),
+                    language=TRANSCRIPTION_LANGUAGE,
+                    response_format="verbose_json",
+                    timestamp_granularities=["segment"]
+                )
+        
+        response = await self.scheduler.call(WHISPER_MODEL, request, deadline=TRANSCRIPTION_DEADLINE)
+        return parse_segments(response, offset)
+    
+    async def transcribe_stream(self, audio_file_path, window_seconds=30.0,
+                                overlap_seconds=2.0, max_concurrency=3, limiter=None):
+        """
+        Transcribe a long recording window by window.
+
+        Overlapping windows are transcribed concurrently (at most
+        max_concurrency at once) and their sentences are yielded in timeline
+        order as dicts with 'sanskrit', 'progress' (fraction of audio
+        covered), 'total' (None until known) and 'start'/'end' media times
+        in seconds (None when the provider returns no timestamps).
+        Segments that start inside the previous window's overlap are
+        dropped by timestamp, falling back to text matching without them.
+        Text is fed to a Segmenter as it arrives, so a sentence that runs
+        across windows is only yielded once it is complete. limiter, if
+        given, is an async context manager held around each API call (e.g.
+        a shared pool slot).
+        """
+        audio_hash, cached = await self.cached_transcript(audio_file_path)
+        if cached:
+            # A previously transcribed recording is served without any API calls
+            sentences = timed_sentences(cached, self.cached_segments(audio_hash))
+            for i, sentence in enumerate(sentences):
+                sentence.update(progress=(i + 1) / len(sentences), total=len(sentences))
+                yield sentence
+            return
+        
+        # Windows are cut from 16kHz mono audio; silence is kept so window times stay recording times
+        prepared = await self.prepare_audio(audio_file_path, audio_hash, codec='wav', mode='resample')
+        if prepared.path.lower().endswith('.wav'):
+            wav_path, is_temporary = prepared.path, False
+        else:
+            wav_path, is_temporary = ensure_wav(audio_file_path)
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        loop = asyncio.get_running_loop()
+        tasks = []
+        
+        async def transcribe(window):
+            async with semaphore:
+                wav_bytes = await loop.run_in_executor(None, read_window, wav_path, window)
+                name = f"window_{window.index}.wav"
+                offset = window.read_start_frame / window.framerate
+                try:
+                    if limiter is None:
+                        return await self.transcribe_window_timed(wav_bytes, name, offset)
+                    async with limiter:
+                        return await self.transcribe_window_timed(wav_bytes, name, offset)
+                except Exception as e:
+                    logger.warning("Window %d transcription error: %s", window.index, e)
+                    return None
+        
+        try:
+            windows = await loop.run_in_executor(
+                None, plan_windows, wav_path, window_seconds, overlap_seconds
+            )
+            if not windows:
+                return
+            duration = windows[-1].end
+            logger.info("Streaming transcription of %.0fs in %d windows", duration, len(windows))
+            
+            previous_text = ""
+            timeline = TimedTranscript()
+            segmenter = Segmenter()
+            all_segments = []
+            cursor = 0  # characters of the timeline already yielded
+            complete = True
+            next_to_schedule = 0
+            for i, window in enumerate(windows):
+                # Keep a bounded number of windows scheduled ahead of the consumer
+                while next_to_schedule < len(windows) and next_to_schedule <= i + 2 * max_concurrency:
+                    tasks.append(asyncio.ensure_future(transcribe(windows[next_to_schedule])))
+                    next_to_schedule += 1
+                
+                result = await tasks[i]
+                tasks[i] = None
+                if result is None:
+                    complete = False
+                text, segments = result or ("", [])
+                text = text.strip()
+                sentences = []
+                if segments:
+                    # The overlap belongs to the previous window; keep segments centred after it
+                    segments = [s for s in segments if i == 0 or (s['start'] + s['end']) / 2 >= window.start]
+                    for segment in segments:
+                        timeline.append(segment['text'], segment['start'], segment['end'])
+                        sentences.extend(segmenter.feed(segment['text'], segment['start'], segment['end']))
+                    all_segments.extend(segments)
+                else:
+                    new_text = merge_overlap(previous_text, text) if previous_text else text
+                    timeline.append(new_text, window.start, window.end)
+                    sentences.extend(segmenter.feed(new_text))
+                if text:
+                    previous_text = text
+                if i == len(windows) - 1:
+                    sentences.extend(segmenter.flush())
+                
+                progress = window.end / duration if duration else 1.0
+                for sentence, start, end, char_end in timeline.locate(sentences, cursor):
+                    cursor = char_end
+                    yield {'sanskrit': sentence, 'progress': progress, 'total': None, 'start': start, 'end': end}
+            
+            if complete:
+                self.save_transcript(audio_hash, timeline.text, all_segments)
+        finally:
+            for task in tasks:
+                if task is not None:
+                    task.cancel()
+            pending = [task for task in tasks if task is not None]
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            if is_temporary:
+                os.remove(wav_path)
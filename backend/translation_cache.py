@@ -0,0 +1,273 @@
+import os
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Puts and hits are written to SQLite in batches of up to this many rows...
+WRITE_BATCH = 256
+# ...or after at most this many seconds
+WRITE_DELAY = 1.0
+# The disk tier is trimmed (see evict) after this many puts
+EVICT_EVERY_PUTS = 1000
+
+
+class TranslationCache:
+    """
+    Two-tier translation cache: an in-memory LRU in front of a SQLite table.
+
+    Entries are content-addressed by the normalized source line together with
+    the model, prompt and temperature that produced them, so a prompt change
+    never serves a stale translation.
+
+    Only the memory tier is touched on the caller's thread. get_any_async()
+    reads SQLite on the cache's own thread, and puts and last_used updates
+    are written behind by a writer thread in batched transactions, so an
+    event loop calling the cache never waits for the disk.
+    """
+
+    def __init__(self, db_path=None, max_memory_entries=2048,
+                 max_disk_entries=200000, max_age_seconds=180 * 24 * 3600):
+        self.db_path = db_path or os.getenv('TRANSLATION_CACHE_PATH', 'translation_cache.sqlite3')
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.max_age_seconds = max_age_seconds
+
+        # Guards the memory tier and the writes waiting for the writer thread
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._memory = OrderedDict()
+        self._pending = {}  # key -> (value, created_at) not yet written to SQLite
+        self._touched = {}  # key -> time of hits not yet written to last_used
+        self._puts = 0
+        self._closed = False
+
+        # The connection is shared by the reader and writer threads under its own lock
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_translations_last_used ON translations(last_used)")
+        self._db.commit()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='translation-cache')
+        self._writer = threading.Thread(target=self._write_behind, name='translation-cache-writer', daemon=True)
+        self._writer.start()
+
+    @staticmethod
+    def normalize_text(text):
+        """Normalize a Devanagari/Malayalam line so trivial variations share a key"""
+        text = unicodedata.normalize('NFC', text)
+        text = re.sub(r'\s+', ' ', text)
+        # Dandas and trailing punctuation do not change the translation
+        return text.strip(' ।॥.!?,;')
+
+    @classmethod
+    def make_key(cls, text, model, prompt, temperature):
+        payload = json.dumps(
+            [cls.normalize_text(text), model, prompt, temperature],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached translation for key, or None"""
+        return self.get_any([key])
+
+    def get_any(self, keys):
+        """Return the first cached value among keys, counting one hit or miss; may block on SQLite"""
+        value = self.get_memory(keys)
+        if value is None:
+            value = self.get_disk(keys)
+        return value
+
+    async def get_any_async(self, keys):
+        """get_any() for event loop callers: a memory-tier miss is looked up on the cache's thread"""
+        value = self.get_memory(keys)
+        if value is None:
+            value = await asyncio.get_running_loop().run_in_executor(self._reader, self.get_disk, keys)
+        return value
+
+    def get_memory(self, keys):
+        """Return the first value among keys in the memory tier, or None (not counted as a miss)"""
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                entry = self._memory.get(key) or self._pending.get(key)
+                if entry is None:
+                    continue
+                value, created_at = entry
+                if now - created_at <= self.max_age_seconds:
+                    self._remember(key, value, created_at)
+                    self._touch(key, now)
+                    self.memory_hits += 1
+                    return value
+                self._memory.pop(key, None)
+        return None
+
+    def get_disk(self, keys):
+        """Return the first value among keys in SQLite, counting a disk hit or a miss; blocking"""
+        now = time.time()
+        with self._db_lock:
+            for key in keys:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM translations WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.max_age_seconds:
+                    break
+            else:
+                row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self._remember(key, row[0], row[1])
+            self._touch(key, now)
+            self.disk_hits += 1
+        return row[0]
+
+    def put(self, key, value):
+        """Store a successful translation in memory; it reaches SQLite with the writer's next batch"""
+        if not value:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._pending[key] = (value, now)
+            self._touched.pop(key, None)
+            self._wake_writer()
+
+    def _remember(self, key, value, created_at):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _touch(self, key, now):
+        # last_used is only recorded on disk, with the writer's next batch
+        self._touched[key] = now
+        self._wake_writer()
+
+    def _wake_writer(self):
+        # Called under _lock; the writer only needs waking for its first row and a full batch
+        waiting = len(self._pending) + len(self._touched)
+        if waiting == 1 or waiting >= WRITE_BATCH:
+            self._changed.notify()
+
+    def _write_behind(self):
+        while True:
+            with self._lock:
+                while not (self._pending or self._touched or self._closed):
+                    self._changed.wait()
+                # Let more writes gather into the same transaction
+                deadline = time.monotonic() + WRITE_DELAY
+                while not self._closed and len(self._pending) + len(self._touched) < WRITE_BATCH:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+                if self._closed:
+                    return
+            self.flush()
+
+    def flush(self):
+        """Write pending puts and last_used updates to SQLite; blocking"""
+        with self._db_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                touched, self._touched = self._touched, {}
+            if not pending and not touched:
+                return
+            self._db.executemany(
+                "INSERT OR REPLACE INTO translations (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                [(key, value, created_at, created_at) for key, (value, created_at) in pending.items()]
+            )
+            self._db.executemany(
+                "UPDATE translations SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in touched.items()]
+            )
+            self._puts += len(pending)
+            if self._puts >= EVICT_EVERY_PUTS:
+                self._puts = 0
+                self._evict_disk()
+            self._db.commit()
+
+    def evict(self):
+        """Drop expired entries and trim the disk tier to max_disk_entries; blocking"""
+        # Recent puts and hits must count before trimming by last_used
+        self.flush()
+        with self._db_lock:
+            removed = self._evict_disk()
+            self._db.commit()
+        cutoff = time.time() - self.max_age_seconds
+        with self._lock:
+            for key in [k for k, (_, created_at) in self._memory.items() if created_at < cutoff]:
+                del self._memory[key]
+        return removed
+
+    def _evict_disk(self):
+        cutoff = time.time() - self.max_age_seconds
+        removed = self._db.execute(
+            "DELETE FROM translations WHERE created_at < ?", (cutoff,)
+        ).rowcount
+        removed += self._db.execute("""
+            DELETE FROM translations WHERE key IN (
+                SELECT key FROM translations ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_disk_entries,)).rowcount
+        return removed
+
+    def warm_up(self, limit=None):
+        """Evict stale rows, then preload the most recently used entries into memory; blocking"""
+        self.evict()
+        limit = limit or self.max_memory_entries
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT key, value, created_at FROM translations ORDER BY last_used DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        with self._lock:
+            # Insert oldest first so the most recent end up at the LRU head
+            for key, value, created_at in reversed(rows):
+                self._remember(key, value, created_at)
+        return len(rows)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_entries': len(self._memory),
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+            }
+
+    def close(self):
+        """Stop the writer, write what it had not yet and close the database"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._changed.notify()
+        self._writer.join()
+        self._reader.shutdown()
+        self.flush()
+        with self._db_lock:
+            self._db.close()
@@ -0,0 +1,294 @@
+import os
+import re
+import csv
+import json
+import heapq
+import logging
+import unicodedata
+from array import array
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+GLOSSARY_DIR = os.getenv('GLOSSARY_DIR', 'glossaries')
+GLOSSARY_EXTENSIONS = ('.tsv', '.json')
+
+# Lines at least this similar (1 - edit distance / length) are answered from memory
+MATCH_SIMILARITY = float(os.getenv('MEMORY_MATCH_SIMILARITY', 0.9))
+# Longest glossary term looked up inside a line, in words
+MAX_TERM_WORDS = 4
+MAX_PROMPT_TERMS = 12
+# Fuzzy candidates verified per lookup, most shared trigrams first
+MAX_CANDIDATES = 16
+# Entry ids counted per fuzzy lookup; lines made only of very common words
+# give up (possibly missing a match) rather than scan most of the index
+MAX_SCANNED = int(os.getenv('MEMORY_MAX_SCANNED', 2000))
+NGRAM = 3
+# Postings are split by key length in steps of this many characters, so a
+# fuzzy lookup only scans entries whose length is within its edit limit
+LENGTH_BUCKET = 4
+
+# Malayalam atomic chillus and their older consonant + virama (+ ZWJ) spelling
+CHILLUS = str.maketrans({
+    '\u0d7a': '\u0d23\u0d4d', '\u0d7b': '\u0d28\u0d4d', '\u0d7c': '\u0d30\u0d4d',
+    '\u0d7d': '\u0d32\u0d4d', '\u0d7e': '\u0d33\u0d4d', '\u0d7f': '\u0d15\u0d4d',
+})
+# Joiners, Vedic accents, dandas, verse numbers and punctuation do not change a line's meaning
+IGNORED = re.compile(
+    '[\u200b-\u200d\u0951-\u0954\u0964-\u096f\u0d66-\u0d6f0-9'
+    '!-/:-@\\[-`{-~\u2013\u2014\u2018-\u201f\u2026]'
+)
+
+
+def normalize(text):
+    """Matching key for a Devanagari/Malayalam line: spelling variants and punctuation removed"""
+    text = unicodedata.normalize('NFC', text).translate(CHILLUS)
+    text = IGNORED.sub(' ', text)
+    return ' '.join(text.lower().split())
+
+
+def ngrams(text):
+    """Distinct character trigrams of a normalized line, padded so short words count"""
+    padded = f' {text} '
+    return {padded[i:i + NGRAM] for i in range(len(padded) - NGRAM + 1)}
+
+
+def edit_distance(a, b):
+    """Levenshtein distance, bit-parallel over the characters of a (Myers/Hyyro)"""
+    if not a or not b:
+        return len(a) + len(b)
+    if len(a) < len(b):
+        a, b = b, a  # iterate over the shorter string
+    peq = {}
+    for i, char in enumerate(a):
+        peq[char] = peq.get(char, 0) | (1 << i)
+    full = (1 << len(a)) - 1
+    last = 1 << (len(a) - 1)
+    pv, mv, distance = full, 0, len(a)
+    for char in b:
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = (mv | ~(xh | pv)) & full
+        mh = pv & xh
+        if ph & last:
+            distance += 1
+        elif mh & last:
+            distance -= 1
+        ph = (ph << 1) | 1
+        mh = (mh << 1) & full
+        pv = (mh | ~(xv | ph)) & full
+        mv = ph & xv & full
+    return distance
+
+
+class MemoryMatch:
+    """
+    Result of a translation-memory lookup.
+
+    kind is 'exact' or 'fuzzy' when a stored line answers the query (see
+    translation and similarity), or 'terms' when only glossary terms
+    occurring in the line were found, as (source, translation) pairs.
+    """
+
+    __slots__ = ('kind', 'source', 'translation', 'similarity', 'terms')
+
+    def __init__(self, kind, source=None, translation=None, similarity=1.0, terms=()):
+        self.kind = kind
+        self.source = source
+        self.translation = translation
+        self.similarity = similarity
+        self.terms = list(terms)
+
+
+class TranslationMemory:
+    """
+    In-memory index of curated line and term translations.
+
+    Entries come from TSV (source<TAB>translation per line, '#' comments)
+    and JSON glossaries ({source: translation} or a list of objects with
+    'source'/'sanskrit' and 'translation'/'english'). Lines are looked up
+    by their normalized form, then by edit distance among candidates found
+    through a character-trigram inverted index: only the postings of a few
+    rare, non-overlapping trigrams of the line are counted, and at most
+    MAX_SCANNED entry ids, so a lookup stays under a millisecond with
+    200,000 entries (see bench_translation_memory). Failing that, the
+    line's word n-grams are looked up as glossary terms to guide the model.
+    """
+
+    def __init__(self, match_similarity=MATCH_SIMILARITY):
+        self.match_similarity = match_similarity
+        self.sources = []
+        self.keys = []
+        self.translations = []
+        self.exact = {}  # normalized source -> entry id
+        self.postings = {}  # (trigram, length bucket) -> array of entry ids, ascending
+        self.frequency = {}  # trigram -> entries containing it
+        self.lengths = array('I')
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, source, translation):
+        """Add one entry; a later entry for the same normalized source replaces it"""
+        key = normalize(source)
+        translation = (translation or '').strip()
+        if not key or not translation:
+            return
+        entry = self.exact.get(key)
+        if entry is not None:
+            self.translations[entry] = translation
+            return
+        entry = len(self.keys)
+        self.exact[key] = entry
+        self.sources.append(source.strip())
+        self.keys.append(key)
+        self.translations.append(translation)
+        self.lengths.append(len(key))
+        bucket = len(key) // LENGTH_BUCKET
+        frequency = self.frequency
+        for gram in ngrams(key):
+            frequency[gram] = frequency.get(gram, 0) + 1
+            posting = self.postings.get((gram, bucket))
+            if posting is None:
+                posting = self.postings[gram, bucket] = array('I')
+            posting.append(entry)
+
+    def load(self, path):
+        """Load a .tsv or .json glossary; returns the number of entries read"""
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.endswith('.json'):
+                data = json.load(f)
+                if isinstance(data, dict):
+                    pairs = data.items()
+                else:
+                    pairs = [
+                        (item.get('source') or item.get('sanskrit'), item.get('translation') or item.get('english'))
+                        for item in data if isinstance(item, dict)
+                    ]
+            else:
+                pairs = [
+                    row[:2] for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE)
+                    if len(row) >= 2 and not row[0].lstrip().startswith('#')
+                ]
+        loaded = 0
+        for source, translation in pairs:
+            if isinstance(source, str) and isinstance(translation, str):
+                self.add(source, translation)
+                loaded += 1
+        return loaded
+
+    def load_directory(self, directory=None):
+        """Load every glossary in directory (GLOSSARY_DIR by default), if it exists"""
+        directory = directory or GLOSSARY_DIR
+        if not os.path.isdir(directory):
+            return self
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(GLOSSARY_EXTENSIONS):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                logger.info("Loaded %d glossary entries from %s", self.load(path), path)
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping glossary %s: %s", path, e)
+        return self
+
+    def lookup(self, text):
+        """Return a MemoryMatch for text, or None when the memory knows nothing about it"""
+        if not self.keys:
+            return None
+        key = normalize(text)
+        if not key:
+            return None
+        entry = self.exact.get(key)
+        if entry is not None:
+            return MemoryMatch('exact', self.sources[entry], self.translations[entry])
+        entry, similarity = self._nearest(key)
+        if entry is not None:
+            return MemoryMatch('fuzzy', self.sources[entry], self.translations[entry], similarity)
+        terms = self._terms(key)
+        if terms:
+            return MemoryMatch('terms', terms=terms)
+        return None
+
+    def _nearest(self, key):
+        """The most similar entry at or above match_similarity, as (entry, similarity)"""
+        limit = int((1 - self.match_similarity) * len(key))
+        if limit == 0:
+            return None, 0.0
+        # Each edit breaks at most one of a set of non-overlapping trigrams, so a
+        # match keeps all but `limit` of them: pick the rarest such trigrams
+        padded = f' {key} '
+        grams = [padded[i:i + NGRAM] for i in range(len(padded) - NGRAM + 1)]
+        frequency = self.frequency
+        sizes = [frequency.get(gram, 0) for gram in grams]
+        taken = bytearray(len(padded))
+        pieces = []
+        for i in sorted(range(len(grams)), key=sizes.__getitem__):
+            if taken[i] or taken[i + NGRAM - 1] or grams[i] in pieces:
+                continue
+            taken[i:i + NGRAM] = b'\x01' * NGRAM
+            pieces.append(grams[i])
+
+        buckets = range((len(key) - limit) // LENGTH_BUCKET, (len(key) + limit) // LENGTH_BUCKET + 1)
+        postings = self.postings
+        hits = Counter()
+        scanned = counted = 0
+        for gram in pieces:
+            found = [postings[gram, bucket] for bucket in buckets if (gram, bucket) in postings]
+            size = sum(map(len, found))
+            if scanned + size > MAX_SCANNED:
+                continue
+            for posting in found:
+                hits.update(posting)
+            scanned += size
+            counted += 1
+        if counted <= limit:
+            return None, 0.0  # too few rare trigrams to be sure of finding a match
+
+        candidates = heapq.nlargest(
+            MAX_CANDIDATES, [entry for entry, shared in hits.items() if shared >= counted - limit],
+            key=hits.__getitem__
+        )
+        best, best_distance = None, limit + 1
+        lengths, keys = self.lengths, self.keys
+        query_grams = required = None
+        for entry in candidates:
+            # Beating best_distance allows at most best_distance - 1 missing pieces
+            if hits[entry] < counted - (best_distance - 1):
+                break
+            if abs(lengths[entry] - len(key)) >= best_distance:
+                continue
+            candidate = keys[entry]
+            if query_grams is None:
+                query_grams = ngrams(key)
+                # Each edit destroys at most NGRAM of all the line's trigrams
+                required = len(query_grams) - NGRAM * limit
+            if len(query_grams & ngrams(candidate)) < required:
+                continue
+            distance = edit_distance(key, candidate)
+            if distance < best_distance:
+                best, best_distance = entry, distance
+                if distance == 1:
+                    break
+        if best is None:
+            return None, 0.0
+        return best, 1 - best_distance / max(len(key), lengths[best])
+
+    def _terms(self, key):
+        """Glossary entries found as whole-word phrases in key, longest first"""
+        words = key.split()
+        found = []
+        covered = set()
+        for size in range(min(MAX_TERM_WORDS, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                span = range(start, start + size)
+                if covered.intersection(span):
+                    continue
+                entry = self.exact.get(' '.join(words[start:start + size]))
+                if entry is not None:
+                    found.append((self.sources[entry], self.translations[entry]))
+                    covered.update(span)
+                    if len(found) >= MAX_PROMPT_TERMS:
+                        return found
+        return found
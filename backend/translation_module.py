@@ -1,92 +1,320 @@
 import os
+import re
+import json
+import time
 import asyncio
+import logging
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
+from translation_cache import TranslationCache
+from translation_memory import TranslationMemory
+from metrics import count, span
+from scheduler import RequestScheduler
+
+logger = logging.getLogger(__name__)
+
+# Overridden with OPENROUTER_BASE_URL, e.g. to point at a local mock server
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+PRIMARY_MODEL = "anthropic/claude-3.5-sonnet"
+PRIMARY_TEMPERATURE = 0.3
+SYSTEM_PROMPT = """You are an expert Sanskrit translator specializing in devotional and spiritual texts. 
+
+Your task:
+1. Translate the given Sanskrit text to natural, flowing English
+2. Focus on the devotional and spiritual meaning
+3. Keep translations concise but meaningful
+4. If the text appears to be garbled or unclear, provide the best possible interpretation
+5. Respond with ONLY the English translation, no explanations
+
+Context: This is likely devotional content related to Hindu deities like Krishna, Vishnu, or other divine beings."""
+
+# Used instead of SYSTEM_PROMPT when the translation memory supplies glossary terms for a line
+GLOSSARY_PROMPT = """You translate devotional Sanskrit (Kathakali lyrics about Krishna, Vishnu and other deities) into concise, natural English. Use the glossary's renderings for the terms it lists. Respond with ONLY the English translation."""
+
+FALLBACK_MODEL = "openai/gpt-4o-mini"
+FALLBACK_TEMPERATURE = 0.2
+FALLBACK_PROMPT = "You are a Sanskrit translator. Translate the given Sanskrit text to English. Focus on devotional meaning. Respond with only the translation."
+
+BATCH_PROMPT = SYSTEM_PROMPT.replace(
+    "5. Respond with ONLY the English translation, no explanations",
+    "5. You will receive numbered lines. Respond with ONLY a JSON array of strings, "
+    "one English translation per input line, in the same order, no explanations"
+)
+# Indic scripts tokenize at roughly two characters per token
+CHARS_PER_TOKEN = 2
+OUTPUT_TOKENS_PER_LINE = 60
+# Seconds allowed for one line (all retries and the fallback) or one batch request
+TRANSLATION_DEADLINE = float(os.getenv('TRANSLATION_DEADLINE', 20))
+BATCH_DEADLINE = 60.0
+# Placeholders returned instead of a translation when every model failed
+ERROR_PREFIXES = (
+    "Authentication error: ", "Credit error - Original: ", "Network error - Original: ",
+    "Translation unavailable: ", "Unable to translate: "
+)
+
+def is_error(translation):
+    """True for the placeholder text returned when a line could not be translated"""
+    return translation.startswith(ERROR_PREFIXES)
+
+
+class PartialTranslation:
+    """The text of a streaming translation so far, for showing it before it completes"""
 
-class TranslationModule:
     def __init__(self):
+        self.text = ""
+        self.changed = asyncio.Event()
+
+    def append(self, delta):
+        self.text += delta
+        self.changed.set()
+
+    def reset(self):
+        """Start over, e.g. when a request is retried"""
+        self.text = ""
+        self.changed.set()
+
+
+class TranslationModule:
+    def __init__(self, http_client=None, cache=None, scheduler=None, memory=None):
         load_dotenv()
         
         api_key = os.getenv('KAPI')
         if not api_key:
             raise ValueError("OPENROUTER_API_KEY environment variable is not set")
         
+        # http_client is the runtime's shared pooled client; None builds a private one
         self.client = AsyncOpenAI(
-            base_url="https://openrouter.ai/api/v1",
+            base_url=os.getenv('OPENROUTER_BASE_URL', OPENROUTER_BASE_URL),
             api_key=api_key,
+            http_client=http_client,
+            # Retries, backoff and rate limiting are handled by the scheduler
+            max_retries=0,
             default_headers={
                 "HTTP-Referer": "http://localhost:5000",
                 "X-Title": "Sanskrit Translator"
             }
         )
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+        self.cache = cache if cache is not None else TranslationCache()
+        # Curated glossaries from GLOSSARY_DIR; empty (a no-op) when there are none
+        self.memory = memory if memory is not None else TranslationMemory().load_directory()
+        # normalized text -> future of the translation currently being fetched
+        self._inflight = {}
+    
+    def remembered(self, sanskrit_text):
+        """
+        Look a line up in the translation memory.
+
+        Returns (translation, terms): a stored translation for an exact or
+        near-identical line, or else the glossary terms found in it (either
+        may be None).
+        """
+        match = self.memory.lookup(sanskrit_text)
+        count('memory_matches', kind=match.kind if match is not None else 'none')
+        if match is None:
+            return None, None
+        if match.kind == 'terms':
+            return None, match.terms
+        logger.debug("Memory %s match (%.2f): %s", match.kind, match.similarity, match.source)
+        return match.translation, None
+    
+    @staticmethod
+    def _glossary_prompt(terms):
+        glossary = "\n".join(f"{source} = {translation}" for source, translation in terms)
+        return f"{GLOSSARY_PROMPT}\n\nGlossary:\n{glossary}"
+    
+    def _primary_key(self, sanskrit_text, terms=None):
+        prompt = self._glossary_prompt(terms) if terms else SYSTEM_PROMPT
+        return self.cache.make_key(sanskrit_text, PRIMARY_MODEL, prompt, PRIMARY_TEMPERATURE)
     
-    async def translate_sentence(self, sanskrit_text):
+    async def cached_translation(self, sanskrit_text, terms=None):
+        """Return a cached translation from the primary or fallback model, or None"""
+        translation = await self.cache.get_any_async([
+            *([self._primary_key(sanskrit_text, terms)] if terms else []),
+            self.cache.make_key(sanskrit_text, PRIMARY_MODEL, SYSTEM_PROMPT, PRIMARY_TEMPERATURE),
+            self.cache.make_key(sanskrit_text, PRIMARY_MODEL, BATCH_PROMPT, PRIMARY_TEMPERATURE),
+            self.cache.make_key(sanskrit_text, FALLBACK_MODEL, FALLBACK_PROMPT, FALLBACK_TEMPERATURE)
+        ])
+        count('cache_misses' if translation is None else 'cache_hits')
+        return translation
+    
+    @staticmethod
+    def _record_usage(response, model, call):
+        """Count the tokens a chat response reports and attach them to its span"""
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return
+        count('tokens', usage.prompt_tokens or 0, model=model, kind='prompt')
+        count('tokens', usage.completion_tokens or 0, model=model, kind='completion')
+        call.fields.update(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+    
+    def _claim(self, key):
+        """
+        Return (future, owner) for an in-flight translation of key.
+
+        The first caller becomes the owner and must resolve the future;
+        later callers for the same text simply wait on it.
+        """
+        loop = asyncio.get_running_loop()
+        future = self._inflight.get(key)
+        if future is not None and not future.done() and future.get_loop() is loop:
+            return future, False
+        future = loop.create_future()
+        self._inflight[key] = future
+        return future, True
+    
+    def _release(self, key, future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+    
+    async def _await_coalesced(self, future):
+        """Wait for another caller's translation; None if that caller was cancelled"""
+        # asyncio.wait does not propagate the owner's cancellation to us
+        await asyncio.wait([future])
+        if future.cancelled():
+            return None
+        return future.result()
+    
+    async def translate_sentence(self, sanskrit_text, partial=None):
         """
         Translate Sanskrit text to English using OpenRouter API
+
+        Lines found in the translation memory are answered locally; when
+        it only knows some of a line's terms, they are sent with a shorter
+        glossary prompt. With a PartialTranslation, the primary model's
+        answer is streamed into it token by token as it arrives.
+        Remembered, cached and coalesced lines complete without any partial
+        text.
         """
+        remembered, terms = self.remembered(sanskrit_text)
+        if remembered is not None:
+            return remembered
+        
+        cached = await self.cached_translation(sanskrit_text, terms)
+        if cached is not None:
+            return cached
+        
+        # Identical lines requested concurrently share a single API call
+        key = TranslationCache.normalize_text(sanskrit_text)
+        while True:
+            future, owner = self._claim(key)
+            if owner:
+                break
+            translation = await self._await_coalesced(future)
+            if translation is not None:
+                return translation
+        
         try:
-            print(f"Translating: {sanskrit_text[:50]}...")
-            
-            response = await self.client.chat.completions.create(
-                model="anthropic/claude-3.5-sonnet",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": """You are an expert Sanskrit translator specializing in devotional and spiritual texts. 
-
-Your task:
-1. Translate the given Sanskrit text to natural, flowing English
-2. Focus on the devotional and spiritual meaning
-3. Keep translations concise but meaningful
-4. If the text appears to be garbled or unclear, provide the best possible interpretation
-5. Respond with ONLY the English translation, no explanations
+            translation = await self._translate_single(sanskrit_text, partial, terms)
+            future.set_result(translation)
+            return translation
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self._release(key, future)
+    
+    async def _translate_single(self, sanskrit_text, partial=None, terms=None):
+        """
+        Translate one line with the primary model.
 
-Context: This is likely devotional content related to Hindu deities like Krishna, Vishnu, or other divine beings."""
-                    },
-                    {
-                        "role": "user", 
-                        "content": f"Translate this Sanskrit text to English: {sanskrit_text}"
-                    }
-                ],
-                max_tokens=200,
-                temperature=0.3
+        The fallback model is raced against the primary when it is slower
+        than usual, and used alone when the primary fails or its circuit is
+        open; the first answer wins.
+        """
+        try:
+            logger.debug("Translating: %s...", sanskrit_text[:50])
+            
+            model, translation = await self.scheduler.hedged(
+                (PRIMARY_MODEL, lambda: self._request_primary(sanskrit_text, partial, terms)),
+                (FALLBACK_MODEL, lambda: self._request_fallback(sanskrit_text)),
+                deadline=TRANSLATION_DEADLINE
             )
+            logger.debug("Translation: %s", translation)
             
-            translation = response.choices[0].message.content.strip()
-            print(f"Translation: {translation}")
+            # Only successful model output is cached, never the error strings below
+            if model == PRIMARY_MODEL:
+                key = self._primary_key(sanskrit_text, terms)
+            else:
+                count('fallbacks', stage='translation')
+                key = self.cache.make_key(sanskrit_text, FALLBACK_MODEL, FALLBACK_PROMPT, FALLBACK_TEMPERATURE)
+            self.cache.put(key, translation)
             return translation
             
         except Exception as e:
             error_msg = str(e)
-            print(f"Translation error: {error_msg}")
+            logger.warning("Translation error: %s", error_msg)
             
             # Provide specific error handling
             if "401" in error_msg or "unauthorized" in error_msg.lower():
-                print("❌ Authentication failed - check your OPENROUTER_API_KEY")
+                logger.error("Authentication failed - check your OPENROUTER_API_KEY")
                 return f"Authentication error: {sanskrit_text}"
             elif "insufficient" in error_msg.lower() or "credits" in error_msg.lower():
-                print("❌ Insufficient credits in OpenRouter account") 
+                logger.error("Insufficient credits in OpenRouter account")
                 return f"Credit error - Original: {sanskrit_text}"
             elif "connection" in error_msg.lower() or "timeout" in error_msg.lower():
-                print("❌ Network connection issue")
+                logger.error("Network connection issue")
                 return f"Network error - Original: {sanskrit_text}"
-            
-            # Try fallback model
+            return f"Translation unavailable: {sanskrit_text}"
+    
+    async def _request_primary(self, sanskrit_text, partial=None, terms=None):
+        """One primary-model request; the scheduler decides on retries"""
+        messages = [
+            {
+                "role": "system", 
+                "content": self._glossary_prompt(terms) if terms else SYSTEM_PROMPT
+            },
+            {
+                "role": "user", 
+                "content": f"Translate this Sanskrit text to English: {sanskrit_text}"
+            }
+        ]
+        if partial is not None:
+            return await self._stream_primary(messages, partial)
+        with span('translation', model=PRIMARY_MODEL, path='primary') as call:
+            response = await self.client.chat.completions.create(
+                model=PRIMARY_MODEL,
+                messages=messages,
+                max_tokens=200,
+                temperature=PRIMARY_TEMPERATURE
+            )
+            self._record_usage(response, PRIMARY_MODEL, call)
+        return response.choices[0].message.content.strip()
+    
+    async def _stream_primary(self, messages, partial):
+        """Stream one primary-model answer into partial and return the full text"""
+        partial.reset()
+        with span('translation', model=PRIMARY_MODEL, path='stream') as call:
+            started = time.perf_counter()
+            stream = await self.client.chat.completions.create(
+                model=PRIMARY_MODEL,
+                messages=messages,
+                max_tokens=200,
+                temperature=PRIMARY_TEMPERATURE,
+                stream=True
+            )
             try:
-                return await self.fallback_translation(sanskrit_text)
-            except Exception as fallback_error:
-                print(f"Fallback translation failed: {fallback_error}")
-                return f"Translation unavailable: {sanskrit_text}"
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if not partial.text:
+                            call.fields['first_token_ms'] = round((time.perf_counter() - started) * 1000, 1)
+                        partial.append(chunk.choices[0].delta.content)
+                    # OpenRouter reports usage on the final chunk
+                    if getattr(chunk, 'usage', None) is not None:
+                        self._record_usage(chunk, PRIMARY_MODEL, call)
+            finally:
+                await stream.close()
+        return partial.text.strip()
     
-    async def fallback_translation(self, sanskrit_text):
-        """Fallback translation using a different model"""
-        try:
+    async def _request_fallback(self, sanskrit_text):
+        """One fallback-model request"""
+        with span('translation', model=FALLBACK_MODEL, path='fallback') as call:
             response = await self.client.chat.completions.create(
-                model="openai/gpt-4o-mini",
+                model=FALLBACK_MODEL,
                 messages=[
                     {
                         "role": "system",
-                        "content": "You are a Sanskrit translator. Translate the given Sanskrit text to English. Focus on devotional meaning. Respond with only the translation."
+                        "content": FALLBACK_PROMPT
                     },
                     {
                         "role": "user",
@@ -94,19 +322,159 @@ Context: This is likely devotional content related to Hindu deities like Krishna
                     }
                 ],
                 max_tokens=150,
-                temperature=0.2
+                temperature=FALLBACK_TEMPERATURE
             )
+            self._record_usage(response, FALLBACK_MODEL, call)
+        return response.choices[0].message.content.strip()
+    
+    async def batch_translate(self, sentences, max_batch_tokens=1500, max_concurrency=4):
+        """
+        Translate multiple sentences.
+
+        Remembered, cached and duplicate sentences are resolved without a new request,
+        the rest are packed into multi-line requests of at most
+        max_batch_tokens input tokens and sent concurrently.
+        """
+        keys = [TranslationCache.normalize_text(sentence) for sentence in sentences]
+        resolved = {}
+        waiting = {}
+        owned = {}
+        
+        for sentence, key in zip(sentences, keys):
+            if key in resolved or key in waiting or key in owned:
+                continue
+            # Glossary terms only help single-line prompts; batches use BATCH_PROMPT as is
+            remembered, _ = self.remembered(sentence)
+            if remembered is not None:
+                resolved[key] = remembered
+                continue
+            cached = await self.cached_translation(sentence)
+            if cached is not None:
+                resolved[key] = cached
+                continue
+            future, owner = self._claim(key)
+            if owner:
+                owned[key] = (sentence, future)
+            else:
+                waiting[key] = future
+        
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        batches = self._pack_batches([sentence for sentence, _ in owned.values()], max_batch_tokens)
+        
+        async def run_batch(batch):
+            async with semaphore:
+                translations = await self._translate_batch(batch)
+            for sentence, translation in zip(batch, translations):
+                key = TranslationCache.normalize_text(sentence)
+                _, future = owned[key]
+                resolved[key] = translation
+                if not future.done():
+                    future.set_result(translation)
+                self._release(key, future)
+        
+        try:
+            await asyncio.gather(*(run_batch(batch) for batch in batches))
+        finally:
+            # Release anything left unresolved (errors or cancellation)
+            for key, (_, future) in owned.items():
+                if not future.done():
+                    future.cancel()
+                self._release(key, future)
+        
+        for key, future in waiting.items():
+            translation = await self._await_coalesced(future)
+            if translation is None:
+                translation = await self.translate_sentence(sentences[keys.index(key)])
+            resolved[key] = translation
+        
+        return [resolved[key] for key in keys]
+    
+    @staticmethod
+    def _estimate_tokens(text):
+        return len(text) // CHARS_PER_TOKEN + 1
+    
+    def _pack_batches(self, sentences, max_batch_tokens):
+        """Greedily pack sentences into batches under the input token budget"""
+        batches = []
+        current = []
+        current_tokens = 0
+        for sentence in sentences:
+            tokens = self._estimate_tokens(sentence)
+            if current and current_tokens + tokens > max_batch_tokens:
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(sentence)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+    
+    async def _translate_batch(self, batch):
+        """
+        Translate a batch of lines in one chat request.
+
+        Falls back to one request per line if the model's answer is not a
+        JSON array with exactly one string per input line.
+        """
+        if len(batch) == 1:
+            return [await self._translate_single(batch[0])]
+        
+        numbered = "\n".join(f"{i + 1}. {sentence}" for i, sentence in enumerate(batch))
+        try:
+            logger.debug("Batch translating %d lines...", len(batch))
             
-            return response.choices[0].message.content.strip()
+            async def request():
+                with span('translation', model=PRIMARY_MODEL, path='batch', lines=len(batch)) as call:
+                    response = await self.client.chat.completions.create(
+                        model=PRIMARY_MODEL,
+                        messages=[
+                            {
+                                "role": "system",
+                                "content": BATCH_PROMPT
+                            },
+                            {
+                                "role": "user",
+                                "content": f"Translate these Sanskrit lines to English:\n{numbered}"
+                            }
+                        ],
+                        max_tokens=OUTPUT_TOKENS_PER_LINE * len(batch) + 50,
+                        temperature=PRIMARY_TEMPERATURE
+                    )
+                    self._record_usage(response, PRIMARY_MODEL, call)
+                return response
             
+            response = await self.scheduler.call(
+                PRIMARY_MODEL, request, deadline=BATCH_DEADLINE, track_latency=False
+            )
+            translations = self._parse_batch_response(response.choices[0].message.content, len(batch))
         except Exception as e:
-            print(f"Fallback translation error: {e}")
-            return f"Unable to translate: {sanskrit_text}"
+            logger.warning("Batch translation error: %s", e)
+            translations = None
+        
+        if translations is None:
+            logger.warning("Batch response unusable, translating lines individually")
+            count('fallbacks', stage='batch')
+            return list(await asyncio.gather(*(self._translate_single(sentence) for sentence in batch)))
+        
+        for sentence, translation in zip(batch, translations):
+            self.cache.put(
+                self.cache.make_key(sentence, PRIMARY_MODEL, BATCH_PROMPT, PRIMARY_TEMPERATURE),
+                translation
+            )
+        return translations
     
-    async def batch_translate(self, sentences):
-        """Translate multiple sentences"""
-        translations = []
-        for sentence in sentences:
-            translation = await self.translate_sentence(sentence)
-            translations.append(translation)
-        return translations
\ No newline at end of file
+    @staticmethod
+    def _parse_batch_response(content, expected_count):
+        """Extract the JSON array of translations, or None if it does not match the batch"""
+        match = re.search(r'\[.*\]', content or "", re.DOTALL)
+        if not match:
+            return None
+        try:
+            translations = json.loads(match.group(0))
+        except json.JSONDecodeError:
+            return None
+        if (not isinstance(translations, list) or len(translations) != expected_count
+                or not all(isinstance(t, str) and t.strip() for t in translations)):
+            return None
+        return [t.strip() for t in translations]